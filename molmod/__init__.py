@@ -55,6 +55,7 @@ np.seterr(divide='raise', invalid='raise')
 from molmod.binning import *
 from molmod.clusters import *
 from molmod.constants import *
+from molmod.ewald import *
 from molmod.graphs import *
 from molmod.ic import *
 from molmod.log import *
@@ -66,6 +67,7 @@ from molmod.quaternions import *
 from molmod.randomize import *
 from molmod.similarity import *
 from molmod.symmetry import *
+from molmod.topology import *
 from molmod.toyff import *
 from molmod.transformations import *
 from molmod.unit_cells import *
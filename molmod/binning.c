@@ -0,0 +1,199 @@
+// MolMod is a collection of molecular modelling tools for python.
+// Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+// for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+// reserved unless otherwise stated.
+//
+// This file is part of MolMod.
+//
+// MolMod is free software; you can redistribute it and/or
+// modify it under the terms of the GNU General Public License
+// as published by the Free Software Foundation; either version 3
+// of the License, or (at your option) any later version.
+//
+// MolMod is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program; if not, see <http://www.gnu.org/licenses/>
+//
+// --
+
+
+
+#include "binning.h"
+
+#include <math.h>
+
+#include "common.h"
+
+
+void binning_counting_sort(size_t n, long *ids, size_t ncell, long *order, long *offsets) {
+  /* Sort the items by their cell index ids[i] in O(n + ncell) time.
+
+     On return, the items in cell c are order[offsets[c]:offsets[c+1]], in
+     increasing order. The array offsets must have ncell+1 elements. */
+  size_t i, c;
+
+  for (c = 0; c <= ncell; c++) {
+    offsets[c] = 0;
+  }
+  for (i = 0; i < n; i++) {
+    offsets[ids[i]+1]++;
+  }
+  for (c = 0; c < ncell; c++) {
+    offsets[c+1] += offsets[c];
+  }
+  for (i = 0; i < n; i++) {
+    order[offsets[ids[i]]] = i;
+    offsets[ids[i]]++;
+  }
+  /* the offsets are shifted by one cell after filling the order array */
+  for (c = ncell; c > 0; c--) {
+    offsets[c] = offsets[c-1];
+  }
+  offsets[0] = 0;
+}
+
+
+size_t binning_cell_pairs(
+  size_t ncell0, long *keys0, size_t nstencil, long *stencil,
+  long *key_min1, long *shape1, long *lookup1, int periodic,
+  double *integer_matrix, double *integer_reciprocal, size_t *icell0,
+  size_t ncell_pair_max, long *cell_pairs
+) {
+  /* Find the pairs of (non-empty) cells that must be searched for pairs.
+
+     For each cell in keys0, starting from *icell0, all shifts in the stencil
+     are applied to its key. In case of periodic boundary conditions, the
+     shifted key is wrapped into the central integer cell. The cell index of
+     the result is looked up in the dense table lookup1, with -1 for empty
+     cells. On return, *icell0 is the first unprocessed cell and the return
+     value is the number of cell pairs written. */
+  size_t ncell_pair, s;
+  long key[3], c1, k;
+  double frac[3], image[3];
+
+  ncell_pair = 0;
+  while (*icell0 < ncell0) {
+    if (ncell_pair + nstencil > ncell_pair_max) break;
+    for (s = 0; s < nstencil; s++) {
+      key[0] = keys0[3*(*icell0)] + stencil[3*s];
+      key[1] = keys0[3*(*icell0)+1] + stencil[3*s+1];
+      key[2] = keys0[3*(*icell0)+2] + stencil[3*s+2];
+      if (periodic) {
+        /* See UnitCell.shortest_vector */
+        dot_matrixT_vector_did(integer_reciprocal, key, frac);
+        frac[0] = floor(frac[0] + 0.5);
+        frac[1] = floor(frac[1] + 0.5);
+        frac[2] = floor(frac[2] + 0.5);
+        dot_matrix_vector_ddd(integer_matrix, frac, image);
+        key[0] -= lround(image[0]);
+        key[1] -= lround(image[1]);
+        key[2] -= lround(image[2]);
+      }
+      key[0] -= key_min1[0];
+      key[1] -= key_min1[1];
+      key[2] -= key_min1[2];
+      if ((key[0] < 0) || (key[0] >= shape1[0]) ||
+          (key[1] < 0) || (key[1] >= shape1[1]) ||
+          (key[2] < 0) || (key[2] >= shape1[2])) continue;
+      k = (key[0]*shape1[1] + key[1])*shape1[2] + key[2];
+      c1 = lookup1[k];
+      if (c1 < 0) continue;
+      cell_pairs[2*ncell_pair] = *icell0;
+      cell_pairs[2*ncell_pair+1] = c1;
+      ncell_pair++;
+    }
+    (*icell0)++;
+  }
+  return ncell_pair;
+}
+
+
+static double closest_image(double *delta, size_t nimage, double *images) {
+  /* Replace delta by the shortest of delta - images[k] (and delta itself) and
+     return its norm. */
+  size_t k;
+  double dsq, dsq_best, tmp[3], best[3];
+
+  best[0] = delta[0];
+  best[1] = delta[1];
+  best[2] = delta[2];
+  dsq_best = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+  for (k = 0; k < nimage; k++) {
+    tmp[0] = delta[0] - images[3*k];
+    tmp[1] = delta[1] - images[3*k+1];
+    tmp[2] = delta[2] - images[3*k+2];
+    dsq = tmp[0]*tmp[0] + tmp[1]*tmp[1] + tmp[2]*tmp[2];
+    if (dsq < dsq_best) {
+      dsq_best = dsq;
+      best[0] = tmp[0];
+      best[1] = tmp[1];
+      best[2] = tmp[2];
+    }
+  }
+  delta[0] = best[0];
+  delta[1] = best[1];
+  delta[2] = best[2];
+  return norm(delta);
+}
+
+
+size_t binning_pairs(
+  double *cor0, long *order0, long *offsets0,
+  double *cor1, long *order1, long *offsets1,
+  size_t ncell_pair, long *cell_pairs, size_t *icell_pair, int intra,
+  double cutoff, int periodic, double *matrix, double *reciprocal,
+  size_t nimage, double *images,
+  size_t npair_max, long *pairs, double *deltas, double *distances
+) {
+  /* Compute all pairs below the cutoff for a list of pairs of cells.
+
+     The atoms in cell c are order[offsets[c]:offsets[c+1]]. The cell pairs
+     are processed starting from *icell_pair until all are done or until the
+     next cell pair might not fit in the output buffers. On return,
+     *icell_pair is the index of the first unprocessed cell pair and the
+     return value is the number of pairs written.
+
+     In case of periodic boundary conditions, the relative vectors are first
+     wrapped into the unit cell. When nimage > 0, the shortest vector is then
+     selected among the given images, for an exact minimum image convention
+     in a reduced cell. */
+  size_t npair, n0, n1;
+  long c0, c1, k0, k1, i0, i1;
+  double d;
+
+  npair = 0;
+  while (*icell_pair < ncell_pair) {
+    c0 = cell_pairs[2*(*icell_pair)];
+    c1 = cell_pairs[2*(*icell_pair)+1];
+    n0 = offsets0[c0+1] - offsets0[c0];
+    n1 = offsets1[c1+1] - offsets1[c1];
+    if (npair + n0*n1 > npair_max) break;
+    for (k0 = offsets0[c0]; k0 < offsets0[c0+1]; k0++) {
+      i0 = order0[k0];
+      for (k1 = offsets1[c1]; k1 < offsets1[c1+1]; k1++) {
+        i1 = order1[k1];
+        if (intra && (i1 >= i0)) continue;
+        if (periodic) {
+          d = distance_delta_periodic(cor1 + 3*i1, cor0 + 3*i0, deltas + 3*npair, matrix, reciprocal);
+          if (nimage > 0) {
+            d = closest_image(deltas + 3*npair, nimage, images);
+          }
+        } else {
+          d = distance_delta(cor1 + 3*i1, cor0 + 3*i0, deltas + 3*npair);
+        }
+        if (d <= cutoff) {
+          pairs[2*npair] = i0;
+          pairs[2*npair+1] = i1;
+          distances[npair] = d;
+          npair++;
+        }
+      }
+    }
+    (*icell_pair)++;
+  }
+  return npair;
+}
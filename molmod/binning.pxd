@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# MolMod is a collection of molecular modelling tools for python.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MolMod.
+#
+# MolMod is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# MolMod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+cdef extern from "binning.h" nogil:
+    void binning_counting_sort(size_t n, long *ids, size_t ncell, long *order, long *offsets)
+
+    size_t binning_cell_pairs(
+      size_t ncell0, long *keys0, size_t nstencil, long *stencil,
+      long *key_min1, long *shape1, long *lookup1, int periodic,
+      double *integer_matrix, double *integer_reciprocal, size_t *icell0,
+      size_t ncell_pair_max, long *cell_pairs)
+
+    size_t binning_pairs(
+      double *cor0, long *order0, long *offsets0,
+      double *cor1, long *order1, long *offsets1,
+      size_t ncell_pair, long *cell_pairs, size_t *icell_pair, int intra,
+      double cutoff, int periodic, double *matrix, double *reciprocal,
+      size_t nimage, double *images,
+      size_t npair_max, long *pairs, double *deltas, double *distances)
@@ -40,11 +40,22 @@ import numpy as np
 from molmod.unit_cells import UnitCell
 
 
-__all__ = ["PairSearchIntra", "PairSearchInter"]
+__all__ = ["PairSearchIntra", "PairSearchInter", "NeighborList"]
 
 
 class Binning(object):
-    """Division of coordinates in regular bins"""
+    """Division of coordinates in regular bins
+
+       The bins are stored as flat integer arrays. The indexes of the
+       coordinates in the c-th non-empty bin are
+       ``order[offsets[c]:offsets[c+1]]`` and the integer coordinates of that
+       bin are ``keys[c]``. The non-empty bins are sorted by their linear
+       index in a dense grid that encloses all bins.
+    """
+    # When the dense grid of bins has more bins than this factor times the
+    # number of coordinates, the empty bins are discarded before sorting.
+    max_dense_factor = 8
+
     def __init__(self, coordinates, cutoff, grid_cell, integer_cell=None):
         """Initialize a Binning object
 
@@ -62,22 +73,49 @@ class Binning(object):
             | ``integer_cell``  --  the periodicity of the system in terms if
                                     integer grid cells.
         """
+        from molmod.ext import binning_counting_sort
+
         self.grid_cell = grid_cell
         self.integer_cell = integer_cell
 
         # setup the bins
-        self._bins = {}
-
-        fractional = grid_cell.to_fractional(coordinates)
-        for i in range(len(coordinates)):
-            key = tuple(fractional[i].astype(int))
-            if integer_cell is not None:
-                key = self.wrap_key(key)
-            bin = self._bins.get(key)
-            if bin is None:
-                bin = []
-                self._bins[key] = bin
-            bin.append((i, coordinates[i]))
+        coordinates = np.asarray(coordinates, float).reshape(-1, 3)
+        keys = np.floor(grid_cell.to_fractional(coordinates)).astype(int)
+        if integer_cell is not None:
+            keys = self.wrap_keys(keys)
+        if len(keys) > 0:
+            self.key_min = keys.min(axis=0)
+            self.shape = keys.max(axis=0) - self.key_min + 1
+        else:
+            self.key_min = np.zeros(3, int)
+            self.shape = np.ones(3, int)
+        if np.prod(self.shape.astype(float)) > 2**62:
+            raise ValueError("The coordinates span too many bins.")
+        ids = np.ravel_multi_index((keys - self.key_min).T, self.shape)
+
+        # counting sort of the coordinates, only keeping non-empty bins
+        ncell = np.prod(self.shape)
+        if ncell > self.max_dense_factor*len(ids):
+            self.cell_ids, ids = np.unique(ids, return_inverse=True)
+            ncell = len(self.cell_ids)
+        else:
+            self.cell_ids = None
+        self.order = np.zeros(len(ids), int)
+        offsets = np.zeros(ncell + 1, int)
+        binning_counting_sort(ids, self.order, offsets)
+        if self.cell_ids is None:
+            self.cell_ids = (offsets[1:] > offsets[:-1]).nonzero()[0]
+            self.offsets = np.concatenate([offsets[self.cell_ids], [len(ids)]])
+            # dense table with the index of each non-empty bin, -1 otherwise
+            self.lookup_table = np.zeros(ncell, int)
+            self.lookup_table[:] = -1
+            self.lookup_table[self.cell_ids] = np.arange(len(self.cell_ids))
+        else:
+            self.offsets = offsets
+            self.lookup_table = None
+        self.keys = np.array(np.unravel_index(self.cell_ids, self.shape)).T.reshape(-1, 3)
+        self.keys += self.key_min
+        self.keys = np.ascontiguousarray(self.keys)
 
         # compute the neigbouring bins within the cutoff
         if self.integer_cell is None:
@@ -87,32 +125,99 @@ class Binning(object):
             max_ranges[True^self.integer_cell.active] = -1
             self.neighbor_indexes = grid_cell.get_radius_indexes(cutoff, max_ranges)
 
+    def __len__(self):
+        """The number of non-empty bins"""
+        return len(self.keys)
+
     def __iter__(self):
-        """Iterate over (key,bin) pairs"""
-        return iter(self._bins.items())
+        """Iterate over (key, indexes) pairs of all non-empty bins"""
+        for cell in range(len(self.keys)):
+            yield tuple(self.keys[cell]), self.get_indexes(cell)
+
+    def get_indexes(self, cell):
+        """The indexes of the coordinates in the given non-empty bin"""
+        return self.order[self.offsets[cell]:self.offsets[cell+1]]
+
+    def lookup(self, keys):
+        """Find the non-empty bins for an array with keys
+
+           Argument:
+            | ``keys``  --  A Kx3 integer array with bin keys. In case of a
+                            periodic system, these must be wrapped first.
+
+           Returns an array with K cell indexes, which are -1 for empty bins.
+        """
+        keys = keys - self.key_min
+        result = np.zeros(len(keys), int)
+        result[:] = -1
+        inside = ((keys >= 0) & (keys < self.shape)).all(axis=1)
+        if len(self.cell_ids) == 0 or not inside.any():
+            return result
+        ids = np.ravel_multi_index(keys[inside].T, self.shape)
+        if self.lookup_table is not None:
+            result[inside] = self.lookup_table[ids]
+            return result
+        cells = np.searchsorted(self.cell_ids, ids)
+        cells[cells == len(self.cell_ids)] = 0
+        cells[self.cell_ids[cells] != ids] = -1
+        result[inside] = cells
+        return result
+
+    def get_surrounding(self, keys):
+        """Find the non-empty bins surrounding the given bins
+
+           Argument:
+            | ``keys``  --  A Kx3 integer array with bin keys.
+
+           Returns a (K, S) array with cell indexes, where S is the number of
+           neighboring bins. Empty bins are represented by -1.
+        """
+        surrounding = (keys[:, np.newaxis, :] + self.neighbor_indexes).reshape(-1, 3)
+        if self.integer_cell is not None:
+            surrounding = self.wrap_keys(surrounding)
+        return self.lookup(surrounding).reshape(len(keys), len(self.neighbor_indexes))
 
     def iter_surrounding(self, center_key):
         """Iterate over all bins surrounding the given bin"""
-        for shift in self.neighbor_indexes:
-            key = tuple(np.add(center_key, shift).astype(int))
-            if self.integer_cell is not None:
-                key = self.wrap_key(key)
-            bin = self._bins.get(key)
-            if bin is not None:
-                yield key, bin
+        cells = self.get_surrounding(np.array([center_key], int))[0]
+        for cell in cells[cells >= 0]:
+            yield tuple(self.keys[cell]), self.get_indexes(cell)
+
+    def wrap_keys(self, keys):
+        """Translate the keys into the central cell
+
+           This method is only applicable in case of a periodic system.
+        """
+        return np.round(self.integer_cell.shortest_vector(keys)).astype(int)
 
     def wrap_key(self, key):
         """Translate the key into the central cell
 
            This method is only applicable in case of a periodic system.
         """
-        return tuple(np.round(
-            self.integer_cell.shortest_vector(key)
-        ).astype(int))
+        return tuple(self.wrap_keys(np.array(key)))
 
 
 class PairSearchBase(object):
     """Base class for :class:`PairSearchIntra` and :class:`PairSearchInter`"""
+    # The number of pairs that is computed in one call to the C extension.
+    chunk_size = 65536
+    # The number of bins for which the neighboring bins are looked up at once
+    # with NumPy, only used for very sparse grids.
+    cell_chunk_size = 4096
+    # The number of spatial domains per worker thread, for load balancing.
+    domains_per_worker = 4
+
+    def _get_mic_cell(self):
+        """The unit cell used for the minimum image convention
+
+           With the exact minimum image convention, the Minkowski-reduced cell
+           is used for the binning and the wrapping of relative vectors.
+        """
+        if self.unit_cell is not None and self.exact_mic:
+            return self.unit_cell.reduced
+        return self.unit_cell
+
     def _setup_grid(self, cutoff, unit_cell, grid):
         """Choose a proper grid for the binning process"""
         if grid is None:
@@ -142,7 +247,7 @@ class PairSearchBase(object):
             # The columns of integer_matrix are the unit cell vectors in
             # fractional coordinates of the grid cell.
             integer_matrix = grid_cell.to_fractional(unit_cell.matrix.transpose()).transpose()
-            if abs((integer_matrix - np.round(integer_matrix))*self.unit_cell.active).max() > 1e-6:
+            if abs((integer_matrix - np.round(integer_matrix))*unit_cell.active).max() > 1e-6:
                 raise ValueError("The unit cell vectors are not an integer linear combination of grid cell vectors.")
             integer_matrix = integer_matrix.round()
             integer_cell = UnitCell(integer_matrix, unit_cell.active)
@@ -151,6 +256,137 @@ class PairSearchBase(object):
 
         return grid_cell, integer_cell
 
+    def _iter_cell_pairs(self, bins0, bins1, begin, end):
+        """Iterate over arrays with pairs of cells that must be searched
+
+           Only the bins ``begin:end`` of ``bins0`` are considered. The cell
+           pairs are generated in chunks to keep the memory usage bounded.
+           They are ordered by the bin in ``bins0`` and then by the
+           neighboring bin in ``bins1``.
+        """
+        if bins1.lookup_table is None:
+            # Few non-empty bins in a large grid: plain NumPy lookups.
+            for chunk_begin in range(begin, end, self.cell_chunk_size):
+                chunk_end = min(chunk_begin + self.cell_chunk_size, end)
+                cells1 = bins1.get_surrounding(bins0.keys[chunk_begin:chunk_end])
+                cells0 = np.repeat(np.arange(chunk_begin, chunk_end), cells1.shape[1]).reshape(cells1.shape)
+                mask = cells1 >= 0
+                yield np.array([cells0[mask], cells1[mask]]).T.copy()
+            return
+
+        from molmod.ext import binning_cell_pairs
+        if bins1.integer_cell is None:
+            integer_matrix = None
+            integer_reciprocal = None
+        else:
+            integer_matrix = np.ascontiguousarray(bins1.integer_cell.matrix, float)
+            integer_reciprocal = np.ascontiguousarray(bins1.integer_cell.reciprocal, float)
+        stencil = np.ascontiguousarray(bins1.neighbor_indexes)
+        ncell_pair_max = max(self.chunk_size, len(stencil))
+        keys0 = bins0.keys[begin:end]
+        icell0 = 0
+        while icell0 < len(keys0):
+            cell_pairs = np.zeros((ncell_pair_max, 2), int)
+            ncell_pair, icell0 = binning_cell_pairs(
+                keys0, stencil, bins1.key_min, bins1.shape, bins1.lookup_table,
+                icell0, cell_pairs, integer_matrix, integer_reciprocal
+            )
+            cell_pairs = cell_pairs[:ncell_pair]
+            cell_pairs[:, 0] += begin
+            yield cell_pairs
+
+    def _compute_domain(self, coordinates0, bins0, coordinates1, bins1, intra, begin, end):
+        """Compute all pairs below the cutoff for the bins ``begin:end`` of ``bins0``
+
+           Returns a list of (pairs, deltas, distances) chunks.
+        """
+        from molmod.ext import binning_pairs
+        mic_cell = self._get_mic_cell()
+        images = None
+        if mic_cell is None:
+            matrix = None
+            reciprocal = None
+        else:
+            matrix = np.ascontiguousarray(mic_cell.matrix)
+            reciprocal = np.ascontiguousarray(mic_cell.reciprocal)
+            if self.exact_mic:
+                images = np.ascontiguousarray(mic_cell.mic_images[1:])
+        sizes0 = bins0.offsets[1:] - bins0.offsets[:-1]
+        sizes1 = bins1.offsets[1:] - bins1.offsets[:-1]
+
+        chunks = []
+        for cell_pairs in self._iter_cell_pairs(bins0, bins1, begin, end):
+            if len(cell_pairs) == 0:
+                continue
+            largest = (sizes0[cell_pairs[:, 0]]*sizes1[cell_pairs[:, 1]]).max()
+            npair_max = max(self.chunk_size, largest)
+            icell_pair = 0
+            while icell_pair < len(cell_pairs):
+                pairs = np.zeros((npair_max, 2), int)
+                deltas = np.zeros((npair_max, 3), float)
+                distances = np.zeros(npair_max, float)
+                npair, icell_pair = binning_pairs(
+                    coordinates0, bins0.order, bins0.offsets, coordinates1,
+                    bins1.order, bins1.offsets, cell_pairs, icell_pair, intra,
+                    self.cutoff, pairs, deltas, distances, matrix, reciprocal,
+                    images
+                )
+                chunks.append((pairs[:npair], deltas[:npair], distances[:npair]))
+        return chunks
+
+    def _compute_arrays(self, coordinates0, bins0, coordinates1, bins1, intra):
+        """Compute all pairs below the cutoff in chunks with the C extension
+
+           When ``self.n_workers`` is larger than one, the bins in ``bins0``
+           are divided into domains with similar numbers of coordinates, which
+           are searched in a pool of threads. The results are always merged in
+           the order of the domains, such that the output does not depend on
+           the number of workers.
+        """
+        if self.n_workers > 1 and len(bins0) > 1:
+            ndomain = min(self.n_workers*self.domains_per_worker, len(bins0))
+            bounds = np.searchsorted(
+                bins0.offsets, np.linspace(0, bins0.offsets[-1], ndomain+1)
+            )
+            bounds[0] = 0
+            bounds[-1] = len(bins0)
+            bounds = np.unique(bounds)
+
+            def compute_domain(domain):
+                return self._compute_domain(
+                    coordinates0, bins0, coordinates1, bins1, intra,
+                    bounds[domain], bounds[domain+1]
+                )
+
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(self.n_workers)
+            try:
+                domain_chunks = pool.map(compute_domain, range(len(bounds)-1))
+            finally:
+                pool.close()
+                pool.join()
+            chunks = sum(domain_chunks, [])
+        else:
+            chunks = self._compute_domain(
+                coordinates0, bins0, coordinates1, bins1, intra, 0, len(bins0)
+            )
+
+        if len(chunks) == 0:
+            return (
+                np.zeros(0, int), np.zeros(0, int), np.zeros((0, 3), float),
+                np.zeros(0, float)
+            )
+        pairs = np.concatenate([chunk[0] for chunk in chunks])
+        deltas = np.concatenate([chunk[1] for chunk in chunks])
+        distances = np.concatenate([chunk[2] for chunk in chunks])
+        return pairs[:, 0].copy(), pairs[:, 1].copy(), deltas, distances
+
+    def __iter__(self):
+        """Iterate over all pairs with a distance below the cutoff"""
+        indexes0, indexes1, deltas, distances = self.arrays()
+        for i0, i1, delta, distance in zip(indexes0.tolist(), indexes1.tolist(), deltas, distances):
+            yield i0, i1, delta, distance
+
 
 class PairSearchIntra(PairSearchBase):
     """Iterator over all pairs of coordinates with a distance below a cutoff.
@@ -161,10 +397,16 @@ class PairSearchIntra(PairSearchBase):
            for i, j, delta, distance in PairSearchIntra(coordinates, 2.5):
                print i, j, distance
 
+       All pairs can also be computed at once as arrays, which is much faster
+       for large systems::
+
+           indexes0, indexes1, deltas, distances = PairSearchIntra(coordinates, 2.5).arrays()
+
        Note that for periodic systems the minimum image convention is applied.
     """
 
-    def __init__(self, coordinates, cutoff, unit_cell=None, grid=None):
+    def __init__(self, coordinates, cutoff, unit_cell=None, grid=None, n_workers=1,
+                 exact_mic=False):
         """
            Arguments:
             | ``coordinates``  --  A Nx3 numpy array with Cartesian coordinates
@@ -183,6 +425,14 @@ class PairSearchIntra(PairSearchBase):
                         cell vectors (for those directions that are active in
                         the unit cell). If this is not the case, a ValueError is
                         raised.
+            | ``n_workers``  --  The number of threads used to compute the
+                                 pairs. The result does not depend on the
+                                 number of threads. [default=1]
+            | ``exact_mic``  --  When True, the exact minimum image convention
+                                 is used, which is only relevant for strongly
+                                 skewed unit cells. See
+                                 :meth:`molmod.unit_cells.UnitCell.shortest_vector`.
+                                 [default=False]
 
            The default value of grid depends on other parameters:
 
@@ -191,25 +441,28 @@ class PairSearchIntra(PairSearchBase):
                 as possible, with spacings below cutoff/2 that are integer
                 divisions of the unit cell spacings
         """
+        self.coordinates = np.ascontiguousarray(coordinates, float)
         self.cutoff = cutoff
         self.unit_cell = unit_cell
-        grid_cell, integer_cell = self._setup_grid(cutoff, unit_cell, grid)
-        self.bins = Binning(coordinates, cutoff, grid_cell, integer_cell)
+        self.n_workers = n_workers
+        self.exact_mic = exact_mic
+        grid_cell, integer_cell = self._setup_grid(cutoff, self._get_mic_cell(), grid)
+        self.bins = Binning(self.coordinates, cutoff, grid_cell, integer_cell)
+
+    def arrays(self):
+        """Compute all pairs with a distance below the cutoff at once
+
+           Returns: ``indexes0``, ``indexes1``, ``deltas``, ``distances``. The
+           first two are integer arrays with the indexes of the atoms in each
+           pair (``indexes0 > indexes1``), ``deltas`` is an Mx3 array with
+           relative vectors and ``distances`` is an array with the
+           corresponding distances. The order of the pairs is the same as
+           when iterating over this object.
+        """
+        return self._compute_arrays(
+            self.coordinates, self.bins, self.coordinates, self.bins, True
+        )
 
-    def __iter__(self):
-        """Iterate over all pairs with a distance below the cutoff"""
-        for key0, bin0 in self.bins:
-            for key1, bin1 in self.bins.iter_surrounding(key0):
-                for i0, c0 in bin0:
-                    for i1, c1 in bin1:
-                        if i1 >= i0:
-                            continue
-                        delta = c1 - c0
-                        if self.unit_cell is not None:
-                            delta = self.unit_cell.shortest_vector(delta)
-                        distance = np.linalg.norm(delta)
-                        if distance <= self.cutoff:
-                            yield i0, i1, delta, distance
 
 class PairSearchInter(PairSearchBase):
     """Iterator over all pairs of coordinates with a distance below a cutoff.
@@ -221,10 +474,14 @@ class PairSearchInter(PairSearchBase):
            for i, j, delta, distance in PairSearchInter(coordinates0, coordinates1, 2.5):
                print i, j, distance
 
+       All pairs can also be computed at once as arrays with the ``arrays``
+       method.
+
        Note that for periodic systems the minimum image convention is applied.
     """
 
-    def __init__(self, coordinates0, coordinates1, cutoff, unit_cell=None, grid=None):
+    def __init__(self, coordinates0, coordinates1, cutoff, unit_cell=None, grid=None,
+                 n_workers=1, exact_mic=False):
         """
            Arguments:
             | ``coordinates0``  --  A Nx3 numpy array with Cartesian coordinates
@@ -244,6 +501,14 @@ class PairSearchInter(PairSearchBase):
                         cell vectors (for those directions that are active in
                         the unit cell). If this is not the case, a ValueError is
                         raised.
+            | ``n_workers``  --  The number of threads used to compute the
+                                 pairs. The result does not depend on the
+                                 number of threads. [default=1]
+            | ``exact_mic``  --  When True, the exact minimum image convention
+                                 is used, which is only relevant for strongly
+                                 skewed unit cells. See
+                                 :meth:`molmod.unit_cells.UnitCell.shortest_vector`.
+                                 [default=False]
 
            The default value of grid depends on other parameters:
              1) When no unit cell is given, it is equal to cutoff/2.9.
@@ -251,21 +516,125 @@ class PairSearchInter(PairSearchBase):
                 as possible, with spacings below cutoff/2 that are integer
                 divisions of the unit cell spacings
         """
+        self.coordinates0 = np.ascontiguousarray(coordinates0, float)
+        self.coordinates1 = np.ascontiguousarray(coordinates1, float)
         self.cutoff = cutoff
         self.unit_cell = unit_cell
-        grid_cell, integer_cell = self._setup_grid(cutoff, unit_cell, grid)
-        self.bins0 = Binning(coordinates0, cutoff, grid_cell, integer_cell)
-        self.bins1 = Binning(coordinates1, cutoff, grid_cell, integer_cell)
+        self.n_workers = n_workers
+        self.exact_mic = exact_mic
+        grid_cell, integer_cell = self._setup_grid(cutoff, self._get_mic_cell(), grid)
+        self.bins0 = Binning(self.coordinates0, cutoff, grid_cell, integer_cell)
+        self.bins1 = Binning(self.coordinates1, cutoff, grid_cell, integer_cell)
+
+    def arrays(self):
+        """Compute all pairs with a distance below the cutoff at once
+
+           Returns: ``indexes0``, ``indexes1``, ``deltas``, ``distances``. The
+           first two are integer arrays with indexes in ``coordinates0`` and
+           ``coordinates1``, respectively. ``deltas`` is an Mx3 array with
+           relative vectors and ``distances`` is an array with the
+           corresponding distances. The order of the pairs is the same as
+           when iterating over this object.
+        """
+        return self._compute_arrays(
+            self.coordinates0, self.bins0, self.coordinates1, self.bins1, False
+        )
 
-    def __iter__(self):
-        """Iterate over all pairs with a distance below the cutoff"""
-        for key0, bin0 in self.bins0:
-            for key1, bin1 in self.bins1.iter_surrounding(key0):
-                for i0, c0 in bin0:
-                    for i1, c1 in bin1:
-                        delta = c1 - c0
-                        if self.unit_cell is not None:
-                            delta = self.unit_cell.shortest_vector(delta)
-                        distance = np.linalg.norm(delta)
-                        if distance <= self.cutoff:
-                            yield i0, i1, delta, distance
+
+class NeighborList(PairSearchBase):
+    """Verlet neighbor list that is reused for a sequence of similar geometries
+
+       The pairs are searched with a cutoff that is increased by a skin. As
+       long as no atom has moved more than half the skin since the last
+       search, all pairs below the cutoff are among the stored pairs and only
+       their distances have to be recomputed.
+
+       Example usage::
+
+           neighbor_list = NeighborList(cutoff, skin)
+           for coordinates in trajectory:
+               indexes0, indexes1, deltas, distances = neighbor_list.update(coordinates)
+
+       Note that for periodic systems the minimum image convention is applied.
+    """
+
+    def __init__(self, cutoff, skin, unit_cell=None, grid=None, n_workers=1,
+                 exact_mic=False):
+        """
+           Arguments:
+            | ``cutoff``  --  The cutoff radius for the pair distances.
+            | ``skin``  --  The extra margin added to the cutoff when the pairs
+                            are searched.
+
+           Optional arguments:
+            | ``unit_cell``  --  Specifies the periodic boundary conditions
+            | ``grid``  --  Specification of the grid, see
+                            :class:`PairSearchIntra`. The grid is determined
+                            once, based on ``cutoff + skin``, and is reused
+                            whenever the neighbor list is rebuilt.
+            | ``n_workers``  --  The number of threads used to rebuild the
+                                 neighbor list. [default=1]
+            | ``exact_mic``  --  When True, the exact minimum image convention
+                                 is used. [default=False]
+        """
+        if skin < 0:
+            raise ValueError("The skin must not be negative.")
+        self.cutoff = cutoff
+        self.skin = skin
+        self.unit_cell = unit_cell
+        self.n_workers = n_workers
+        self.exact_mic = exact_mic
+        self.grid_cell = self._setup_grid(cutoff + skin, self._get_mic_cell(), grid)[0]
+        self.nbuild = 0
+        self.reference = None
+        self.indexes0 = None
+        self.indexes1 = None
+
+    def _compute_deltas(self, coordinates, indexes0, indexes1):
+        """Compute relative vectors and distances for the given pairs"""
+        deltas = coordinates[indexes1] - coordinates[indexes0]
+        if self.unit_cell is not None:
+            deltas = self.unit_cell.shortest_vector(deltas, self.exact_mic)
+        distances = np.sqrt((deltas*deltas).sum(axis=1))
+        return deltas, distances
+
+    def _needs_build(self, coordinates):
+        """Check if the stored pairs are still valid for the given geometry"""
+        if self.reference is None or len(self.reference) != len(coordinates):
+            return True
+        displacements = coordinates - self.reference
+        if self.unit_cell is not None:
+            displacements = self.unit_cell.shortest_vector(displacements)
+        if len(displacements) == 0:
+            return False
+        max_displacement = np.sqrt((displacements*displacements).sum(axis=1).max())
+        return 2*max_displacement > self.skin
+
+    def build(self, coordinates):
+        """Search all pairs below cutoff + skin for the given geometry"""
+        coordinates = np.ascontiguousarray(coordinates, float)
+        pair_search = PairSearchIntra(
+            coordinates, self.cutoff + self.skin, self.unit_cell, self.grid_cell,
+            self.n_workers, self.exact_mic
+        )
+        self.indexes0, self.indexes1 = pair_search.arrays()[:2]
+        self.reference = coordinates.copy()
+        self.nbuild += 1
+
+    def update(self, coordinates):
+        """Return all pairs below the cutoff for a new geometry
+
+           Argument:
+            | ``coordinates``  --  A Nx3 numpy array with Cartesian coordinates
+
+           The neighbor list is only rebuilt when an atom has moved more than
+           half the skin since the last build. Returns ``indexes0``,
+           ``indexes1``, ``deltas`` and ``distances``, like
+           :meth:`PairSearchIntra.arrays`.
+        """
+        coordinates = np.ascontiguousarray(coordinates, float)
+        if self._needs_build(coordinates):
+            self.build(coordinates)
+        deltas, distances = self._compute_deltas(coordinates, self.indexes0, self.indexes1)
+        mask = distances <= self.cutoff
+        return self.indexes0[mask], self.indexes1[mask], deltas[mask], distances[mask]
@@ -46,6 +46,8 @@ from __future__ import division
 from builtins import range
 import pkg_resources
 
+import numpy as np
+
 from molmod.periodic import periodic
 import molmod.units as units
 
@@ -85,6 +87,7 @@ class BondData(object):
             in self.lengths.values()
             if len(lengths) > 0
         )
+        self._build_length_table()
 
     def _load_bond_data(self):
         """Load the bond data from the given file
@@ -139,6 +142,37 @@ class BondData(object):
                         dataset[pair] = (atom1.covalent_radius + atom2.covalent_radius)
                     #print "%3i  %3i  %s %30s %30s" % (n1, n2, dataset.get(pair), atom1, atom2)
 
+    def _build_length_table(self):
+        """Store the bond lengths in arrays for vectorized lookups
+
+           The attribute ``length_table`` has shape (len(bond_types), Z+1,
+           Z+1), where Z is the largest atom number in the database. Missing
+           bond lengths are NaN. The attribute ``cutoff_table`` has shape
+           (Z+1, Z+1) and contains the largest distance at which two atoms can
+           be bonded, or zero if no bond length is known.
+        """
+        max_number = max(
+            max(pair) for lengths in self.lengths.values() for pair in lengths
+        )
+        self.length_table = np.zeros((len(bond_types), max_number+1, max_number+1), float)
+        self.length_table[:] = np.nan
+        for index, bond_type in enumerate(bond_types):
+            for pair, length in self.lengths[bond_type].items():
+                n1 = min(pair)
+                n2 = max(pair)
+                self.length_table[index, n1, n2] = length
+                self.length_table[index, n2, n1] = length
+        with np.errstate(invalid='ignore'):
+            self.cutoff_table = np.nan_to_num(np.fmax.reduce(self.length_table, axis=0))*self.bond_tolerance
+
+    def get_max_cutoff(self, numbers):
+        """Return the largest distance at which atoms with the given numbers can be bonded"""
+        numbers = np.unique(numbers)
+        numbers = numbers[(numbers >= 0) & (numbers < self.cutoff_table.shape[0])]
+        if len(numbers) == 0:
+            return 0.0
+        return self.cutoff_table[numbers][:, numbers].max()
+
     def bonded(self, n1, n2, distance):
         """Return the estimated bond type
 
@@ -173,6 +207,40 @@ class BondData(object):
                         deviation = new_deviation
         return result
 
+    def bonded_array(self, numbers1, numbers2, distances):
+        """Return the estimated bond types for arrays of atom pairs
+
+           Arguments:
+            | ``numbers1``  --  the atom numbers of the first atoms
+            | ``numbers2``  --  the atom numbers of the second atoms
+            | ``distances``  --  the distances between the atoms
+
+           Returns: an integer array with the same result as the method
+           ``bonded`` for each pair, except that 0 is used instead of None.
+        """
+        numbers1 = np.asarray(numbers1, int)
+        numbers2 = np.asarray(numbers2, int)
+        distances = np.asarray(distances, float)
+        size = self.cutoff_table.shape[0]
+        result = np.zeros(len(distances), int)
+        known = (numbers1 >= 0) & (numbers1 < size) & (numbers2 >= 0) & (numbers2 < size)
+        pair_indexes = numbers1*size + numbers2
+        # cheap test with the largest cutoff of all bond types
+        candidates = known.nonzero()[0]
+        candidates = candidates[
+            distances[candidates] < self.cutoff_table.ravel()[pair_indexes[candidates]]
+        ]
+        if len(candidates) == 0:
+            return result
+        # The bond lengths for each bond type (rows) and each pair (columns).
+        lengths = self.length_table.reshape(len(bond_types), -1)[:, pair_indexes[candidates]]
+        candidate_distances = distances[candidates]
+        with np.errstate(invalid='ignore'):
+            deviations = abs(lengths - candidate_distances)
+            deviations[~(candidate_distances < lengths*self.bond_tolerance)] = np.inf
+        result[candidates] = np.array(bond_types)[deviations.argmin(axis=0)]
+        return result
+
     def get_length(self, n1, n2, bond_type=BOND_SINGLE):
         """Return the length of a bond between n1 and n2 of type bond_type
 
@@ -30,10 +30,129 @@
            cf.add_related(some, related, items)
        for cluster in cf.iter_clusters():
            print cluster
+
+   The same problem, for items that are integers from 0 to n-1 and relations
+   given as an array of pairs, is solved much faster by the function
+   connected_components.
 """
 
 
-__all__ = ["Cluster", "RuleCluster", "ClusterFactory"]
+import numpy as np
+
+
+__all__ = [
+    "UnionFind", "connected_components", "Cluster", "RuleCluster",
+    "ClusterFactory"
+]
+
+
+class UnionFind(object):
+    """A disjoint-set forest with path compression and union by rank
+
+       Items are stored in lists with parents and ranks, such that only one
+       integer per item is kept in memory. Sets of items are only constructed
+       by the method get_groups.
+    """
+
+    def __init__(self):
+        # mapping: item -> index in the lists below
+        self.indexes = {}
+        self.items = []
+        self.parents = []
+        self.ranks = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        """Add an item (if not yet present) and return its index"""
+        index = self.indexes.get(item)
+        if index is None:
+            index = len(self.items)
+            self.indexes[item] = index
+            self.items.append(item)
+            self.parents.append(index)
+            self.ranks.append(0)
+        return index
+
+    def find(self, index):
+        """Return the index of the root of the set that contains index"""
+        parents = self.parents
+        root = index
+        while parents[root] != root:
+            root = parents[root]
+        # path compression
+        while parents[index] != root:
+            parents[index], index = root, parents[index]
+        return root
+
+    def union(self, index1, index2):
+        """Merge the sets that contain index1 and index2, return the new root"""
+        root1 = self.find(index1)
+        root2 = self.find(index2)
+        if root1 == root2:
+            return root1
+        ranks = self.ranks
+        if ranks[root1] < ranks[root2]:
+            root1, root2 = root2, root1
+        self.parents[root2] = root1
+        if ranks[root1] == ranks[root2]:
+            ranks[root1] += 1
+        return root1
+
+    def get_labels(self):
+        """Return an array with the index of the root for each item"""
+        return np.array([self.find(index) for index in range(len(self.items))], int)
+
+    def get_groups(self):
+        """Return a dictionary with the items in each set
+
+           The keys are the indexes of the roots of the sets and the values
+           are lists of items.
+        """
+        result = {}
+        for index, item in enumerate(self.items):
+            result.setdefault(self.find(index), []).append(item)
+        return result
+
+
+def connected_components(edges, n):
+    """Label the connected components in an undirected graph
+
+       Arguments:
+        | ``edges``  --  An integer array with shape (M, 2), with pairs of
+                         related items.
+        | ``n``  --  The number of items, i.e. the items are 0, 1, ..., n-1.
+
+       Returns: an integer array with n labels. The components are numbered
+       from 0 to the number of components minus one, in the order of their
+       smallest item.
+
+       This is a vectorized union-find algorithm. In each iteration, all
+       edges are used at once to hook the root with the highest index onto the
+       other root, followed by full path compression with pointer jumping.
+       Each iteration at least halves the number of edges between different
+       components.
+    """
+    edges = np.asarray(edges, int).reshape(-1, 2)
+    parents = np.arange(n)
+    while True:
+        roots = parents[edges]
+        mask = roots[:,0] != roots[:,1]
+        if not mask.any():
+            break
+        roots = roots[mask]
+        edges = edges[mask]
+        roots.sort(axis=1)
+        np.minimum.at(parents, roots[:,1], roots[:,0])
+        # pointer jumping
+        while True:
+            grand_parents = parents[parents]
+            if (grand_parents == parents).all():
+                break
+            parents = grand_parents
+    # The root of each component is its smallest item.
+    return np.unique(parents, return_inverse=True)[1].ravel()
 
 
 class Cluster(object):
@@ -92,15 +211,27 @@ class RuleCluster(Cluster):
 class ClusterFactory(object):
     """A very basic cluster algorithm"""
 
-    def __init__(self, cls=Cluster):
+    def __init__(self, cls=Cluster, streaming=False):
         """
-           Optinional argument:
+           Optinional arguments:
             | ``cls``  --  A class to construct new cluster objects
                            [default=Cluster]
+            | ``streaming``  --  When True, the relations are only recorded in
+                                 a UnionFind object. The cluster objects are
+                                 constructed when get_clusters is called. The
+                                 attribute lookup is not available in this
+                                 mode. [default=False]
         """
         self.cls = cls
-        # mapping: item -> cluster. Each cluster is a tuple of related items.
-        self.lookup = {}
+        self.streaming = streaming
+        if streaming:
+            self.union_find = UnionFind()
+            # cluster objects given to add_related, stored by the index of
+            # one of their items
+            self.pending = []
+        else:
+            # mapping: item -> cluster. Each cluster is a tuple of related items.
+            self.lookup = {}
 
     def add_related(self, *objects):
         """Add related items
@@ -111,6 +242,9 @@ class ClusterFactory(object):
            When two groups of related items share one or more common members,
            they will be merged into one cluster.
         """
+        if self.streaming:
+            self._add_related_streaming(objects)
+            return
         master = None # this will become the common cluster of all related items
         slaves = set([]) # set of clusters that are going to be merged in the master
         solitaire = set([]) # set of new items that are not yet part of a cluster
@@ -150,6 +284,32 @@ class ClusterFactory(object):
         for item in master.items:
             self.lookup[item] = master
 
+    def _add_related_streaming(self, objects):
+        """Record related items in the union-find structure"""
+        union_find = self.union_find
+        first = None
+        for new in objects:
+            if isinstance(new, self.cls):
+                items = new.items
+                if len(items) == 0:
+                    continue
+                indexes = [union_find.add(item) for item in items]
+                self.pending.append((indexes[0], new))
+            else:
+                indexes = [union_find.add(new)]
+            if first is None:
+                first = indexes[0]
+            for index in indexes:
+                union_find.union(first, index)
+
     def get_clusters(self):
         """Returns a set with the clusters"""
-        return set(self.lookup.values())
+        if not self.streaming:
+            return set(self.lookup.values())
+        union_find = self.union_find
+        clusters = {}
+        for root, items in union_find.get_groups().items():
+            clusters[root] = self.cls(items)
+        for index, other in self.pending:
+            clusters[union_find.find(index)].update(other)
+        return set(clusters.values())
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# MolMod is a collection of molecular modelling tools for python.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MolMod.
+#
+# MolMod is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# MolMod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+"""Reciprocal-space part of Ewald summations for point charges
+
+   The electrostatic interactions in a three-dimensional periodic system are
+   split in a short-ranged real-space part, erfc(alpha*r)/r, and a smooth
+   long-ranged part that is evaluated in reciprocal space. This module only
+   implements the latter, including the self-interaction and the neutralizing
+   background corrections. The real-space part is computed with pair lists in
+   :class:`molmod.pairff.CoulombFF`.
+
+   Two implementations are provided with the same interface:
+
+   * :class:`EwaldReciprocal`  --  the conventional Ewald sum over reciprocal
+     lattice vectors, O(N**1.5) when the parameters are chosen optimally.
+   * :class:`SPMEReciprocal`  --  smooth particle-mesh Ewald, which spreads
+     the charges on a grid with cardinal B-splines and uses FFTs, O(N log N).
+
+   Both compute the electrostatic potential and field at arbitrary points,
+   from which the energy and the gradient follow.
+"""
+
+
+from __future__ import division
+
+from builtins import range
+import numpy as np
+
+
+__all__ = ["ewald_parameters", "EwaldReciprocal", "SPMEReciprocal"]
+
+
+def ewald_parameters(cutoff, accuracy):
+    """Return the Ewald splitting parameter and the reciprocal cutoff
+
+       Arguments:
+        | ``cutoff``  --  the real-space cutoff
+        | ``accuracy``  --  the relative magnitude of the neglected terms in
+                            both the real and the reciprocal space sums, e.g.
+                            1e-8.
+
+       Returns: ``alpha``, ``kcut``. The real-space term erfc(alpha*r)/r is
+       of the order of ``accuracy`` at the cutoff and reciprocal vectors with
+       a norm larger than ``kcut`` (including the factor 2*pi) are neglected.
+    """
+    if accuracy <= 0 or accuracy >= 1:
+        raise ValueError("The accuracy must be in the range ]0,1[.")
+    if cutoff <= 0:
+        raise ValueError("The cutoff must be strictly positive.")
+    tmp = np.sqrt(-np.log(accuracy))
+    alpha = tmp/cutoff
+    kcut = 2*alpha*tmp
+    return alpha, kcut
+
+
+class ReciprocalBase(object):
+    """Common functionality of the reciprocal-space Ewald implementations"""
+
+    point_chunk_size = 1024
+
+    def __init__(self, unit_cell, alpha, kcut):
+        """
+           Arguments:
+            | ``unit_cell``  --  a UnitCell object with three active cell
+                                 vectors
+            | ``alpha``  --  the Ewald splitting parameter
+            | ``kcut``  --  the cutoff for the reciprocal vectors (including
+                            the factor 2*pi)
+        """
+        if not unit_cell.active.all():
+            raise ValueError("Ewald summation requires a three-dimensional periodic unit cell.")
+        self.unit_cell = unit_cell
+        self.alpha = alpha
+        self.kcut = kcut
+        self.volume = unit_cell.volume
+
+    def _get_reciprocal_ranges(self):
+        """Number of reciprocal vectors needed along each direction"""
+        lengths = np.sqrt((self.unit_cell.reciprocal**2).sum(axis=0))
+        return np.ceil(self.kcut/(2*np.pi*lengths)).astype(int)
+
+    def compute(self, coordinates, charges, points, do_field=False):
+        """Compute the long-ranged potential (and field) at a set of points
+
+           Arguments:
+            | ``coordinates``  --  Nx3 array with the positions of the charges
+            | ``charges``  --  array with N charges
+            | ``points``  --  Mx3 array with the positions where the potential
+                               must be computed
+
+           Optional argument:
+            | ``do_field``  --  when True, also the electric field is computed
+                                [default=False]
+
+           Returns: an array with M potentials, and if ``do_field`` is set,
+           an Mx3 array with the electric field. The result includes the
+           contribution of the neutralizing background for non-neutral
+           systems, but not the self-interaction correction.
+        """
+        raise NotImplementedError
+
+    def background(self, charges):
+        """The potential due to the neutralizing background charge"""
+        return -np.pi*charges.sum()/(self.volume*self.alpha**2)
+
+    def self_potential(self, charges):
+        """The potential of the Gaussian charge at its own center
+
+           This must be subtracted from the potential at the atoms to exclude
+           the self-interaction.
+        """
+        return 2*self.alpha/np.sqrt(np.pi)*charges
+
+
+class EwaldReciprocal(ReciprocalBase):
+    """Conventional Ewald summation over reciprocal lattice vectors"""
+
+    def __init__(self, unit_cell, alpha, kcut):
+        """
+           Arguments:
+            | ``unit_cell``  --  a UnitCell object with three active cell
+                                 vectors
+            | ``alpha``  --  the Ewald splitting parameter
+            | ``kcut``  --  the cutoff for the reciprocal vectors (including
+                            the factor 2*pi)
+        """
+        ReciprocalBase.__init__(self, unit_cell, alpha, kcut)
+        ranges = self._get_reciprocal_ranges()
+        indexes = np.mgrid[
+            -ranges[0]:ranges[0]+1,
+            -ranges[1]:ranges[1]+1,
+            -ranges[2]:ranges[2]+1,
+        ].reshape(3, -1).T
+        # Only half of the reciprocal vectors are needed: k and -k give the
+        # same contribution.
+        half = (
+            (indexes[:, 0] > 0) |
+            ((indexes[:, 0] == 0) & (indexes[:, 1] > 0)) |
+            ((indexes[:, 0] == 0) & (indexes[:, 1] == 0) & (indexes[:, 2] > 0))
+        )
+        kvecs = 2*np.pi*np.dot(indexes[half], self.unit_cell.reciprocal.T)
+        ksq = (kvecs**2).sum(axis=1)
+        mask = ksq < kcut**2
+        self.kvecs = kvecs[mask]
+        ksq = ksq[mask]
+        # The factor two accounts for the missing half of the vectors.
+        self.prefactors = 2*4*np.pi/self.volume*np.exp(-ksq/(4*alpha**2))/ksq
+
+    def compute(self, coordinates, charges, points, do_field=False):
+        """See :meth:`ReciprocalBase.compute`"""
+        structure_factors = np.zeros(len(self.kvecs), complex)
+        for begin in range(0, len(coordinates), self.point_chunk_size):
+            end = begin + self.point_chunk_size
+            structure_factors += np.dot(
+                charges[begin:end], np.exp(1j*np.dot(coordinates[begin:end], self.kvecs.T))
+            )
+        structure_factors *= self.prefactors
+        potential = np.zeros(len(points), float)
+        if do_field:
+            field = np.zeros((len(points), 3), float)
+        for begin in range(0, len(points), self.point_chunk_size):
+            end = begin + self.point_chunk_size
+            tmp = np.exp(-1j*np.dot(points[begin:end], self.kvecs.T))*structure_factors
+            potential[begin:end] = tmp.real.sum(axis=1)
+            if do_field:
+                field[begin:end] = -np.dot(tmp.imag, self.kvecs)
+        potential += self.background(charges)
+        if do_field:
+            return potential, field
+        return potential
+
+
+class SPMEReciprocal(ReciprocalBase):
+    """Smooth particle-mesh Ewald (Essmann et al., J. Chem. Phys. 103, 8577)
+
+       The charges are spread on a regular grid with cardinal B-splines. The
+       convolution with the Ewald kernel is carried out with FFTs and the
+       potential and the field are interpolated at the requested points with
+       the same B-splines.
+    """
+
+    def __init__(self, unit_cell, alpha, kcut, order=8, oversampling=1.5):
+        """
+           Arguments:
+            | ``unit_cell``  --  a UnitCell object with three active cell
+                                 vectors
+            | ``alpha``  --  the Ewald splitting parameter
+            | ``kcut``  --  the cutoff for the reciprocal vectors (including
+                            the factor 2*pi)
+
+           Optional arguments:
+            | ``order``  --  the order of the B-splines, must be even
+                             [default=8]
+            | ``oversampling``  --  the ratio between the number of grid
+                                    points and the number of reciprocal
+                                    vectors within the cutoff along each
+                                    direction [default=1.5]
+        """
+        ReciprocalBase.__init__(self, unit_cell, alpha, kcut)
+        if order < 2 or order % 2 != 0:
+            raise ValueError("The order of the B-splines must be even and at least two.")
+        self.order = order
+        ranges = self._get_reciprocal_ranges()
+        shape = np.ceil(oversampling*(2*ranges + 1)).astype(int)
+        self.shape = np.array([_fft_size(max(size, order)) for size in shape])
+        # reciprocal vectors on the grid, in FFT order
+        indexes = np.array(np.meshgrid(*[
+            np.fft.fftfreq(size, 1.0/size) for size in self.shape
+        ], indexing="ij"))
+        kvecs = 2*np.pi*np.einsum("ij,jabc->iabc", self.unit_cell.reciprocal, indexes)
+        ksq = (kvecs**2).sum(axis=0)
+        ksq[0, 0, 0] = 1.0
+        kernel = 4*np.pi/self.volume*np.exp(-ksq/(4*alpha**2))/ksq
+        kernel[0, 0, 0] = 0.0
+        for axis, size in enumerate(self.shape):
+            factors = _bspline_moduli(size, order)
+            kernel *= factors.reshape([-1 if i == axis else 1 for i in range(3)])
+        self.kernel = kernel
+
+    def _get_weights(self, points):
+        """Return the grid indexes and B-spline weights for a set of points
+
+           Returns: ``indexes``, an Mx3xorder integer array with grid indexes
+           along each axis, ``weights`` and ``derivatives``, two Mx3xorder
+           arrays with the B-spline weights and their derivatives towards the
+           scaled fractional coordinates.
+        """
+        scaled = np.dot(points, self.unit_cell.reciprocal)*self.shape
+        floor = np.floor(scaled)
+        frac = scaled - floor
+        offsets = np.arange(self.order)
+        indexes = (floor.astype(int)[:, :, np.newaxis] - offsets) % self.shape[:, np.newaxis]
+        # B-spline of order n evaluated at frac + j, for j = 0..order-1
+        weights, derivatives = _bspline_weights(frac, self.order)
+        return indexes, weights, derivatives
+
+    def compute(self, coordinates, charges, points, do_field=False):
+        """See :meth:`ReciprocalBase.compute`"""
+        # spread the charges
+        indexes, weights, derivatives = self._get_weights(coordinates)
+        flat = self._flat_indexes(indexes)
+        contributions = (
+            charges[:, np.newaxis, np.newaxis, np.newaxis]*
+            weights[:, 0, :, np.newaxis, np.newaxis]*
+            weights[:, 1, np.newaxis, :, np.newaxis]*
+            weights[:, 2, np.newaxis, np.newaxis, :]
+        )
+        grid = np.bincount(
+            flat.ravel(), contributions.ravel(), self.shape.prod()
+        ).reshape(self.shape)
+        # convolution with the Ewald kernel
+        grid = np.fft.ifftn(np.fft.fftn(grid)*self.kernel).real*self.shape.prod()
+        grid = grid.ravel()
+        # interpolate the potential and the field
+        potential = np.zeros(len(points), float)
+        if do_field:
+            field = np.zeros((len(points), 3), float)
+            gradient_scale = self.unit_cell.reciprocal*self.shape
+        for begin in range(0, len(points), self.point_chunk_size):
+            end = begin + self.point_chunk_size
+            indexes, weights, derivatives = self._get_weights(points[begin:end])
+            values = grid[self._flat_indexes(indexes)]
+            w0 = weights[:, 0, :, np.newaxis, np.newaxis]
+            w1 = weights[:, 1, np.newaxis, :, np.newaxis]
+            w2 = weights[:, 2, np.newaxis, np.newaxis, :]
+            potential[begin:end] = (values*w0*w1*w2).sum(axis=(1, 2, 3))
+            if do_field:
+                d0 = derivatives[:, 0, :, np.newaxis, np.newaxis]
+                d1 = derivatives[:, 1, np.newaxis, :, np.newaxis]
+                d2 = derivatives[:, 2, np.newaxis, np.newaxis, :]
+                fractional_gradient = np.array([
+                    (values*d0*w1*w2).sum(axis=(1, 2, 3)),
+                    (values*w0*d1*w2).sum(axis=(1, 2, 3)),
+                    (values*w0*w1*d2).sum(axis=(1, 2, 3)),
+                ]).T
+                field[begin:end] = -np.dot(fractional_gradient, gradient_scale.T)
+        potential += self.background(charges)
+        if do_field:
+            return potential, field
+        return potential
+
+    def _flat_indexes(self, indexes):
+        """Convert Mx3xorder grid indexes into Mxorderxorderxorder flat indexes"""
+        return (
+            indexes[:, 0, :, np.newaxis, np.newaxis]*(self.shape[1]*self.shape[2]) +
+            indexes[:, 1, np.newaxis, :, np.newaxis]*self.shape[2] +
+            indexes[:, 2, np.newaxis, np.newaxis, :]
+        )
+
+
+def _fft_size(size):
+    """Return the smallest integer >= size without prime factors above 7"""
+    while True:
+        tmp = size
+        for factor in 2, 3, 5, 7:
+            while tmp % factor == 0:
+                tmp //= factor
+        if tmp == 1:
+            return size
+        size += 1
+
+
+def _bspline_weights(frac, order):
+    """Evaluate cardinal B-splines and their derivatives
+
+       Arguments:
+        | ``frac``  --  array with values in [0,1[
+        | ``order``  --  the order of the B-spline
+
+       Returns: two arrays with an additional last axis of length ``order``,
+       containing M_n(frac + j) and M_n'(frac + j) for j = 0..order-1.
+    """
+    # M_2(u) = 1 - |u - 1|
+    weights = np.zeros(frac.shape + (order,), float)
+    weights[..., 0] = frac
+    weights[..., 1] = 1 - frac
+    for n in range(3, order + 1):
+        if n == order:
+            derivatives = weights.copy()
+            derivatives[..., 1:] -= weights[..., :-1]
+        new = np.zeros(weights.shape, float)
+        for j in range(n):
+            u = frac + j
+            new[..., j] = u*weights[..., j]
+            if j > 0:
+                new[..., j] += (n - u)*weights[..., j-1]
+        weights = new/(n - 1)
+    if order == 2:
+        derivatives = np.zeros(weights.shape, float)
+        derivatives[..., 0] = 1
+        derivatives[..., 1] = -1
+    return weights, derivatives
+
+
+def _bspline_moduli(size, order):
+    """Return the factors |b(m)|^2 of the SPME influence function"""
+    knots = _bspline_weights(np.zeros(1), order)[0][0]
+    # M_n(k+1) for k = 0..order-2
+    values = knots[1:]
+    m = np.arange(size)
+    phases = np.exp(2j*np.pi*np.outer(m, np.arange(order - 1))/size)
+    denominators = np.dot(phases, values)
+    denominators_sq = abs(denominators)**2
+    # For even orders and odd sizes, the denominator does not vanish. When it
+    # does, the average of the neighboring values is used.
+    small = denominators_sq < 1e-7
+    if small.any():
+        for index in small.nonzero()[0]:
+            denominators_sq[index] = 0.5*(
+                denominators_sq[(index - 1) % size] + denominators_sq[(index + 1) % size]
+            )
+    return 1/denominators_sq
@@ -29,13 +29,143 @@ from __future__ import division
 import numpy as np
 cimport numpy as np
 
+cimport binning
 cimport ff
 cimport graphs
+cimport ic
 cimport molecules
 cimport similarity
 cimport unit_cells
 
 
+#
+# binning.c
+#
+
+
+def binning_counting_sort(long[::1] ids not None, long[::1] order not None,
+                          long[::1] offsets not None):
+    cdef size_t n = ids.shape[0]
+    cdef size_t ncell = offsets.shape[0] - 1
+    if order.shape[0] != n:
+        raise TypeError('order must have the same length as ids.')
+    if n == 0:
+        offsets[:] = 0
+        return
+    if np.asarray(ids).min() < 0 or np.asarray(ids).max() >= ncell:
+        raise ValueError('The ids array contains cell indexes that are out of bounds.')
+    binning.binning_counting_sort(n, &ids[0], ncell, &order[0], &offsets[0])
+
+
+def binning_cell_pairs(long[:, ::1] keys0 not None, long[:, ::1] stencil not None,
+                       long[::1] key_min1 not None, long[::1] shape1 not None,
+                       long[::1] lookup1 not None, size_t icell0,
+                       long[:, ::1] cell_pairs not None,
+                       double[:, ::1] integer_matrix=None,
+                       double[:, ::1] integer_reciprocal=None):
+    cdef size_t ncell_pair
+    if keys0.shape[1] != 3 or stencil.shape[1] != 3:
+        raise TypeError('keys0 and stencil must have three columns.')
+    if key_min1.shape[0] != 3 or shape1.shape[0] != 3:
+        raise TypeError('key_min1 and shape1 must have shape (3,).')
+    if lookup1.shape[0] != np.prod(shape1):
+        raise TypeError('lookup1 must have one element for each cell in the dense grid.')
+    if cell_pairs.shape[1] != 2:
+        raise TypeError('cell_pairs must have two columns.')
+    if cell_pairs.shape[0] < stencil.shape[0]:
+        raise TypeError('cell_pairs must have at least as many rows as stencil.')
+    if (integer_matrix is None) ^ (integer_reciprocal is None):
+        raise TypeError('Either both integer_matrix and integer_reciprocal or given, or both are not given.')
+    if integer_matrix is not None and integer_matrix.shape[0] != 3 and integer_matrix.shape[1] != 3:
+        raise TypeError('integer_matrix must be an array with shape (3, 3)')
+    if integer_reciprocal is not None and integer_reciprocal.shape[0] != 3 and integer_reciprocal.shape[1] != 3:
+        raise TypeError('integer_reciprocal must be an array with shape (3, 3)')
+    if keys0.shape[0] == 0 or stencil.shape[0] == 0:
+        return 0, keys0.shape[0]
+    cdef double* integer_matrix_ptr = NULL
+    cdef double* integer_reciprocal_ptr = NULL
+    if integer_matrix is not None:
+        integer_matrix_ptr = &integer_matrix[0, 0]
+        integer_reciprocal_ptr = &integer_reciprocal[0, 0]
+    cdef size_t ncell0 = keys0.shape[0]
+    cdef size_t nstencil = stencil.shape[0]
+    cdef size_t ncell_pair_max = cell_pairs.shape[0]
+    cdef long* keys0_ptr = &keys0[0, 0]
+    cdef long* stencil_ptr = &stencil[0, 0]
+    cdef long* key_min1_ptr = &key_min1[0]
+    cdef long* shape1_ptr = &shape1[0]
+    cdef long* lookup1_ptr = &lookup1[0]
+    cdef long* cell_pairs_ptr = &cell_pairs[0, 0]
+    with nogil:
+        ncell_pair = binning.binning_cell_pairs(
+            ncell0, keys0_ptr, nstencil, stencil_ptr, key_min1_ptr, shape1_ptr,
+            lookup1_ptr, integer_matrix_ptr != NULL, integer_matrix_ptr,
+            integer_reciprocal_ptr, &icell0, ncell_pair_max, cell_pairs_ptr)
+    return ncell_pair, icell0
+
+
+def binning_pairs(double[:, ::1] cor0 not None, long[::1] order0 not None,
+                  long[::1] offsets0 not None, double[:, ::1] cor1 not None,
+                  long[::1] order1 not None, long[::1] offsets1 not None,
+                  long[:, ::1] cell_pairs not None, size_t icell_pair, bint intra,
+                  double cutoff, long[:, ::1] pairs not None,
+                  double[:, ::1] deltas not None, double[::1] distances not None,
+                  double[:, ::1] matrix=None, double[:, ::1] reciprocal=None,
+                  double[:, ::1] images=None):
+    cdef size_t npair_max = distances.shape[0]
+    cdef size_t npair
+    if cor0.shape[1] != 3 or cor1.shape[1] != 3:
+        raise TypeError('cor0 and cor1 arguments must have three columns.')
+    if order0.shape[0] != cor0.shape[0] or order1.shape[0] != cor1.shape[0]:
+        raise TypeError('order0 and order1 must have the same length as cor0 and cor1.')
+    if cell_pairs.shape[1] != 2:
+        raise TypeError('cell_pairs argument must have two columns.')
+    if pairs.shape[0] != npair_max or pairs.shape[1] != 2:
+        raise TypeError('pairs must have shape (npair_max, 2).')
+    if deltas.shape[0] != npair_max or deltas.shape[1] != 3:
+        raise TypeError('deltas must have shape (npair_max, 3).')
+    if (matrix is None) ^ (reciprocal is None):
+        raise TypeError('Either both matrix and reciprocal or given, or both are not given.')
+    if matrix is not None and matrix.shape[0] != 3 and matrix.shape[1] != 3:
+        raise TypeError('matrix must be an array with shape (3, 3)')
+    if reciprocal is not None and reciprocal.shape[0] != 3 and reciprocal.shape[1] != 3:
+        raise TypeError('reciprocal must be an array with shape (3, 3)')
+    if cell_pairs.shape[0] == 0 or cor0.shape[0] == 0 or cor1.shape[0] == 0:
+        return 0, cell_pairs.shape[0]
+    if images is not None and matrix is None:
+        raise TypeError('images can only be given in combination with matrix and reciprocal.')
+    if images is not None and images.shape[1] != 3:
+        raise TypeError('images must have three columns.')
+    cdef double* matrix_ptr = NULL
+    cdef double* reciprocal_ptr = NULL
+    if matrix is not None:
+        matrix_ptr = &matrix[0, 0]
+        reciprocal_ptr = &reciprocal[0, 0]
+    cdef size_t nimage = 0
+    cdef double* images_ptr = NULL
+    if images is not None and images.shape[0] > 0:
+        nimage = images.shape[0]
+        images_ptr = &images[0, 0]
+    cdef size_t ncell_pair = cell_pairs.shape[0]
+    cdef double* cor0_ptr = &cor0[0, 0]
+    cdef long* order0_ptr = &order0[0]
+    cdef long* offsets0_ptr = &offsets0[0]
+    cdef double* cor1_ptr = &cor1[0, 0]
+    cdef long* order1_ptr = &order1[0]
+    cdef long* offsets1_ptr = &offsets1[0]
+    cdef long* cell_pairs_ptr = &cell_pairs[0, 0]
+    cdef long* pairs_ptr = &pairs[0, 0]
+    cdef double* deltas_ptr = &deltas[0, 0]
+    cdef double* distances_ptr = &distances[0]
+    with nogil:
+        npair = binning.binning_pairs(
+            cor0_ptr, order0_ptr, offsets0_ptr, cor1_ptr, order1_ptr, offsets1_ptr,
+            ncell_pair, cell_pairs_ptr, &icell_pair, intra, cutoff, matrix_ptr != NULL,
+            matrix_ptr, reciprocal_ptr, nimage, images_ptr, npair_max, pairs_ptr,
+            deltas_ptr, distances_ptr)
+    return npair, icell_pair
+
+
 #
 #  ff.c
 #
@@ -158,6 +288,45 @@ def ff_bond_hyper(double[:, ::1] cor not None, long[:, ::1] pairs not None,
             amp, &gradient[0, 0], &matrix[0, 0], &reciprocal[0, 0])
 
 
+def ff_esp_points(double[:, ::1] cor not None, double[:, ::1] points not None,
+                  double[::1] charges=None, double[:, ::1] dipoles=None,
+                  double[::1] esp=None, double[:, ::1] efield=None):
+    cdef size_t natom = cor.shape[0]
+    cdef size_t npoint = points.shape[0]
+    if cor.shape[1] != 3:
+        raise TypeError('cor argument must have three columns.')
+    if points.shape[1] != 3:
+        raise TypeError('points argument must have three columns.')
+    if charges is not None and charges.shape[0] != natom:
+        raise TypeError('charges must have shape (natom,).')
+    if dipoles is not None and (dipoles.shape[0] != natom or dipoles.shape[1] != 3):
+        raise TypeError('dipoles must have shape (natom, 3).')
+    if esp is not None and esp.shape[0] != npoint:
+        raise TypeError('esp must have shape (npoint,).')
+    if efield is not None and (efield.shape[0] != npoint or efield.shape[1] != 3):
+        raise TypeError('efield must have shape (npoint, 3).')
+    if natom == 0 or npoint == 0:
+        return
+    cdef double* cor_ptr = &cor[0, 0]
+    cdef double* points_ptr = &points[0, 0]
+    cdef double* charges_ptr = NULL
+    cdef double* dipoles_ptr = NULL
+    cdef double* esp_ptr = NULL
+    cdef double* efield_ptr = NULL
+    if charges is not None:
+        charges_ptr = &charges[0]
+    if dipoles is not None:
+        dipoles_ptr = &dipoles[0, 0]
+    if esp is not None:
+        esp_ptr = &esp[0]
+    if efield is not None:
+        efield_ptr = &efield[0, 0]
+    with nogil:
+        ff.ff_esp_points(
+            natom, cor_ptr, charges_ptr, dipoles_ptr, npoint, points_ptr,
+            esp_ptr, efield_ptr)
+
+
 #
 # graphs.c
 #
@@ -170,6 +339,167 @@ def graphs_floyd_warshall(long[:, ::1] dm):
     graphs.graphs_floyd_warshall(nvertex, &dm[0, 0])
 
 
+def graphs_bfs_distances(long[::1] indptr not None, long[::1] indices not None,
+                         long[::1] sources not None, long max_distance,
+                         long[:, ::1] dm not None):
+    cdef size_t nvertex = indptr.shape[0] - 1
+    cdef size_t nsource = sources.shape[0]
+    if indptr.shape[0] == 0:
+        raise TypeError('indptr must have at least one element.')
+    if indices.shape[0] != indptr[nvertex]:
+        raise TypeError('The length of indices does not match indptr.')
+    if dm.shape[0] != nsource or dm.shape[1] != nvertex:
+        raise TypeError('dm must have shape (nsource, nvertex).')
+    if nsource == 0 or nvertex == 0:
+        return
+    if np.asarray(sources).min() < 0 or np.asarray(sources).max() >= nvertex:
+        raise ValueError('The sources array contains vertices that are out of bounds.')
+    cdef np.ndarray[long, ndim=1] queue = np.zeros(nvertex, int)
+    cdef long* indptr_ptr = &indptr[0]
+    cdef long* indices_ptr = NULL
+    if indices.shape[0] > 0:
+        indices_ptr = &indices[0]
+    cdef long* sources_ptr = &sources[0]
+    cdef long* queue_ptr = &queue[0]
+    cdef long* dm_ptr = &dm[0, 0]
+    with nogil:
+        graphs.graphs_bfs_distances(
+            nvertex, indptr_ptr, indices_ptr, nsource, sources_ptr,
+            max_distance, queue_ptr, dm_ptr)
+
+
+def graphs_bfs_within(long[::1] indptr not None, long[::1] indices not None,
+                      long[::1] sources not None, size_t isource, long max_distance,
+                      long[::1] work not None, long[::1] counts not None,
+                      long[::1] pair_indices not None, long[::1] pair_distances not None):
+    cdef size_t nvertex = indptr.shape[0] - 1
+    cdef size_t nsource = sources.shape[0]
+    cdef size_t npair_max = pair_indices.shape[0]
+    cdef size_t npair = 0
+    if indptr.shape[0] == 0:
+        raise TypeError('indptr must have at least one element.')
+    if indices.shape[0] != indptr[nvertex]:
+        raise TypeError('The length of indices does not match indptr.')
+    if work.shape[0] != nvertex:
+        raise TypeError('work must have shape (nvertex,).')
+    if counts.shape[0] != nsource:
+        raise TypeError('counts must have shape (nsource,).')
+    if pair_distances.shape[0] != npair_max:
+        raise TypeError('pair_indices and pair_distances must have the same length.')
+    if npair_max + 1 < nvertex:
+        raise TypeError('The output arrays must have at least nvertex-1 elements.')
+    if isource >= nsource or nvertex == 0:
+        return 0, nsource
+    if np.asarray(sources).min() < 0 or np.asarray(sources).max() >= nvertex:
+        raise ValueError('The sources array contains vertices that are out of bounds.')
+    cdef np.ndarray[long, ndim=1] queue = np.zeros(nvertex, int)
+    cdef long* indices_ptr = NULL
+    if indices.shape[0] > 0:
+        indices_ptr = &indices[0]
+    cdef long* pair_indices_ptr = NULL
+    cdef long* pair_distances_ptr = NULL
+    if npair_max > 0:
+        pair_indices_ptr = &pair_indices[0]
+        pair_distances_ptr = &pair_distances[0]
+    with nogil:
+        isource = graphs.graphs_bfs_within(
+            nvertex, &indptr[0], indices_ptr, nsource, &sources[0], isource,
+            max_distance, &queue[0], &work[0], npair_max, &counts[0],
+            pair_indices_ptr, pair_distances_ptr, &npair)
+    return npair, isource
+
+
+#
+# ic.c
+#
+
+
+ctypedef void (*ic_low2_t)(double*, double*, int, double*, double*, double*)
+ctypedef void (*ic_low3_t)(double*, double*, double*, int, double*, double*, double*)
+
+
+cdef double[::1] _ic_vector(r):
+    cdef double[::1] result = np.array(r, dtype=float).ravel()
+    if result.shape[0] != 3:
+        raise TypeError('The relative vectors must have three elements.')
+    return result
+
+
+cdef _ic_results(int size, int deriv):
+    if deriv < 0 or deriv > 2:
+        raise ValueError('deriv must be 0, 1 or 2.')
+    return np.zeros(size, float), np.zeros((size, size), float)
+
+
+cdef tuple _ic_return(double v, d, dd, int deriv):
+    if deriv == 0:
+        return v,
+    elif deriv == 1:
+        return v, d
+    return v, d, dd
+
+
+def ic_bond_length_low(r, int deriv):
+    cdef double[::1] r_ = _ic_vector(r)
+    d, dd = _ic_results(3, deriv)
+    cdef double[::1] d_ = d
+    cdef double[:, ::1] dd_ = dd
+    cdef double v
+    ic.ic_bond_length_low(&r_[0], deriv, &v, &d_[0], &dd_[0, 0])
+    return _ic_return(v, d, dd, deriv)
+
+
+cdef tuple _ic_low2(ic_low2_t fn, a, b, int deriv):
+    cdef double[::1] a_ = _ic_vector(a)
+    cdef double[::1] b_ = _ic_vector(b)
+    d, dd = _ic_results(6, deriv)
+    cdef double[::1] d_ = d
+    cdef double[:, ::1] dd_ = dd
+    cdef double v
+    fn(&a_[0], &b_[0], deriv, &v, &d_[0], &dd_[0, 0])
+    return _ic_return(v, d, dd, deriv)
+
+
+def ic_bend_cos_low(a, b, int deriv):
+    return _ic_low2(ic.ic_bend_cos_low, a, b, deriv)
+
+
+def ic_bend_angle_low(a, b, int deriv):
+    return _ic_low2(ic.ic_bend_angle_low, a, b, deriv)
+
+
+cdef tuple _ic_low3(ic_low3_t fn, a, b, c, int deriv):
+    cdef double[::1] a_ = _ic_vector(a)
+    cdef double[::1] b_ = _ic_vector(b)
+    cdef double[::1] c_ = _ic_vector(c)
+    d, dd = _ic_results(9, deriv)
+    cdef double[::1] d_ = d
+    cdef double[:, ::1] dd_ = dd
+    cdef double v
+    fn(&a_[0], &b_[0], &c_[0], deriv, &v, &d_[0], &dd_[0, 0])
+    return _ic_return(v, d, dd, deriv)
+
+
+def ic_dihed_cos_low(a, b, c, int deriv):
+    return _ic_low3(ic.ic_dihed_cos_low, a, b, c, deriv)
+
+
+def ic_dihed_angle_low(a, b, c, int deriv):
+    return _ic_low3(ic.ic_dihed_angle_low, a, b, c, deriv)
+
+
+def ic_opdist_low(a, b, c, int deriv):
+    return _ic_low3(ic.ic_opdist_low, a, b, c, deriv)
+
+
+def ic_opbend_cos_low(a, b, c, int deriv):
+    return _ic_low3(ic.ic_opbend_cos_low, a, b, c, deriv)
+
+
+def ic_opbend_angle_low(a, b, c, int deriv):
+    return _ic_low3(ic.ic_opbend_angle_low, a, b, c, deriv)
+
+
 #
 # molecules.c
 #
@@ -161,3 +161,46 @@ double ff_bond_hyper(
   }
   return result;
 }
+
+void ff_esp_points(
+  size_t natom, double *cor, double *charges, double *dipoles,
+  size_t npoint, double *points, double *esp, double *efield
+) {
+  size_t i, j;
+  double delta[3], d, d_2, d_3, pot, field[3], q, p_dot, tmp;
+
+  for (i=0; i<npoint; i++) {
+    pot = 0.0;
+    field[0] = 0.0;
+    field[1] = 0.0;
+    field[2] = 0.0;
+    for (j=0; j<natom; j++) {
+      // delta points from the atom to the point
+      d = distance_delta(points + 3*i, cor + 3*j, delta);
+      d_2 = 1.0/(d*d);
+      d_3 = d_2/d;
+      if (charges != NULL) {
+        q = charges[j];
+        pot += q/d;
+        tmp = q*d_3;
+        field[0] += tmp*delta[0];
+        field[1] += tmp*delta[1];
+        field[2] += tmp*delta[2];
+      }
+      if (dipoles != NULL) {
+        p_dot = dipoles[3*j]*delta[0] + dipoles[3*j+1]*delta[1] + dipoles[3*j+2]*delta[2];
+        pot += p_dot*d_3;
+        tmp = 3*p_dot*d_2*d_3;
+        field[0] += tmp*delta[0] - dipoles[3*j  ]*d_3;
+        field[1] += tmp*delta[1] - dipoles[3*j+1]*d_3;
+        field[2] += tmp*delta[2] - dipoles[3*j+2]*d_3;
+      }
+    }
+    if (esp != NULL) esp[i] = pot;
+    if (efield != NULL) {
+      efield[3*i  ] = field[0];
+      efield[3*i+1] = field[1];
+      efield[3*i+2] = field[2];
+    }
+  }
+}
@@ -47,5 +47,9 @@ double ff_bond_hyper(
   double scale, double amp, double *gradient, double *matrix, double *reciprocal
 );
 
+void ff_esp_points(
+  size_t natom, double *cor, double *charges, double *dipoles,
+  size_t npoint, double *points, double *esp, double *efield
+);
 
 #endif  // MOLMOD_FF_H_
@@ -22,7 +22,7 @@
 # --
 
 
-cdef extern from "ff.h":
+cdef extern from "ff.h" nogil:
     double ff_dm_quad(
       size_t natom, int periodic, double *cor, double *dm0, double *dmk,
       double amp, double *gradient, double *matrix, double *reciprocal
@@ -42,3 +42,8 @@ cdef extern from "ff.h":
       size_t npair, int periodic, double *cor, long *pairs, double *lengths,
       double scale, double amp, double *gradient, double *matrix, double *reciprocal
     )
+
+    void ff_esp_points(
+      size_t natom, double *cor, double *charges, double *dipoles,
+      size_t npoint, double *points, double *esp, double *efield
+    )
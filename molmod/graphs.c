@@ -48,3 +48,99 @@ void graphs_floyd_warshall(size_t n, long* dm) {
     }
   }
 }
+
+
+void graphs_bfs_distances(
+  size_t nvertex, long* indptr, long* indices, size_t nsource, long* sources,
+  long max_distance, long* queue, long* dm
+) {
+  // Breadth-first search from each source. The neighbors of vertex i are
+  // indices[indptr[i]:indptr[i+1]]. Each row of dm is filled with the
+  // distances from the corresponding source. Vertices that can not be reached
+  // within max_distance (negative means unlimited) get a distance of zero.
+  size_t isource, i, head, tail;
+  long vertex, neighbor, d, k;
+  long* row;
+
+  for (isource=0; isource<nsource; isource++) {
+    row = dm + isource*nvertex;
+    for (i=0; i<nvertex; i++) row[i] = -1;
+    vertex = sources[isource];
+    row[vertex] = 0;
+    queue[0] = vertex;
+    head = 0;
+    tail = 1;
+    while (head < tail) {
+      vertex = queue[head];
+      head++;
+      d = row[vertex];
+      if (d == max_distance) continue;
+      for (k=indptr[vertex]; k<indptr[vertex+1]; k++) {
+        neighbor = indices[k];
+        if (row[neighbor] == -1) {
+          row[neighbor] = d+1;
+          queue[tail] = neighbor;
+          tail++;
+        }
+      }
+    }
+    for (i=0; i<nvertex; i++) {
+      if (row[i] == -1) row[i] = 0;
+    }
+  }
+}
+
+
+size_t graphs_bfs_within(
+  size_t nvertex, long* indptr, long* indices, size_t nsource, long* sources,
+  size_t isource, long max_distance, long* queue, long* work, size_t npair_max,
+  long* counts, long* pair_indices, long* pair_distances, size_t* npair
+) {
+  // Truncated breadth-first search from the sources, starting at isource.
+  // For each source, the vertices within max_distance (excluding the source)
+  // and their distances are appended to pair_indices and pair_distances, and
+  // their number is stored in counts. The work array must contain -1 for all
+  // vertices and is restored before returning, such that each search only
+  // costs a time proportional to the number of visited vertices. The search
+  // stops when the results of the next source do not fit in the output
+  // arrays. The index of that source is returned. When npair_max is at least
+  // nvertex-1, at least one source is always processed.
+  size_t head, tail, i, n;
+  long vertex, neighbor, d, k;
+
+  n = 0;
+  for (; isource<nsource; isource++) {
+    vertex = sources[isource];
+    work[vertex] = 0;
+    queue[0] = vertex;
+    head = 0;
+    tail = 1;
+    while (head < tail) {
+      vertex = queue[head];
+      head++;
+      d = work[vertex];
+      if (d == max_distance) continue;
+      for (k=indptr[vertex]; k<indptr[vertex+1]; k++) {
+        neighbor = indices[k];
+        if (work[neighbor] == -1) {
+          work[neighbor] = d+1;
+          queue[tail] = neighbor;
+          tail++;
+        }
+      }
+    }
+    if ((n > 0) && (n + tail - 1 > npair_max)) {
+      for (i=0; i<tail; i++) work[queue[i]] = -1;
+      break;
+    }
+    counts[isource] = tail - 1;
+    for (i=1; i<tail; i++) {
+      pair_indices[n] = queue[i];
+      pair_distances[n] = work[queue[i]];
+      n++;
+    }
+    for (i=0; i<tail; i++) work[queue[i]] = -1;
+  }
+  *npair = n;
+  return isource;
+}
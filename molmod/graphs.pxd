@@ -22,5 +22,16 @@
 # --
 
 
-cdef extern from "graphs.h":
+cdef extern from "graphs.h" nogil:
     void graphs_floyd_warshall(size_t n, long* dm)
+
+    void graphs_bfs_distances(
+      size_t nvertex, long* indptr, long* indices, size_t nsource, long* sources,
+      long max_distance, long* queue, long* dm
+    )
+
+    size_t graphs_bfs_within(
+      size_t nvertex, long* indptr, long* indices, size_t nsource, long* sources,
+      size_t isource, long max_distance, long* queue, long* work, size_t npair_max,
+      long* counts, long* pair_indices, long* pair_distances, size_t* npair
+    )
@@ -29,8 +29,8 @@
      http://en.wikipedia.org/wiki/Dijkstra's_algorithm for more info.
    * Iterating over vertices or edges using the Breadth First convention. See
      http://en.wikipedia.org/wiki/Breadth-first_search for more info.
-   * The all pairs shortest path matrix (Floyd-Warshall). See
-     http://en.wikipedia.org/wiki/Floyd-Warshall_algorithm for more info.
+   * The all pairs shortest path matrix (breadth-first search from each
+     vertex), optionally truncated and row by row.
    * Symmetry analysis of graphs (automorphisms). The Graph class can generate a
      list of permutations between vertices that map the graph onto itself. This
      can be used to generate (and test) all possible geometric symmetries in a
@@ -42,6 +42,8 @@
      automorphisms, ... The pattern_graph can deal with (multiple sets of)
      additional conditions that must be satisfied, such as "give me all
      dihedral angles where the central atoms are carbons" without duplicates.
+     The VF2GraphSearch finds the same matches with a pruned, vertex by
+     vertex search, which is much faster on large subject graphs.
 
    The central class in this module is 'Graph'. It caches most of the analysis
    results, which implies that the graph structure can not be changed once the
@@ -57,6 +59,7 @@ import copy
 
 import numpy as np
 
+from molmod.clusters import connected_components
 from molmod.utils import cached, ReadOnly, ReadOnlyAttribute
 
 
@@ -64,14 +67,61 @@ __all__ = [
     "GraphError", "Graph", "OneToOne", "Match", "Pattern",
     "CriteriaSet", "Anything", "CritOr", "CritAnd", "CritXor", "CritNot",
     "CustomPattern", "EqualPattern", "RingPattern", "GraphSearch",
+    "VF2GraphSearch",
 ]
 
 
+def _mix64(z):
+    """The finalizer of the splitmix64 random number generator"""
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return z ^ (z >> np.uint64(31))
+
+
+def _hash_rows(rows):
+    """Hash each row of 20 bytes into a new row of 20 bytes
+
+       This is a vectorized replacement for the SHA1 hash of each row. The
+       bytes are interpreted as little-endian words, so the result does not
+       depend on the platform.
+    """
+    words = np.ascontiguousarray(rows).view("<u4").astype(np.uint64)
+    golden = np.uint64(0x9e3779b97f4a7c15)
+    state = np.zeros(len(rows), np.uint64)
+    for i in range(words.shape[1]):
+        state = _mix64((state + golden) ^ words[:, i])
+    result = np.zeros((len(rows), 3), "<u8")
+    for i in range(3):
+        state = _mix64(state + golden)
+        result[:, i] = state
+    return np.ascontiguousarray(result.view(np.ubyte)[:, :20])
+
+
 class GraphError(Exception):
     """Raised when something goes wrong in one of the graph algorithms"""
     pass
 
 
+class EdgesAttribute(ReadOnlyAttribute):
+    """The read-only edges attribute of a Graph
+
+       When a graph is constructed from an edge array, the tuple of frozensets
+       is only created when the edges attribute is accessed for the first
+       time.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        result = getattr(instance, self.attribute_name, None)
+        if result is None:
+            edge_array = getattr(instance, "_edge_array", None)
+            if edge_array is not None:
+                result = tuple(frozenset(edge) for edge in edge_array.tolist())
+                setattr(instance, self.attribute_name, result)
+        return result
+
+
 class Graph(ReadOnly):
     """An undirected graph, where edges have equal weight
 
@@ -101,7 +151,7 @@ class Graph(ReadOnly):
        >>> # bond orders of ethene
        >>> graph.edge_property = np.array([2, 1, 1, 1, 1], int)
     """
-    edges = ReadOnlyAttribute(tuple, none=False, doc="the incidence list")
+    edges = EdgesAttribute(tuple, none=False, doc="the incidence list")
     num_vertices = ReadOnlyAttribute(int, none=False, doc="the number of vertices")
 
     def __init__(self, edges, num_vertices=None):
@@ -115,27 +165,43 @@ class Graph(ReadOnly):
            num_vertices argument to tell what the total number of vertices is.
 
            If the edges argument does not have the correct format, it will be
-           converted.
+           converted. When the edges are given as an integer numpy array with
+           shape (E, 2), they are validated with array operations and the
+           tuple of frozensets is only created when it is needed. (See
+           :meth:`from_edge_array`.)
         """
 
-        tmp = []
-        for edge in edges:
-            if len(edge) != 2:
+        if isinstance(edges, np.ndarray) and edges.dtype.kind in "iu":
+            edge_array = np.array(edges, int)
+            if edge_array.size == 0:
+                edge_array = edge_array.reshape(0, 2)
+            if edge_array.ndim != 2 or edge_array.shape[1] != 2:
                 raise TypeError("The edges must be a iterable with 2 elements")
-            i, j = edge
-            i = int(i)
-            j = int(j)
-            if i == j:
+            if (edge_array[:, 0] == edge_array[:, 1]).any():
                 raise ValueError("A edge must contain two different values.")
-            if i < 0 or j < 0:
+            if (edge_array < 0).any():
                 raise TypeError("The edges must contain positive integers.")
-            tmp.append(frozenset([i, j]))
-        edges = tuple(tmp)
-
-        if len(edges) == 0:
+        else:
+            tmp = []
+            for edge in edges:
+                if len(edge) != 2:
+                    raise TypeError("The edges must be a iterable with 2 elements")
+                i, j = edge
+                i = int(i)
+                j = int(j)
+                if i == j:
+                    raise ValueError("A edge must contain two different values.")
+                if i < 0 or j < 0:
+                    raise TypeError("The edges must contain positive integers.")
+                tmp.append((i, j))
+            edge_array = np.array(tmp, int).reshape(-1, 2)
+            self.edges = tuple(frozenset(edge) for edge in tmp)
+        self._edge_array = edge_array
+
+        if len(edge_array) == 0:
             real_num_vertices = 0
         else:
-            real_num_vertices = max(max(a, b) for a, b in edges)+1
+            real_num_vertices = int(edge_array.max())+1
         if num_vertices is not None:
             if not isinstance(num_vertices, int):
                 raise TypeError("The optional argument num_vertices must be an "
@@ -145,12 +211,44 @@ class Graph(ReadOnly):
                     "number of vertices deduced from the edge list.")
             real_num_vertices = num_vertices
 
-        self.edges = edges
         self.num_vertices = real_num_vertices
 
-    num_edges = property(lambda self: len(self.edges),
+    @classmethod
+    def from_edge_array(cls, edge_array, num_vertices=None):
+        """Construct a graph from an integer array with shape (E, 2)
+
+           Arguments:
+            | ``edge_array`` -- the vertex indexes of each edge
+
+           Optional argument:
+            | ``num_vertices`` -- number of vertices
+
+           This is much faster than the default constructor for large graphs
+           because the edges are validated with array operations. The tuple
+           of frozensets in the edges attribute is only created when it is
+           used. Algorithms that work with the compressed sparse row
+           representation (see :attr:`csr`) never need it.
+        """
+        edge_array = np.asarray(edge_array)
+        if edge_array.dtype.kind not in "iu":
+            raise TypeError("The edge array must contain integers.")
+        return cls(edge_array, num_vertices)
+
+    def __setstate__(self, state):
+        """Part of the pickle protocol"""
+        # The edge array must be restored first because the checks of
+        # subclasses, e.g. MolecularGraph._check_orders, use num_edges.
+        self._edge_array = np.array([tuple(edge) for edge in state["edges"]], int).reshape(-1, 2)
+        ReadOnly.__setstate__(self, state)
+
+    num_edges = property(lambda self: len(self._edge_array),
         doc="*Read-only attribute:* the number of edges in the graph.")
 
+    edge_array = property(lambda self: self._edge_array.view(),
+        doc="*Read-only attribute:* an integer array with shape (E, 2) with "
+        "the vertex indexes of all edges, in the same order as the edges "
+        "attribute.")
+
     def __mul__(self, repeat):
         """Construct a graph that repeats this graph a number of times
 
@@ -191,6 +289,58 @@ class Graph(ReadOnly):
 
     # cached attributes:
 
+    @cached
+    def csr(self):
+        """The adjacency matrix in compressed sparse row format
+
+           A tuple ``(indptr, indices, edge_indexes)`` of int32 arrays. The
+           neighbors of vertex ``i`` are ``indices[indptr[i]:indptr[i+1]]``,
+           sorted in increasing order, and ``edge_indexes`` contains the
+           corresponding indexes in the edges attribute.
+        """
+        edge_array = self._edge_array
+        num_edges = len(edge_array)
+        sources = np.concatenate([edge_array[:, 0], edge_array[:, 1]])
+        targets = np.concatenate([edge_array[:, 1], edge_array[:, 0]])
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(self.num_vertices+1, np.int32)
+        np.cumsum(np.bincount(sources, minlength=self.num_vertices), out=indptr[1:])
+        indices = targets[order].astype(np.int32)
+        edge_indexes = (order % max(num_edges, 1)).astype(np.int32)
+        return indptr, indices, edge_indexes
+
+    @cached
+    def _adjacency(self):
+        """The arrays indptr and indices with the integer type of the C extension"""
+        indptr, indices = self.csr[:2]
+        return indptr.astype(int), indices.astype(int)
+
+    @cached
+    def _csr_lists(self):
+        """The arrays of the csr attribute as Python lists
+
+           Pure Python loops over the adjacency are much faster with lists
+           than with numpy arrays.
+        """
+        return tuple(array.tolist() for array in self.csr)
+
+    def get_neighbors(self, vertex):
+        """Return an (int32) array with the sorted neighbors of a vertex"""
+        indptr, indices = self.csr[:2]
+        return indices[indptr[vertex]:indptr[vertex+1]]
+
+    def get_edge_index(self, vertex1, vertex2):
+        """Return the index of the edge between two vertices
+
+           Returns None if the vertices are not connected.
+        """
+        indptr, indices, edge_indexes = self.csr
+        begin = indptr[vertex1]
+        end = indptr[vertex1+1]
+        pos = begin + np.searchsorted(indices[begin:end], vertex2)
+        if pos < end and indices[pos] == vertex2:
+            return int(edge_indexes[pos])
+
     @cached
     def edge_index(self):
         """A map to look up the index of a edge"""
@@ -206,42 +356,214 @@ class Graph(ReadOnly):
            implies that the following elements are part of the dictionary:
            ``{vertexY1: (vertexX, ...), vertexY2: (vertexX, ...), ...}``.
         """
-        neighbors = dict(
-            (vertex, []) for vertex
-            in range(self.num_vertices)
+        indptr, indices = self._csr_lists[:2]
+        return dict(
+            (vertex, frozenset(indices[indptr[vertex]:indptr[vertex+1]]))
+            for vertex in range(self.num_vertices)
         )
-        for a, b in self.edges:
-            neighbors[a].append(b)
-            neighbors[b].append(a)
-        # turn lists into frozensets
-        neighbors = dict((key, frozenset(val)) for key, val in neighbors.items())
-        return neighbors
 
     @cached
     def distances(self):
-        """The matrix with the all-pairs shortest path lenghts"""
-        from molmod.ext import graphs_floyd_warshall
-        distances = np.zeros((self.num_vertices,)*2, dtype=int)
-        #distances[:] = -1 # set all -1, which is just a very big integer
-        #distances.ravel()[::len(distances)+1] = 0 # set diagonal to zero
-        for i, j in self.edges: # set edges to one
-            distances[i, j] = 1
-            distances[j, i] = 1
-        graphs_floyd_warshall(distances)
-        return distances
+        """The matrix with the all-pairs shortest path lenghts
+
+           Disconnected vertices have a distance of zero. The matrix is
+           computed with a breadth-first search from every vertex. See
+           :meth:`get_distances` and :meth:`iter_distance_rows` for compact
+           and truncated alternatives that do not require a full integer
+           matrix.
+        """
+        return self.get_distances(dtype=int)
+
+    distance_block_size = 256
+
+    def _get_distance_dtype(self, max_distance):
+        """The smallest unsigned integer type that can hold all distances"""
+        if max_distance is None or max_distance < 0:
+            max_distance = self.num_vertices - 1
+        for dtype in np.uint8, np.uint16, np.uint32:
+            if max_distance <= np.iinfo(dtype).max:
+                return dtype
+        return np.uint64
+
+    def iter_distance_rows(self, sources=None, max_distance=None, dtype=None):
+        """Iterate over rows of the distance matrix
+
+           Optional arguments:
+            | ``sources``  --  the vertices for which the rows are computed.
+                               [default=all vertices]
+            | ``max_distance``  --  the breadth-first search is not continued
+                                    beyond this distance. [default=None,
+                                    unlimited]
+            | ``dtype``  --  the integer type of the rows. [default=the
+                             smallest unsigned type that can represent all
+                             distances]
+
+           Yields (source, row) pairs, where row is an array with the graph
+           distances from the source to all vertices. Vertices that can not be
+           reached within ``max_distance`` get a distance of zero, just like
+           the source itself. The rows are computed with the C extension in
+           blocks of ``distance_block_size`` sources, which is O(V+E) per row.
+        """
+        from molmod.ext import graphs_bfs_distances
+        if sources is None:
+            sources = np.arange(self.num_vertices)
+        else:
+            sources = np.array(sources, int).ravel()
+        if dtype is None:
+            dtype = self._get_distance_dtype(max_distance)
+        if max_distance is None:
+            max_distance = -1
+        elif max_distance < 0:
+            raise ValueError("max_distance must be positive.")
+        indptr, indices = self._adjacency
+        for begin in range(0, len(sources), self.distance_block_size):
+            block = sources[begin:begin+self.distance_block_size]
+            work = np.zeros((len(block), self.num_vertices), int)
+            graphs_bfs_distances(indptr, indices, block, max_distance, work)
+            work = work.astype(dtype)
+            for source, row in zip(block, work):
+                yield source, row
+
+    def get_distances(self, sources=None, max_distance=None, dtype=None):
+        """Compute (a part of) the distance matrix
+
+           All arguments are optional and have the same meaning as in
+           :meth:`iter_distance_rows`. The result is an array with shape
+           (len(sources), num_vertices).
+        """
+        if sources is None:
+            nsource = self.num_vertices
+        else:
+            nsource = len(np.array(sources, int).ravel())
+        if dtype is None:
+            dtype = self._get_distance_dtype(max_distance)
+        result = np.zeros((nsource, self.num_vertices), dtype)
+        for index, (source, row) in enumerate(self.iter_distance_rows(sources, max_distance, dtype)):
+            result[index] = row
+        return result
+
+    @cached
+    def _distances_within_cache(self):
+        """Results of distances_within, with max_distance as key"""
+        return {}
+
+    def distances_within(self, max_distance):
+        """The sparse matrix with all graph distances up to a given bound
+
+           Argument:
+            | ``max_distance``  --  the largest graph distance that is included
+
+           Returns: ``indptr``, ``indices``, ``distances``. These are integer
+           arrays in the compressed sparse row format, similar to :attr:`csr`.
+           The vertices within ``max_distance`` of vertex i, excluding i itself,
+           are ``indices[indptr[i]:indptr[i+1]]`` (sorted) and their distances
+           are ``distances[indptr[i]:indptr[i+1]]``.
+
+           The result is computed with a truncated breadth-first search from
+           each vertex with the C extension. The memory usage is proportional
+           to the number of pairs within the bound, instead of the square of
+           the number of vertices as in :attr:`distances`. Results are cached
+           for each value of ``max_distance``. A smaller bound is derived from
+           a larger cached bound without a new search.
+        """
+        if max_distance < 0:
+            raise ValueError("max_distance must be positive.")
+        cache = self._distances_within_cache
+        result = cache.get(max_distance)
+        if result is not None:
+            return result
+        larger = [key for key in cache if key > max_distance]
+        if len(larger) > 0:
+            indptr, indices, distances = cache[min(larger)]
+            mask = distances <= max_distance
+            rows = np.repeat(np.arange(self.num_vertices), indptr[1:] - indptr[:-1])
+            new_indptr = np.zeros(self.num_vertices+1, int)
+            new_indptr[1:] = np.bincount(rows[mask], minlength=self.num_vertices).cumsum()
+            result = new_indptr, indices[mask], distances[mask]
+        else:
+            result = self._compute_distances_within(max_distance)
+        cache[max_distance] = result
+        return result
+
+    def _compute_distances_within(self, max_distance):
+        """Run the truncated breadth-first search for distances_within"""
+        from molmod.ext import graphs_bfs_within
+        indptr, indices = self._adjacency
+        sources = np.arange(self.num_vertices)
+        counts = np.zeros(self.num_vertices, int)
+        work = -np.ones(self.num_vertices, int)
+        npair_max = max(self.num_vertices, 4*len(indices))
+        chunks = []
+        isource = 0
+        while isource < self.num_vertices:
+            pair_indices = np.zeros(npair_max, int)
+            pair_distances = np.zeros(npair_max, int)
+            npair, begin = graphs_bfs_within(
+                indptr, indices, sources, isource, max_distance, work, counts,
+                pair_indices, pair_distances
+            )
+            # sort the vertices in each row
+            rows = np.repeat(np.arange(isource, begin), counts[isource:begin])
+            order = np.lexsort((pair_indices[:npair], rows))
+            chunks.append((pair_indices[order], pair_distances[order]))
+            isource = begin
+        result_indptr = np.zeros(self.num_vertices+1, int)
+        result_indptr[1:] = counts.cumsum()
+        if len(chunks) == 0:
+            return result_indptr, np.zeros(0, int), np.zeros(0, int)
+        return (
+            result_indptr,
+            np.concatenate([chunk[0] for chunk in chunks]),
+            np.concatenate([chunk[1] for chunk in chunks]),
+        )
+
+    def get_pair_distances(self, vertices1, vertices2, max_distance):
+        """Look up the graph distances for arrays of vertex pairs
+
+           Arguments:
+            | ``vertices1``, ``vertices2``  --  integer arrays with the vertices
+                                                of each pair
+            | ``max_distance``  --  the largest graph distance of interest
+
+           Returns an integer array with the graph distances. Pairs that are
+           further apart than ``max_distance`` (or not connected) get a
+           distance of zero, just like pairs of identical vertices. See
+           :meth:`distances_within`.
+        """
+        vertices1 = np.asarray(vertices1, int)
+        vertices2 = np.asarray(vertices2, int)
+        indptr, indices, distances = self.distances_within(max_distance)
+        rows = np.repeat(np.arange(self.num_vertices), indptr[1:] - indptr[:-1])
+        keys = rows*self.num_vertices + indices
+        queries = vertices1*self.num_vertices + vertices2
+        positions = np.searchsorted(keys, queries)
+        positions[positions == len(keys)] = 0
+        result = np.zeros(queries.shape, int)
+        if len(keys) > 0:
+            found = keys[positions] == queries
+            result[found] = distances[positions[found]]
+        return result
+
+    @cached
+    def eccentricities(self):
+        """The maximum distance of each vertex to any other (connected) vertex"""
+        result = np.zeros(self.num_vertices, int)
+        for source, row in self.iter_distance_rows():
+            result[source] = row.max()
+        return result
 
     @cached
     def max_distance(self):
         """The maximum value in the distances matrix."""
-        if self.distances.shape[0] == 0:
+        if self.num_vertices == 0:
             return 0
         else:
-            return self.distances.max()
+            return self.eccentricities.max()
 
     @cached
     def central_vertices(self):
         """Vertices that have the lowest maximum distance to any other vertex"""
-        max_distances = self.distances.max(0)
+        max_distances = self.eccentricities
         max_distances_min = max_distances[max_distances > 0].min()
         return (max_distances == max_distances_min).nonzero()[0]
 
@@ -254,6 +576,15 @@ class Graph(ReadOnly):
         """
         return self.central_vertices[0]
 
+    @cached
+    def component_labels(self):
+        """The index of the connected component of each vertex
+
+           The components are numbered in the same order as in
+           :attr:`independent_vertices`.
+        """
+        return connected_components(self._edge_array, self.num_vertices)
+
     @cached
     def independent_vertices(self):
         """Lists of vertices that are only interconnected within each list
@@ -262,21 +593,13 @@ class Graph(ReadOnly):
            vertex in another list. In case of a molecular graph, this would
            yield the atoms that belong to individual molecules.
         """
-        candidates = set(range(self.num_vertices))
-
-        result = []
-        while len(candidates) > 0:
-            pivot = candidates.pop()
-            group = [
-                vertex for vertex, distance
-                in self.iter_breadth_first(pivot)
-            ]
-            candidates.difference_update(group)
-
-            # this sort makes sure that the order of the vertices is respected
-            group.sort()
-            result.append(group)
-        return result
+        if self.num_vertices == 0:
+            return []
+        labels = self.component_labels
+        # a stable sort makes sure that the order of the vertices is respected
+        order = labels.argsort(kind="mergesort")
+        bounds = np.bincount(labels).cumsum()[:-1]
+        return [group.tolist() for group in np.split(order, bounds)]
 
     @cached
     def fingerprint(self):
@@ -322,19 +645,104 @@ class Graph(ReadOnly):
                 level2[vertex] = vertices
         return level2
 
+    @cached
+    def _symmetry_transversals(self):
+        """Base vertices and coset representatives of the automorphism group
+
+           The automorphism group G has a chain of subgroups G_k that fix the
+           first k base vertices. For each k, the second item in the result
+           contains a list of permutations (tuples with the image of each
+           vertex) that map the (k+1)-th base vertex onto each vertex of its
+           orbit under G_k. Every symmetry can be written in a unique way as a
+           product u_0*u_1*..., with one permutation from each list.
+        """
+        if len(self.independent_vertices) != 1:
+            raise ValueError("The symmetries of a disconnected graph are not "
+                             "supported.")
+        order, certificate, base, generators = self._individualize_refine(False)
+        identity = tuple(range(self.num_vertices))
+        result = []
+        for k, vertex in enumerate(base):
+            # the generators of the stabilizer of the first k base vertices
+            permutations = []
+            for generator in generators:
+                if not any(other in generator for other in base[:k]):
+                    permutations.append(tuple(generator.get(i, i) for i in identity))
+            # the orbit of the base vertex, with the representatives
+            representatives = {vertex: identity}
+            todo = [vertex]
+            for current in todo:
+                for permutation in permutations:
+                    image = permutation[current]
+                    if image not in representatives:
+                        representative = representatives[current]
+                        representatives[image] = tuple(permutation[i] for i in representative)
+                        todo.append(image)
+            result.append([representatives[image] for image in todo])
+        return base, result
+
+    @cached
+    def symmetry_generators(self):
+        """A set of graph symmetries that generates all other symmetries
+
+           The symmetries (EqualMatch objects) are computed with a search
+           tree with partition refinement and orbit pruning, see
+           :meth:`_individualize_refine`, without enumerating all symmetries.
+        """
+        result = []
+        for transversal in self._symmetry_transversals[1]:
+            for permutation in transversal[1:]:
+                result.append(self._get_symmetry(permutation))
+        return result
+
+    @cached
+    def num_symmetries(self):
+        """The number of graph symmetries (the order of the automorphism group)"""
+        result = 1
+        for transversal in self._symmetry_transversals[1]:
+            result *= len(transversal)
+        return result
+
+    def _get_symmetry(self, permutation):
+        """Convert a permutation (tuple) into an EqualMatch object"""
+        result = EqualMatch(enumerate(permutation))
+        result.cycles = result.get_closed_cycles()
+        return result
+
+    def iter_symmetries(self, prune=None):
+        """Iterate over all graph symmetries, without storing them
+
+           Optional argument:
+            | ``prune``  --  a function that accepts a dictionary with images
+                             of a few vertices. When it returns True, no
+                             symmetry with these images is generated.
+
+           The symmetries are EqualMatch objects. They are constructed as
+           products of the permutations in :attr:`_symmetry_transversals`. After
+           each factor, the images of one more base vertex are fixed, which are
+           given to the ``prune`` function.
+        """
+        base, transversals = self._symmetry_transversals
+
+        def iter_products(k, product):
+            """Multiply the partial product with all permutations at level k"""
+            if k == len(transversals):
+                yield product
+                return
+            for permutation in transversals[k]:
+                new_product = tuple(product[i] for i in permutation)
+                if prune is not None and prune(dict((vertex, new_product[vertex]) for vertex in base[:k+1])):
+                    continue
+                for result in iter_products(k+1, new_product):
+                    yield result
+
+        for permutation in iter_products(0, tuple(range(self.num_vertices))):
+            yield self._get_symmetry(permutation)
+
     @cached
     def symmetries(self):
         """Graph symmetries (permutations) that map the graph onto itself."""
-
-        symmetry_cycles = set([])
-        symmetries = set([])
-        for match in GraphSearch(EqualPattern(self))(self):
-            match.cycles = match.get_closed_cycles()
-            if match.cycles in symmetry_cycles:
-                raise RuntimeError("Duplicates in EqualMatch")
-            symmetry_cycles.add(match.cycles)
-            symmetries.add(match)
-        return symmetries
+        return set(self.iter_symmetries())
 
     @cached
     def symmetry_cycles(self):
@@ -350,7 +758,8 @@ class Graph(ReadOnly):
 
            This routine will return a list of vertices in an order that does not
            depend on the initial order, but only depends on the connectivity and
-           the return values of the function self.get_vertex_string.
+           the return values of the functions self.get_vertex_string and
+           self.get_edge_string.
 
            Only the vertices that are involved in edges will be included. The
            result can be given as first argument to self.get_subgraph, with
@@ -362,21 +771,40 @@ class Graph(ReadOnly):
            ordering that feels like natural, i.e. starting in the center and
            pushing vertices with few equivalents to the front. If necessary, the
            nature of the vertices and  their bonds to atoms closer to the center
-           will also play a role, but only as a last resort.
+           will also play a role, but only as a last resort. When this is not
+           sufficient to fix the order, e.g. for symmetric molecules, a complete
+           canonical labeling algorithm is used, see
+           :meth:`_individualize_refine`.
         """
+        if self.num_edges == 0:
+            return []
+        components = [group for group in self.independent_vertices if len(group) > 1]
+        if len(components) > 1:
+            # Each connected component gets its own canonical order. The
+            # components are sorted by their size, vertex strings and
+            # certificates, which are equal for isomorphic components. This
+            # avoids a search over all permutations of identical components.
+            records = []
+            for group in components:
+                order, certificate = self._individualize_refine(True, group)[:2]
+                vertex_strings = [self.get_vertex_string(vertex) for vertex in order]
+                records.append((len(order), vertex_strings, certificate, order))
+            records.sort(key=(lambda record: record[:-1]), reverse=True)
+            return [vertex for record in records for vertex in record[-1]]
         # A) find an appropriate starting vertex.
         # Here we take a central vertex that has a minimal number of symmetrical
         # equivalents, 'the highest atom number', and the highest fingerprint.
         # Note that the symmetrical equivalents are computed from the vertex
         # fingerprints, i.e. without the GraphSearch.
-        starting_vertex = max(
+        candidates = sorted((
             (
                 -len(self.equivalent_vertices[vertex]),
                 self.get_vertex_string(vertex),
                 self.vertex_fingerprints[vertex].tobytes(),
                 vertex
             ) for vertex in self.central_vertices
-        )[-1]
+        ), reverse=True)
+        starting_vertex = candidates[0][-1]
 
         # B) sort all vertices based on
         #      1) distance from central vertex
@@ -402,28 +830,214 @@ class Graph(ReadOnly):
         # C) The order of some vertices is still not completely set. e.g.
         # consider the case of allene. The four hydrogen atoms are equivalent,
         # but one can have two different orders: make geminiles consecutive or
-        # don't. It is more trikcy than one would think at first sight. In the
-        # case of allene, geminility could easily solve the problem. Consider a
-        # big flat rotationally symmetric molecule (order 2). The first five
-        # shells are order 4 and one would just give a random order to four
-        # segemnts in the first shell. Only when one reaches the outer part that
-        # has order two, it turns out that the arbitrary choices in the inner
-        # shell play a role. So it does not help to look at relations with
-        # vertices at inner or current shells only. One has to consider the
-        # whole picture. (unit testing reveals troubles like these)
-
-        # I need some sleep now. The code below checks for potential fuzz and
-        # will raise an error if the ordering is not fully determined yet. One
-        # day, I'll need this code more than I do now, and I'll fix things up.
-        # I know how to do this, but I don't care enough right now.
-        # -- Toon
+        # don't. The same is true when the starting vertex is not unique. In
+        # these cases the complete search takes over. The outcome of the test
+        # below is itself invariant under a permutation of the vertices.
+        fuzzy = len(candidates) > 1 and candidates[0][:-1] == candidates[1][:-1]
         for i in range(1, len(l)):
-            if l[i][:-1] == l[i-1][:-1]:
-                raise NotImplementedError
+            if fuzzy or l[i][:-1] == l[i-1][:-1]:
+                fuzzy = True
+                break
+        if fuzzy:
+            return self._individualize_refine(True)[0]
 
         # D) Return only the vertex indexes.
         return [record[-1] for record in l]
 
+    @cached
+    def canonical_hash(self):
+        """A hash of the graph in the canonical order (a hexadecimal string)
+
+           Isomorphic graphs, with the same vertex and edge strings, get the
+           same hash. Apart from the (tiny) chance of a collision, different
+           graphs get a different hash. Just like in :attr:`canonical_order`,
+           vertices without edges are ignored.
+        """
+        import hashlib
+        order = self.canonical_order
+        relabel = dict((vertex, i) for i, vertex in enumerate(order))
+        lines = [self.get_vertex_string(vertex) for vertex in order]
+        edges = sorted(
+            (min(relabel[a], relabel[b]), max(relabel[a], relabel[b]), self.get_edge_string(i))
+            for i, (a, b) in enumerate(tuple(edge) for edge in self.edges)
+        )
+        lines.extend("%i %i %s" % edge for edge in edges)
+        return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+    def _refine_colors(self, colors, neighbors):
+        """Refine a coloring of the vertices until it is equitable
+
+           Arguments:
+            | ``colors``  --  a dictionary with a color (integer) for each
+                              vertex that takes part in the refinement
+            | ``neighbors``  --  a dictionary with for each of these vertices
+                                 a list of (neighbor, edge string) pairs
+
+           A new color is assigned to each vertex, based on its current color
+           and the (sorted) colors of its neighbors and the connecting edges.
+           The new colors are ranks of these keys, so the order of the colors
+           is preserved and the result only depends on the graph structure.
+           This is repeated until the number of colors no longer changes.
+        """
+        num_colors = len(set(colors))
+        while True:
+            keys = dict(
+                (vertex, (color, tuple(sorted(
+                    (colors[neighbor], edge_string)
+                    for neighbor, edge_string in neighbors[vertex]
+                )))) for vertex, color in colors.items()
+            )
+            ranks = dict((key, rank) for rank, key in enumerate(sorted(set(keys.values()))))
+            colors = dict((vertex, ranks[key]) for vertex, key in keys.items())
+            if len(ranks) == num_colors:
+                return colors
+            num_colors = len(ranks)
+
+    def _individualize_refine(self, canonical, vertices=None):
+        """Search tree with individualization and refinement
+
+           Argument:
+            | ``canonical``  --  When True, the canonical order is searched.
+                                 Otherwise, only the generators of the
+                                 automorphism group are needed, which allows
+                                 more branches to be skipped.
+
+           Optional argument:
+            | ``vertices``  --  The vertices to be ordered, which must be a
+                                union of connected components. By default,
+                                all vertices with at least one edge are used.
+
+           This is an algorithm in the spirit of nauty and bliss. The initial
+           colors of the vertices are based on the same invariants as in
+           :attr:`canonical_order`. These colors are refined with
+           :meth:`_refine_colors`. While some vertices still share a color,
+           each vertex of the first such color is individualized in turn (i.e.
+           it gets a color on its own) and the refinement is repeated. Every
+           branch of this search tree ends with a different order of the
+           vertices. The order with the largest certificate (the sorted list of
+           relabeled edges) is the canonical one. Two orders with the same
+           certificate reveal an automorphism, which is used to skip equivalent
+           branches.
+
+           Returns a tuple (order, certificate, base, generators). The base
+           contains the vertices that are individualized along the first branch. The
+           generators are dictionaries with the vertices that are not fixed by
+           an automorphism as keys and their images as values.
+        """
+        indptr, indices, edge_indexes = self._csr_lists
+        if vertices is None:
+            vertices = [vertex for vertex in range(self.num_vertices) if indptr[vertex+1] > indptr[vertex]]
+        # the edges (a, b, edge string) with a < b and the neighbors of each
+        # vertex, restricted to the given vertices
+        edges = []
+        neighbors = {}
+        for vertex in vertices:
+            neighbors[vertex] = []
+            for i in range(indptr[vertex], indptr[vertex+1]):
+                edge_string = self.get_edge_string(edge_indexes[i])
+                neighbors[vertex].append((indices[i], edge_string))
+                if vertex < indices[i]:
+                    edges.append((vertex, indices[i], edge_string))
+        # initial colors, based on invariants of the vertices
+        keys = dict((vertex, (
+            -self.eccentricities[vertex],
+            -len(self.equivalent_vertices[vertex]),
+            self.get_vertex_string(vertex),
+            self.vertex_fingerprints[vertex].tobytes(),
+        )) for vertex in vertices)
+        ranks = dict((key, rank) for rank, key in enumerate(sorted(set(keys.values()), reverse=True)))
+        colors = dict((vertex, ranks[key]) for vertex, key in keys.items())
+
+        def get_certificate(colors):
+            """The order of the vertices and the relabeled edges"""
+            order = sorted(vertices, key=colors.get)
+            relabel = dict((vertex, i) for i, vertex in enumerate(order))
+            certificate = sorted(
+                (min(relabel[a], relabel[b]), max(relabel[a], relabel[b]), edge_string)
+                for a, b, edge_string in edges
+            )
+            return order, certificate
+
+        first = []
+        base = []
+        best = [None, None]
+        generators = []
+
+        def get_orbits(fixed, cell):
+            """Group the vertices of a cell in orbits of the known automorphisms"""
+            parents = {}
+            def find(vertex):
+                while parents.get(vertex, vertex) != vertex:
+                    vertex = parents[vertex]
+                return vertex
+            for generator in generators:
+                if not any(vertex in generator for vertex in fixed):
+                    for vertex, image in generator.items():
+                        root_a = find(vertex)
+                        root_b = find(image)
+                        if root_a != root_b:
+                            parents[max(root_a, root_b)] = min(root_a, root_b)
+            return [find(vertex) for vertex in cell]
+
+        def search(colors, fixed):
+            """Explore the search tree recursively
+
+               Returns True when an automorphism was found that maps a leaf of
+               this branch onto the first leaf.
+            """
+            colors = self._refine_colors(colors, neighbors)
+            counts = {}
+            for vertex in vertices:
+                counts[colors[vertex]] = counts.get(colors[vertex], 0) + 1
+            target = min((color for color, count in counts.items() if count > 1), default=None)
+            if target is None:
+                order, certificate = get_certificate(colors)
+                if len(first) == 0:
+                    first.extend([order, certificate])
+                    base.extend(fixed)
+                # Equal certificates imply an automorphism. Only the vertices
+                # that are not fixed are stored.
+                found = False
+                for other_order, other_certificate in first, best:
+                    if certificate == other_certificate and order != other_order:
+                        generators.append(dict(
+                            (vertex, image) for vertex, image in zip(order, other_order)
+                            if vertex != image
+                        ))
+                        found = True
+                        break
+                if best[1] is None or certificate > best[1]:
+                    best[0] = order
+                    best[1] = certificate
+                return found and other_order is first[0]
+            on_first_branch = (len(first) == 0)
+            cell = [vertex for vertex in vertices if colors[vertex] == target]
+            done = []
+            num_generators = None
+            for index, vertex in enumerate(cell):
+                # skip vertices that are equivalent with a vertex that is
+                # already done, given the automorphisms found so far.
+                if num_generators != len(generators):
+                    orbits = get_orbits(fixed, cell)
+                    num_generators = len(generators)
+                if orbits[index] in set(orbits[cell.index(other)] for other in done):
+                    continue
+                done.append(vertex)
+                # individualize vertex: it keeps the color, all other vertices
+                # with the same or a higher color are shifted.
+                new_colors = dict(
+                    (other, color + (color > target or (color == target and other != vertex)))
+                    for other, color in colors.items()
+                )
+                if search(new_colors, fixed + [vertex]) and not (canonical or on_first_branch):
+                    # one automorphism is sufficient to fix the orbit of the
+                    # vertex that was individualized by the caller.
+                    return True
+            return False
+
+        search(colors, [])
+        return best[0], best[1], base, generators
+
     # other usefull graph functions
 
     def iter_breadth_first(self, start=None, do_paths=False, do_duplicates=False):
@@ -451,9 +1065,8 @@ class Graph(ReadOnly):
                 raise ValueError("start must be in the range [0, %i[" %
                                  self.num_vertices)
         from collections import deque
-        work = np.zeros(self.num_vertices, int)
-        work[:] = -1
-        work[start] = 0
+        indptr, indices = self._csr_lists[:2]
+        work = {start: 0}
         if do_paths:
             result = (start, 0, (start, ))
         else:
@@ -466,8 +1079,8 @@ class Graph(ReadOnly):
             else:
                 parent, parent_length = todo.popleft()
             current_length = parent_length + 1
-            for current in self.neighbors[parent]:
-                visited = work[current]
+            for current in indices[indptr[parent]:indptr[parent+1]]:
+                visited = work.get(current, -1)
                 if visited == -1 or (do_duplicates and visited == current_length):
                     work[current] = current_length
                     if do_paths:
@@ -491,6 +1104,123 @@ class Graph(ReadOnly):
                 max_len = length
                 yield path
 
+    def _iter_counted_breadth_first(self, start, max_distance):
+        """Return the distances and shortest path counts from a start vertex
+
+           The breadth-first search is truncated at ``max_distance``. The
+           result is a dictionary with (distance, count) tuples as values. The
+           number of shortest paths is capped at three, which is enough to
+           distinguish the cases used by the ring perception.
+        """
+        indptr, indices = self.csr[:2]
+        result = {start: (0, 1)}
+        todo = [start]
+        for distance in range(1, max_distance+1):
+            counts = {}
+            for parent in todo:
+                parent_count = result[parent][1]
+                for current in indices[indptr[parent]:indptr[parent+1]]:
+                    current = int(current)
+                    if current not in result:
+                        counts[current] = min(counts.get(current, 0) + parent_count, 3)
+            for current, count in counts.items():
+                result[current] = (distance, count)
+            todo = list(counts)
+        return result
+
+    def iter_strong_rings(self, max_size):
+        """Iterate over all strong rings up to a given size
+
+           Argument:
+            | ``max_size``  --  the maximum number of vertices in a ring
+
+           This is a dedicated implementation of the search carried out with
+           ``GraphSearch(RingPattern(max_size))``. It yields exactly the same
+           rings, as integer arrays in the same order as
+           ``match.ring_vertices``. The shortest path counts needed for the
+           strong-ring criteria are taken from truncated breadth-first
+           searches that are computed once per vertex and reused for all
+           candidate rings.
+        """
+        if max_size < 3:
+            raise ValueError("Ring sizes must be at least 3.")
+        max_level = (max_size-1)//2
+        max_distance = max_level + 1
+        neighbors = self.neighbors
+        balls = {}
+
+        def get_count(vertex_a, vertex_b):
+            """Return the number of shortest paths and the distance"""
+            ball = balls.get(vertex_a)
+            if ball is None:
+                ball = self._iter_counted_breadth_first(vertex_a, max_distance)
+                balls[vertex_a] = ball
+            return ball.get(vertex_b, (0, 0))
+
+        def complete(forward):
+            """Return the ring when the chains can be closed, None otherwise"""
+            size = len(forward)
+            # odd ring
+            if forward[size-1] in neighbors[forward[size-2]]:
+                order = list(range(0, size, 2)) + list(range(1, size-1, 2))[::-1]
+                for i in range(size//2):
+                    vertex = forward[order[i]]
+                    if get_count(vertex, forward[order[(i+size//2)%size]])[1] > 1:
+                        break
+                    if get_count(vertex, forward[order[(i+size//2+1)%size]])[1] > 1:
+                        break
+                else:
+                    return [forward[i] for i in order]
+            # even ring
+            distance, count = get_count(forward[size-1], forward[size-2])
+            if distance != 2 or count != (2 if size == 3 else 1):
+                return None
+            middles = neighbors[forward[size-1]] & neighbors[forward[size-2]]
+            middles = [vertex for vertex in middles if vertex != forward[0]]
+            forward = forward + middles
+            size += 1
+            if forward[size-1] < forward[0]:
+                return None
+            order = list(range(0, size, 2)) + list(range(size-1, 0, -2))
+            for i in range(size//2):
+                if get_count(forward[order[i]], forward[order[(i+size//2)%size]])[1] != 2:
+                    return None
+            return [forward[i] for i in order]
+
+        def iter_rings(forward, children, level):
+            """Extend the two chains of vertices simultaneously"""
+            ring = complete(forward)
+            if ring is not None:
+                yield ring
+            elif level < max_level:
+                for vertex2 in children(forward[-1]):
+                    for vertex1 in children(forward[-2]):
+                        for ring in iter_rings(forward + [vertex1, vertex2], children, level+1):
+                            yield ring
+
+        for vertex0 in range(self.num_vertices):
+            # balls of vertices smaller than vertex0 are no longer needed
+            for vertex in [vertex for vertex in balls if vertex < vertex0]:
+                del balls[vertex]
+            get_count(vertex0, vertex0)
+            ball0 = balls[vertex0]
+
+            def children(vertex):
+                """Vertices one step further from vertex0 with a unique shortest path"""
+                distance = ball0[vertex][0] + 1
+                return [
+                    child for child in neighbors[vertex]
+                    if child > vertex0 and ball0.get(child) == (distance, 1)
+                ]
+
+            # the loops follow the traversal order of GraphSearch
+            first = children(vertex0)
+            for vertex2 in first:
+                for vertex1 in first:
+                    if vertex1 > vertex2:
+                        for ring in iter_rings([vertex0, vertex1, vertex2], children, 1):
+                            yield np.array(ring)
+
     def iter_breadth_first_edges(self, start=None):
         """Iterate over the edges with the breadth first convention.
 
@@ -516,22 +1246,22 @@ class Graph(ReadOnly):
                 raise ValueError("start must be in the range [0, %i[" %
                                  self.num_vertices)
         from collections import deque
-        work = np.zeros(self.num_vertices, int)
-        work[:] = -1
-        work[start] = 0
+        indptr, indices = self._csr_lists[:2]
+        work = {start: 0}
         todo = deque([start])
         while len(todo) > 0:
             parent = todo.popleft()
             distance = work[parent]
-            for current in self.neighbors[parent]:
-                if work[current] == -1:
+            for current in indices[indptr[parent]:indptr[parent+1]]:
+                visited = work.get(current, -1)
+                if visited == -1:
                     yield (parent, current), distance, False
                     work[current] = distance+1
                     todo.append(current)
-                elif work[current] == distance and current > parent:
+                elif visited == distance and current > parent:
                     # second equation in elif avoids duplicates
                     yield (parent, current), distance, True
-                elif work[current] == distance+1:
+                elif visited == distance+1:
                     yield (parent, current), distance, False
 
     def get_subgraph(self, subvertices, normalize=False):
@@ -603,37 +1333,73 @@ class Graph(ReadOnly):
         return result
 
     def get_vertex_fingerprints(self, vertex_strings, edge_strings, num_iter=None):
-        """Return an array with fingerprints for each vertex"""
+        """Return an array with fingerprints for each vertex
+
+           Arguments:
+            | ``vertex_strings``  --  a string for each vertex, see
+                                      :meth:`get_vertex_string`
+            | ``edge_strings``  --  a string for each edge, see
+                                    :meth:`get_edge_string`
+
+           Optional argument:
+            | ``num_iter``  --  the number of iterations. [default=None,
+                                iterate until the fingerprints no longer split
+                                up groups of vertices]
+
+           The initial fingerprints are SHA1 hashes of the vertex and edge
+           strings. In each iteration, in the spirit of the Weisfeiler-Lehman
+           algorithm, the fingerprints of the neighbors are added and the
+           result is hashed again. All vertices are processed at once with a
+           vectorized hash function, such that the results are identical on all
+           platforms. The default number of iterations does not require the
+           distance matrix.
+        """
         import hashlib
-        def str2array(x):
-            """convert a hash string to a numpy array of bytes"""
-            if len(x) == 0:
-                return np.zeros(0, np.ubyte)
-            else:
-                return np.fromstring(x, np.ubyte)
-        hashrow = lambda x: np.fromstring(hashlib.sha1(x.data).digest(), np.ubyte)
+        def hash_strings(strings):
+            """SHA1 hash of each string, only computed once for equal strings"""
+            cache = {}
+            result = np.zeros((len(strings), 20), np.ubyte)
+            for i, string in enumerate(strings):
+                row = cache.get(string)
+                if row is None:
+                    if isinstance(string, bytes):
+                        data = string
+                    else:
+                        data = string.encode("utf-8")
+                    row = np.frombuffer(hashlib.sha1(data).digest(), np.ubyte)
+                    cache[string] = row
+                result[i] = row
+            return result
         # initialization
-        result = np.zeros((self.num_vertices, 20), np.ubyte)
-        for i in range(self.num_vertices):
-            result[i] = hashrow(str2array(vertex_strings[i]))
-        for i in range(self.num_edges):
-            a, b = self.edges[i]
-            tmp = hashrow(str2array(edge_strings[i]))
-            result[a] += tmp
-            result[b] += tmp
+        result = hash_strings(vertex_strings)
+        edge_array = self._edge_array
+        if self.num_edges > 0:
+            tmp = hash_strings(edge_strings)
+            np.add.at(result, edge_array[:, 0], tmp)
+            np.add.at(result, edge_array[:, 1], tmp)
         work = result.copy()
         # iterations
+        def count_groups(fingerprints):
+            """The number of different fingerprints (based on 64 bits)"""
+            return len(np.unique(np.ascontiguousarray(fingerprints[:, :8]).view("<u8")))
         if num_iter is None:
-            num_iter = self.max_distance
+            num_iter = self.num_vertices
+            num_groups = count_groups(result)
+        else:
+            num_groups = None
+        # The sums over the neighbors are differences of a cumulative sum in
+        # the CSR order, all modulo 256.
+        indptr, indices = self.csr[:2]
+        cumsum = np.zeros((len(indices)+1, 20), np.ubyte)
         for i in range(num_iter):
-            for a, b in self.edges:
-                work[a] += result[b]
-                work[b] += result[a]
-            #for a in xrange(self.num_vertices):
-            #    for b in xrange(self.num_vertices):
-            #        work[a] += hashrow(result[b]*self.distances[a, b])
-            for a in range(self.num_vertices):
-                result[a] = hashrow(work[a])
+            np.cumsum(result[indices], axis=0, dtype=np.ubyte, out=cumsum[1:])
+            work += cumsum[indptr[1:]] - cumsum[indptr[:-1]]
+            result = _hash_rows(work)
+            if num_groups is not None:
+                new_num_groups = count_groups(result)
+                if new_num_groups == num_groups:
+                    break
+                num_groups = new_num_groups
         return result
 
     def get_halfs(self, vertex1, vertex2):
@@ -987,6 +1753,16 @@ class Pattern(object):
         """
         return True
 
+    def get_vertex_mask(self, vertex0, subject_graph, one_match):
+        """Boolean mask of the subject vertices that can be related to ``vertex0``
+
+           Returns None when no mask is available. False positives are
+           allowed, but a vertex that is rejected by the mask may never be
+           related to ``vertex0`` in a canonical match. The
+           :class:`VF2GraphSearch` computes these masks once per search.
+        """
+        return None
+
     def check_next_match(self, match, new_relations, subject_graph, one_match):
         """Does this match object make sense for the current pattern
 
@@ -1253,6 +2029,37 @@ class CustomPattern(Pattern):
             self.level_constraints.get(level, [])
         )
 
+    def get_vertex_mask(self, vertex0, subject_graph, one_match):
+        """Boolean mask of the subject vertices that can be related to ``vertex0``
+
+           The mask combines the compare method, the number of neighbors and
+           the vertex criteria. Because the criteria are tested after the
+           symmetry operations in :meth:`iter_final_matches`, a subject vertex
+           is kept when it satisfies the criteria of any vertex that is
+           equivalent with ``vertex0`` in one of the criteria sets.
+        """
+        indptr = subject_graph.csr[0]
+        mask = np.diff(indptr) >= len(self.pattern_graph.neighbors[vertex0])
+        for vertex1 in mask.nonzero()[0].tolist():
+            if not self.compare(vertex0, vertex1, subject_graph):
+                mask[vertex1] = False
+        if self.criteria_sets is None or one_match:
+            return mask
+        criteria = []
+        for criteria_set in self.criteria_sets:
+            for symmetry in self.pattern_graph.symmetries:
+                criterion = criteria_set.vertex_criteria.get(symmetry.reverse[vertex0])
+                if criterion is None:
+                    return mask
+                criteria.append(criterion)
+        for vertex1 in mask.nonzero()[0].tolist():
+            for criterion in criteria:
+                if criterion(vertex1, subject_graph):
+                    break
+            else:
+                mask[vertex1] = False
+        return mask
+
     def check_next_match(self, match, new_relations, subject_graph, one_match):
         """Check if the (onset for a) match can be a valid"""
         # only returns true for ecaxtly one set of new_relations from all the
@@ -1736,3 +2543,159 @@ class GraphSearch(object):
                 for match in self._iter_matches(next_match, subject_graph, one_match, level+1):
                     yield match
         self.print_debug("LEAVING_ITER_MATCHES", -1)
+
+
+class VF2GraphSearch(GraphSearch):
+    """A faster alternative for the GraphSearch with the same matches
+
+       The matches are still grown level by level, such that all methods of
+       the pattern are used in the same way. Within one level, the new
+       relations are no longer selected from all combinations of candidate
+       relations. They are added one pattern vertex at a time, in the spirit
+       of the VF2 algorithm:
+
+       * The candidates for a new pattern vertex are the free vertices in the
+         subject graph that are connected to the subject vertices of all its
+         parents.
+       * The candidates are filtered with masks that are computed once per
+         search, see :meth:`Pattern.get_vertex_mask`. For a CustomPattern,
+         these take into account the number of neighbors and the vertex
+         criteria.
+       * The pattern vertex with the fewest candidates is related first and
+         the constraints between new vertices are tested as soon as both
+         vertices are related.
+
+       The matches may come in a different order than with the GraphSearch.
+
+       Usage:
+
+         >>> gs = VF2GraphSearch(pattern)
+         >>> for match in gs(graph):
+         ...     print match.forward
+    """
+
+    def __call__(self, subject_graph, one_match=False):
+        """Iterator over all matches of self.pattern in the given graph.
+
+           See :meth:`GraphSearch.__call__` for the arguments.
+        """
+        masks = {}
+        for vertex0, vertex1 in self.pattern.iter_initial_relations(subject_graph):
+            mask = self._get_mask(masks, vertex0, subject_graph, one_match)
+            if mask is not None and not mask[vertex1]:
+                continue
+            init_match = self.pattern.MatchClass.from_first_relation(vertex0, vertex1)
+            for canonical_match in self._iter_matches(init_match, subject_graph, one_match, masks=masks):
+                ifm = self.pattern.iter_final_matches(canonical_match, subject_graph, one_match)
+                for final_match in ifm:
+                    self.print_debug("final_match: %s" % final_match)
+                    yield final_match
+                    if one_match: return
+
+    def _get_mask(self, masks, vertex0, subject_graph, one_match):
+        """Return the (cached) mask for a vertex in the pattern graph"""
+        if vertex0 not in masks:
+            masks[vertex0] = self.pattern.get_vertex_mask(vertex0, subject_graph, one_match)
+        return masks[vertex0]
+
+    def _iter_pruned_relations(self, input_match, subject_graph, edges0, constraints0, one_match, masks):
+        """Given an onset for a match, iterate over all possible new key-value pairs"""
+        forward = input_match.forward
+        reverse = input_match.reverse
+        neighbors = subject_graph.neighbors
+        parents = {}
+        num_edges0 = {}
+        for start_vertex0, end_vertex0 in edges0:
+            parents.setdefault(end_vertex0, []).append(start_vertex0)
+            num_edges0[start_vertex0] = num_edges0.get(start_vertex0, 0) + 1
+        if len(parents) == 0:
+            return
+        # the subject graph must have enough free neighbors (or exactly as
+        # many for an exact match), just like in the GraphSearch
+        for start_vertex0, num in num_edges0.items():
+            num_free = sum(neighbor not in reverse for neighbor in neighbors[forward[start_vertex0]])
+            if num > num_free or (not self.pattern.sub and num != num_free):
+                return
+
+        # collect the candidates for each new vertex
+        candidates = {}
+        for end_vertex0, start_vertices0 in parents.items():
+            common = set(neighbors[forward[start_vertices0[0]]])
+            for start_vertex0 in start_vertices0[1:]:
+                common &= neighbors[forward[start_vertex0]]
+            mask = self._get_mask(masks, end_vertex0, subject_graph, one_match)
+            l = []
+            for end_vertex1 in common:
+                if end_vertex1 in reverse:
+                    continue
+                if mask is None:
+                    if not self.pattern.compare(end_vertex0, end_vertex1, subject_graph):
+                        continue
+                elif not mask[end_vertex1]:
+                    continue
+                l.append(end_vertex1)
+            if len(l) == 0:
+                return
+            candidates[end_vertex0] = l
+        self.print_debug("candidates: %s" % candidates)
+        order = sorted(candidates, key=(lambda end_vertex0: len(candidates[end_vertex0])))
+        links = dict((end_vertex0, []) for end_vertex0 in order)
+        for a0, b0 in constraints0:
+            links[a0].append(b0)
+            links[b0].append(a0)
+
+        new_relations = {}
+        used = set([])
+
+        def extend(index):
+            """Relate the remaining new vertices recursively"""
+            if index == len(order):
+                yield dict(new_relations)
+                return
+            end_vertex0 = order[index]
+            for end_vertex1 in candidates[end_vertex0]:
+                if end_vertex1 in used:
+                    continue
+                ok = True
+                for other0 in links[end_vertex0]:
+                    other1 = new_relations.get(other0)
+                    if other1 is not None and other1 not in neighbors[end_vertex1]:
+                        ok = False
+                        break
+                if not ok:
+                    continue
+                new_relations[end_vertex0] = end_vertex1
+                used.add(end_vertex1)
+                for result in extend(index+1):
+                    yield result
+                del new_relations[end_vertex0]
+                used.discard(end_vertex1)
+
+        for result in extend(0):
+            self.print_debug("new_relations: %s" % result)
+            yield result
+
+    def _iter_matches(self, input_match, subject_graph, one_match, level=0, masks=None):
+        """Given an onset for a match, iterate over all completions of that match
+
+           See :meth:`GraphSearch._iter_matches`. The optional argument
+           ``masks`` is a dictionary with the vertex masks of the current
+           search.
+        """
+        if masks is None:
+            masks = {}
+        self.print_debug("ENTERING _ITER_MATCHES", 1)
+        self.print_debug("input_match: %s" % input_match)
+        edges0, constraints0 = self.pattern.get_new_edges(level)
+        ipr = self._iter_pruned_relations(input_match, subject_graph, edges0,
+                                          constraints0, one_match, masks)
+        for new_relations in ipr:
+            next_match = input_match.copy_with_new_relations(new_relations)
+            if not self.pattern.check_next_match(next_match, new_relations, subject_graph, one_match):
+                continue
+            if self.pattern.complete(next_match, subject_graph):
+                yield next_match
+            else:
+                for match in self._iter_matches(next_match, subject_graph, one_match, level+1, masks):
+                    yield match
+        self.print_debug("LEAVING_ITER_MATCHES", -1)
@@ -0,0 +1,425 @@
+// MolMod is a collection of molecular modelling tools for python.
+// Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+// for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+// reserved unless otherwise stated.
+//
+// This file is part of MolMod.
+//
+// MolMod is free software; you can redistribute it and/or
+// modify it under the terms of the GNU General Public License
+// as published by the Free Software Foundation; either version 3
+// of the License, or (at your option) any later version.
+//
+// MolMod is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program; if not, see <http://www.gnu.org/licenses/>
+//
+// --
+
+
+
+#include "ic.h"
+
+#include <math.h>
+#include <string.h>
+
+// Needed for portability, M_PI is not part of the C/C++ standard
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+
+// Forward-mode derivatives of scalars with respect to at most nine inputs.
+// These are the C counterparts of the Scalar and Vector3 classes in ic.py. The
+// order of the floating point operations follows the Python implementation.
+
+#define IC_MAX_SIZE 9
+
+typedef struct {
+  int size;
+  int deriv;
+  double v;
+  double d[IC_MAX_SIZE];
+  double dd[IC_MAX_SIZE*IC_MAX_SIZE];
+} scalar_t;
+
+typedef struct {
+  scalar_t x, y, z;
+} vector3_t;
+
+
+static void scalar_init(scalar_t *s, int size, int deriv, double value, int index) {
+  s->size = size;
+  s->deriv = deriv;
+  s->v = value;
+  if (deriv > 0) {
+    memset(s->d, 0, size*sizeof(double));
+    if (index >= 0) s->d[index] = 1.0;
+  }
+  if (deriv > 1) memset(s->dd, 0, size*size*sizeof(double));
+}
+
+static void scalar_iadd(scalar_t *s, const scalar_t *o) {
+  int i;
+  if (s->deriv > 1) for (i=0; i<s->size*s->size; i++) s->dd[i] += o->dd[i];
+  if (s->deriv > 0) for (i=0; i<s->size; i++) s->d[i] += o->d[i];
+  s->v += o->v;
+}
+
+static void scalar_isub(scalar_t *s, const scalar_t *o) {
+  int i;
+  if (s->deriv > 1) for (i=0; i<s->size*s->size; i++) s->dd[i] -= o->dd[i];
+  if (s->deriv > 0) for (i=0; i<s->size; i++) s->d[i] -= o->d[i];
+  s->v -= o->v;
+}
+
+static void scalar_imul(scalar_t *s, const scalar_t *o) {
+  int i, j, n = s->size;
+  if (s->deriv > 1) {
+    for (i=0; i<n*n; i++) {
+      s->dd[i] *= o->v;
+      s->dd[i] += s->v*o->dd[i];
+    }
+    for (i=0; i<n; i++) {
+      for (j=0; j<n; j++) {
+        s->dd[i*n+j] += s->d[i]*o->d[j];
+        s->dd[i*n+j] += s->d[j]*o->d[i];
+      }
+    }
+  }
+  if (s->deriv > 0) {
+    for (i=0; i<n; i++) {
+      s->d[i] *= o->v;
+      s->d[i] += s->v*o->d[i];
+    }
+  }
+  s->v *= o->v;
+}
+
+static void scalar_idiv(scalar_t *s, const scalar_t *o) {
+  int i, j, n = s->size;
+  s->v /= o->v;
+  if (s->deriv > 0) {
+    for (i=0; i<n; i++) {
+      s->d[i] -= s->v*o->d[i];
+      s->d[i] /= o->v;
+    }
+  }
+  if (s->deriv > 1) {
+    for (i=0; i<n*n; i++) s->dd[i] -= s->v*o->dd[i];
+    for (i=0; i<n; i++) {
+      for (j=0; j<n; j++) {
+        s->dd[i*n+j] -= s->d[i]*o->d[j];
+        s->dd[i*n+j] -= s->d[j]*o->d[i];
+      }
+    }
+    for (i=0; i<n*n; i++) s->dd[i] /= o->v;
+  }
+}
+
+static void scalar_mul(scalar_t *result, const scalar_t *s1, const scalar_t *s2) {
+  *result = *s1;
+  scalar_imul(result, s2);
+}
+
+static void vector3_init(vector3_t *r, int size, int deriv, double *values, int offset) {
+  scalar_init(&r->x, size, deriv, values[0], offset);
+  scalar_init(&r->y, size, deriv, values[1], offset + 1);
+  scalar_init(&r->z, size, deriv, values[2], offset + 2);
+}
+
+static void vector3_isub(vector3_t *r, const vector3_t *o) {
+  scalar_isub(&r->x, &o->x);
+  scalar_isub(&r->y, &o->y);
+  scalar_isub(&r->z, &o->z);
+}
+
+static void vector3_imul(vector3_t *r, const scalar_t *s) {
+  scalar_imul(&r->x, s);
+  scalar_imul(&r->y, s);
+  scalar_imul(&r->z, s);
+}
+
+static void vector3_idiv(vector3_t *r, const scalar_t *s) {
+  scalar_idiv(&r->x, s);
+  scalar_idiv(&r->y, s);
+  scalar_idiv(&r->z, s);
+}
+
+static void vector3_norm_add_cross(double *dd, double factor, const double *d1, const double *d2, int n) {
+  int i, j;
+  for (i=0; i<n; i++) {
+    for (j=0; j<n; j++) {
+      dd[i*n+j] += factor*(d1[i]*d2[j]) + factor*(d1[j]*d2[i]);
+    }
+  }
+}
+
+static void vector3_norm(scalar_t *result, const vector3_t *r) {
+  int i, j, n = r->x.size;
+  double denom;
+  scalar_init(result, n, r->x.deriv, 0.0, -1);
+  result->v = sqrt(r->x.v*r->x.v + r->y.v*r->y.v + r->z.v*r->z.v);
+  if (result->deriv > 0) {
+    for (i=0; i<n; i++) {
+      result->d[i] += r->x.v*r->x.d[i];
+      result->d[i] += r->y.v*r->y.d[i];
+      result->d[i] += r->z.v*r->z.d[i];
+      result->d[i] /= result->v;
+    }
+  }
+  if (result->deriv > 1) {
+    for (i=0; i<n*n; i++) {
+      result->dd[i] += r->x.v*r->x.dd[i];
+      result->dd[i] += r->y.v*r->y.dd[i];
+      result->dd[i] += r->z.v*r->z.dd[i];
+    }
+    denom = result->v*result->v;
+    for (i=0; i<n; i++) {
+      for (j=0; j<n; j++) {
+        result->dd[i*n+j] += (1 - r->x.v*r->x.v/denom)*(r->x.d[i]*r->x.d[j]);
+        result->dd[i*n+j] += (1 - r->y.v*r->y.v/denom)*(r->y.d[i]*r->y.d[j]);
+        result->dd[i*n+j] += (1 - r->z.v*r->z.v/denom)*(r->z.d[i]*r->z.d[j]);
+      }
+    }
+    vector3_norm_add_cross(result->dd, -r->x.v*r->y.v/denom, r->x.d, r->y.d, n);
+    vector3_norm_add_cross(result->dd, -r->y.v*r->z.v/denom, r->y.d, r->z.d, n);
+    vector3_norm_add_cross(result->dd, -r->z.v*r->x.v/denom, r->z.d, r->x.d, n);
+    for (i=0; i<n*n; i++) result->dd[i] /= result->v;
+  }
+}
+
+static void vector3_dot(scalar_t *result, const vector3_t *r1, const vector3_t *r2) {
+  scalar_t tmp;
+  scalar_mul(result, &r1->x, &r2->x);
+  scalar_mul(&tmp, &r1->y, &r2->y);
+  scalar_iadd(result, &tmp);
+  scalar_mul(&tmp, &r1->z, &r2->z);
+  scalar_iadd(result, &tmp);
+}
+
+static void vector3_cross(vector3_t *result, const vector3_t *r1, const vector3_t *r2) {
+  scalar_t tmp;
+  scalar_mul(&result->x, &r1->y, &r2->z);
+  scalar_mul(&tmp, &r1->z, &r2->y);
+  scalar_isub(&result->x, &tmp);
+  scalar_mul(&result->y, &r1->z, &r2->x);
+  scalar_mul(&tmp, &r1->x, &r2->z);
+  scalar_isub(&result->y, &tmp);
+  scalar_mul(&result->z, &r1->x, &r2->y);
+  scalar_mul(&tmp, &r1->y, &r2->x);
+  scalar_isub(&result->z, &tmp);
+}
+
+static void vector3_normalize(vector3_t *r) {
+  scalar_t n;
+  vector3_norm(&n, r);
+  vector3_idiv(r, &n);
+}
+
+// Remove the component along the unit vector b from r.
+static void vector3_project_out(vector3_t *r, const vector3_t *b) {
+  vector3_t tmp = *b;
+  scalar_t s;
+  vector3_dot(&s, r, b);
+  vector3_imul(&tmp, &s);
+  vector3_isub(r, &tmp);
+}
+
+static void scalar_results(const scalar_t *s, double *v, double *d, double *dd) {
+  *v = s->v;
+  if (s->deriv > 0) memcpy(d, s->d, s->size*sizeof(double));
+  if (s->deriv > 1) memcpy(dd, s->dd, s->size*s->size*sizeof(double));
+}
+
+static double det3(double *a, double *b, double *c) {
+  return a[0]*(b[1]*c[2] - b[2]*c[1]) + a[1]*(b[2]*c[0] - b[0]*c[2]) + a[2]*(b[0]*c[1] - b[1]*c[0]);
+}
+
+
+// Cosine and sine to angle conversion
+
+static void cos_to_angle(const scalar_t *c, double sign, double *v, double *d, double *dd) {
+  int i, j, n = c->size;
+  double factor1, factor2;
+  double x = c->v;
+  if (x > 1) x = 1;
+  if (x < -1) x = -1;
+  *v = acos(x)*sign;
+  if (c->deriv == 0) return;
+  if (fabs(c->v) >= 1) {
+    factor1 = 0;
+  } else {
+    factor1 = -1.0/sqrt(1 - c->v*c->v);
+  }
+  for (i=0; i<n; i++) d[i] = factor1*c->d[i]*sign;
+  if (c->deriv == 1) return;
+  factor2 = c->v*pow(factor1, 3);
+  for (i=0; i<n; i++) {
+    for (j=0; j<n; j++) {
+      dd[i*n+j] = (factor2*(c->d[i]*c->d[j]) + factor1*c->dd[i*n+j])*sign;
+    }
+  }
+}
+
+static void sin_to_angle(const scalar_t *s, int side, double *v, double *d, double *dd) {
+  int i, j, n = s->size;
+  double factor1, factor2, offset = 0.0;
+  double x = s->v;
+  if (x > 1) x = 1;
+  if (x < -1) x = -1;
+  x = asin(x);
+  if (side == -1) offset = (x < 0) ? -M_PI : M_PI;
+  *v = x*side + offset;
+  if (s->deriv == 0) return;
+  if (fabs(s->v) >= 1) {
+    factor1 = 0;
+  } else {
+    factor1 = 1.0/sqrt(1 - s->v*s->v);
+  }
+  for (i=0; i<n; i++) d[i] = factor1*s->d[i]*side;
+  if (s->deriv == 1) return;
+  factor2 = s->v*pow(factor1, 3);
+  for (i=0; i<n; i++) {
+    for (j=0; j<n; j++) {
+      dd[i*n+j] = (factor2*(s->d[i]*s->d[j]) + factor1*s->dd[i*n+j])*side;
+    }
+  }
+}
+
+
+// Low level internal coordinate functions
+
+void ic_bond_length_low(double *r, int deriv, double *v, double *d, double *dd) {
+  vector3_t rv;
+  scalar_t result;
+  vector3_init(&rv, 3, deriv, r, 0);
+  vector3_norm(&result, &rv);
+  scalar_results(&result, v, d, dd);
+}
+
+static void bend_cos(double *a, double *b, int deriv, scalar_t *result) {
+  vector3_t av, bv;
+  vector3_init(&av, 6, deriv, a, 0);
+  vector3_init(&bv, 6, deriv, b, 3);
+  vector3_normalize(&av);
+  vector3_normalize(&bv);
+  vector3_dot(result, &av, &bv);
+}
+
+void ic_bend_cos_low(double *a, double *b, int deriv, double *v, double *d, double *dd) {
+  scalar_t result;
+  bend_cos(a, b, deriv, &result);
+  scalar_results(&result, v, d, dd);
+}
+
+void ic_bend_angle_low(double *a, double *b, int deriv, double *v, double *d, double *dd) {
+  scalar_t result;
+  bend_cos(a, b, deriv, &result);
+  cos_to_angle(&result, 1.0, v, d, dd);
+}
+
+// Compute the cosine of the dihedral angle. The normalized vectors are stored
+// in av, bv and cv for the computation of the sine.
+static void dihed_cos(double *a, double *b, double *c, int deriv, scalar_t *result,
+                      vector3_t *av, vector3_t *bv, vector3_t *cv) {
+  vector3_init(av, 9, deriv, a, 0);
+  vector3_init(bv, 9, deriv, b, 3);
+  vector3_init(cv, 9, deriv, c, 6);
+  vector3_normalize(bv);
+  vector3_project_out(av, bv);
+  vector3_project_out(cv, bv);
+  vector3_normalize(av);
+  vector3_normalize(cv);
+  vector3_dot(result, av, cv);
+}
+
+void ic_dihed_cos_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                      double *dd) {
+  vector3_t av, bv, cv;
+  scalar_t result;
+  dihed_cos(a, b, c, deriv, &result, &av, &bv, &cv);
+  scalar_results(&result, v, d, dd);
+}
+
+void ic_dihed_angle_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                        double *dd) {
+  vector3_t av, bv, cv, dv;
+  scalar_t result;
+  dihed_cos(a, b, c, deriv, &result, &av, &bv, &cv);
+  // avoid troubles with the gradients by either using arccos or arcsin
+  if (fabs(result.v) < 0.5) {
+    // if the cosine is far away for -1 or +1, it is safe to take the arccos
+    // and fix the sign of the angle.
+    cos_to_angle(&result, (det3(a, b, c) > 0) ? -1.0 : 1.0, v, d, dd);
+  } else {
+    // if the cosine is close to -1 or +1, it is better to compute the sine,
+    // take the arcsin and fix the sign of the angle
+    int side = (result.v > 0) ? 1 : -1;
+    vector3_cross(&dv, &bv, &av);
+    vector3_dot(&result, &dv, &cv);
+    sin_to_angle(&result, side, v, d, dd);
+  }
+}
+
+void ic_opdist_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                   double *dd) {
+  vector3_t av, bv, cv, nv;
+  scalar_t result;
+  vector3_init(&av, 9, deriv, a, 0);
+  vector3_init(&bv, 9, deriv, b, 3);
+  vector3_init(&cv, 9, deriv, c, 6);
+  vector3_cross(&nv, &av, &bv);
+  vector3_normalize(&nv);
+  vector3_dot(&result, &cv, &nv);
+  scalar_results(&result, v, d, dd);
+}
+
+static void opbend_cos(double *a, double *b, double *c, int deriv, scalar_t *result) {
+  int i, j, n = 9;
+  vector3_t av, bv, cv, nv;
+  scalar_t temp;
+  vector3_init(&av, 9, deriv, a, 0);
+  vector3_init(&bv, 9, deriv, b, 3);
+  vector3_init(&cv, 9, deriv, c, 6);
+  vector3_cross(&nv, &av, &bv);
+  vector3_normalize(&nv);
+  vector3_normalize(&cv);
+  vector3_dot(&temp, &nv, &cv);
+  *result = temp;
+  result->v = sqrt(1.0 - temp.v*temp.v);
+  if (deriv > 0) {
+    for (i=0; i<n; i++) {
+      result->d[i] *= -temp.v;
+      result->d[i] /= result->v;
+    }
+  }
+  if (deriv > 1) {
+    for (i=0; i<n; i++) {
+      for (j=0; j<n; j++) {
+        result->dd[i*n+j] *= -temp.v;
+        result->dd[i*n+j] /= result->v;
+        result->dd[i*n+j] -= temp.d[i]*temp.d[j]/pow(result->v, 3);
+      }
+    }
+  }
+}
+
+void ic_opbend_cos_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                       double *dd) {
+  scalar_t result;
+  opbend_cos(a, b, c, deriv, &result);
+  scalar_results(&result, v, d, dd);
+}
+
+void ic_opbend_angle_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                         double *dd) {
+  scalar_t result;
+  double det = det3(a, b, c);
+  opbend_cos(a, b, c, deriv, &result);
+  cos_to_angle(&result, (det > 0) - (det < 0), v, d, dd);
+}
@@ -0,0 +1,44 @@
+// MolMod is a collection of molecular modelling tools for python.
+// Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+// for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+// reserved unless otherwise stated.
+//
+// This file is part of MolMod.
+//
+// MolMod is free software; you can redistribute it and/or
+// modify it under the terms of the GNU General Public License
+// as published by the Free Software Foundation; either version 3
+// of the License, or (at your option) any later version.
+//
+// MolMod is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program; if not, see <http://www.gnu.org/licenses/>
+//
+// --
+
+
+
+#ifndef MOLMOD_IC_H_
+#define MOLMOD_IC_H_
+
+
+void ic_bond_length_low(double *r, int deriv, double *v, double *d, double *dd);
+void ic_bend_cos_low(double *a, double *b, int deriv, double *v, double *d, double *dd);
+void ic_bend_angle_low(double *a, double *b, int deriv, double *v, double *d, double *dd);
+void ic_dihed_cos_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                      double *dd);
+void ic_dihed_angle_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                        double *dd);
+void ic_opdist_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                   double *dd);
+void ic_opbend_cos_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                       double *dd);
+void ic_opbend_angle_low(double *a, double *b, double *c, int deriv, double *v, double *d,
+                         double *dd);
+
+
+#endif  // MOLMOD_IC_H_
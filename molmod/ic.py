@@ -32,6 +32,16 @@ Two auxiliary classes Scalar and Vector3 support most of the mathematical
 operations required to compute the internal coordinates. Additionally they also
 know the chain rule for each operation and can therefore evaluate the
 derivatives simultaneously.
+
+The pure python implementation is the reference. By default, the internal
+coordinate functions use compiled counterparts of the low level functions from
+molmod.ext, which carry out the same operations. The function set_backend
+switches between both implementations.
+
+The functions with a ``_batch`` suffix evaluate the same internal coordinates
+for many tuples of atoms in many frames at once. They work with the same chain
+rules, but all operations act on arrays with a leading batch shape, such that
+the Python overhead no longer scales with the number of internal coordinates.
 """
 
 
@@ -39,14 +49,23 @@ from __future__ import division
 
 import numpy as np
 
+from molmod.ext import ic_bond_length_low, ic_bend_cos_low, ic_bend_angle_low, \
+    ic_dihed_cos_low, ic_dihed_angle_low, ic_opdist_low, ic_opbend_cos_low, \
+    ic_opbend_angle_low
+from molmod.topology import get_bonds, get_bends, get_dihedrals, get_impropers
+
 
 __all__ = [
-    "Scalar", "Vector3", "dot", "cross",
+    "Scalar", "Vector3", "dot", "cross", "set_backend",
     "bond_length", "pair_distance",
     "bend_cos", "bend_angle",
     "dihed_cos", "dihed_angle",
     "opbend_cos", "opbend_angle", "opbend_dist",
     "opbend_mcos", "opbend_mangle",
+    "bond_length_batch", "bend_cos_batch", "bend_angle_batch",
+    "dihed_cos_batch", "dihed_angle_batch", "opbend_dist_batch",
+    "opbend_cos_batch", "opbend_angle_batch", "opbend_mcos_batch",
+    "opbend_mangle_batch", "InternalCoordinates",
 ]
 
 
@@ -327,7 +346,7 @@ def bond_length(rs, deriv=0):
 
        When derivatives are computed a tuple with a single result is returned
     """
-    return _bond_transform(rs, _bond_length_low, deriv)
+    return _bond_transform(rs, _low["bond_length"], deriv)
 
 pair_distance = bond_length
 
@@ -341,7 +360,7 @@ def bend_cos(rs, deriv=0):
 
        When derivatives are computed a tuple with a single result is returned
     """
-    return _bend_transform(rs, _bend_cos_low, deriv)
+    return _bend_transform(rs, _low["bend_cos"], deriv)
 
 
 def bend_angle(rs, deriv=0):
@@ -353,7 +372,7 @@ def bend_angle(rs, deriv=0):
 
        When derivatives are computed a tuple with a single result is returned
     """
-    return _bend_transform(rs, _bend_angle_low, deriv)
+    return _bend_transform(rs, _low["bend_angle"], deriv)
 
 
 def dihed_cos(rs, deriv=0):
@@ -363,7 +382,7 @@ def dihed_cos(rs, deriv=0):
         | ``rs``  --  four numpy array with three elements
         | ``deriv``  --  the derivatives to be computed: 0, 1 or 2 [default=0]
     """
-    return _dihed_transform(rs, _dihed_cos_low, deriv)
+    return _dihed_transform(rs, _low["dihed_cos"], deriv)
 
 
 def dihed_angle(rs, deriv=0):
@@ -378,7 +397,7 @@ def dihed_angle(rs, deriv=0):
 
        When derivatives are computed a tuple with a single result is returned
     """
-    return _dihed_transform(rs, _dihed_angle_low, deriv)
+    return _dihed_transform(rs, _low["dihed_angle"], deriv)
 
 
 def opbend_dist(rs, deriv=0):
@@ -388,7 +407,7 @@ def opbend_dist(rs, deriv=0):
         | ``rs``  --  four numpy array with three elements
         | ``deriv``  --  the derivatives to be computed: 0, 1 or 2 [default=0]
     """
-    return _opbend_transform(rs, _opdist_low, deriv)
+    return _opbend_transform(rs, _low["opdist"], deriv)
 
 
 def opbend_cos(rs, deriv=0):
@@ -398,7 +417,7 @@ def opbend_cos(rs, deriv=0):
         | ``rs``  --  four numpy array with three elements
         | ``deriv``  --  the derivatives to be computed: 0, 1 or 2 [default=0]
     """
-    return _opbend_transform(rs, _opbend_cos_low, deriv)
+    return _opbend_transform(rs, _low["opbend_cos"], deriv)
 
 
 def opbend_angle(rs, deriv=0):
@@ -414,19 +433,19 @@ def opbend_angle(rs, deriv=0):
 
        When no derivatives are computed a tuple with a single result is returned.
     """
-    return _opbend_transform(rs, _opbend_angle_low, deriv)
+    return _opbend_transform(rs, _low["opbend_angle"], deriv)
 
 
 def opbend_mangle(rs, deriv=0):
     """Compute the mean value of the 3 opbend_angles
     """
-    return _opbend_transform_mean(rs, _opbend_angle_low, deriv)
+    return _opbend_transform_mean(rs, _low["opbend_angle"], deriv)
 
 
 def opbend_mcos(rs, deriv=0):
     """Compute the mean cos of the 3 opbend_angles
     """
-    return _opbend_transform_mean(rs, _opbend_cos_low, deriv)
+    return _opbend_transform_mean(rs, _low["opbend_cos"], deriv)
 
 
 #
@@ -800,3 +819,663 @@ def _sin_to_angle(result, deriv, side=1):
     if deriv == 2:
         return v*sign + offset, d*sign, dd*sign
     raise ValueError("deriv must be 0, 1 or 2.")
+
+
+#
+# Implementations of the low level internal coordinate functions
+#
+
+
+_backends = {
+    "python": {
+        "bond_length": _bond_length_low,
+        "bend_cos": _bend_cos_low,
+        "bend_angle": _bend_angle_low,
+        "dihed_cos": _dihed_cos_low,
+        "dihed_angle": _dihed_angle_low,
+        "opdist": _opdist_low,
+        "opbend_cos": _opbend_cos_low,
+        "opbend_angle": _opbend_angle_low,
+    },
+    "ext": {
+        "bond_length": ic_bond_length_low,
+        "bend_cos": ic_bend_cos_low,
+        "bend_angle": ic_bend_angle_low,
+        "dihed_cos": ic_dihed_cos_low,
+        "dihed_angle": ic_dihed_angle_low,
+        "opdist": ic_opdist_low,
+        "opbend_cos": ic_opbend_cos_low,
+        "opbend_angle": ic_opbend_angle_low,
+    },
+}
+_low = dict(_backends["ext"])
+
+
+def set_backend(name):
+    """Select the implementation of the low level internal coordinate functions
+
+       Argument:
+        | ``name``  --  "ext" for the compiled implementation (default) or
+                        "python" for the reference implementation with Scalar
+                        and Vector3 objects.
+
+       This affects all internal coordinate functions that work on a single
+       set of atoms, e.g. bond_length and dihed_angle.
+    """
+    if name not in _backends:
+        raise ValueError("Unknown backend: %s. Use 'ext' or 'python'." % name)
+    _low.update(_backends[name])
+
+
+#
+# Batched auxiliary classes
+#
+
+
+class _ScalarArray(object):
+    """An array of scalars with optional first and second order derivatives
+
+       This is the batched counterpart of :class:`Scalar`. The attribute v is
+       an array with the batch shape, d and dd have one and two extra trailing
+       axes of length size, respectively.
+    """
+
+    def __init__(self, deriv, v, d=None, dd=None):
+        self.deriv = deriv
+        self.v = v
+        self.d = d
+        self.dd = dd
+
+    def results(self):
+        """Return the value and optionally derivative and second order derivative"""
+        if self.deriv == 0:
+            return self.v,
+        if self.deriv == 1:
+            return self.v, self.d
+        return self.v, self.d, self.dd
+
+    def __sub__(self, other):
+        return _ScalarArray(
+            self.deriv, self.v - other.v,
+            None if self.deriv < 1 else self.d - other.d,
+            None if self.deriv < 2 else self.dd - other.dd,
+        )
+
+    def __mul__(self, other):
+        v = self.v*other.v
+        if self.deriv < 1:
+            return _ScalarArray(0, v)
+        d = self.d*other.v[..., None] + self.v[..., None]*other.d
+        if self.deriv < 2:
+            return _ScalarArray(1, v, d)
+        tmp = self.d[..., :, None]*other.d[..., None, :]
+        dd = self.dd*other.v[..., None, None] + self.v[..., None, None]*other.dd
+        dd += tmp
+        dd += tmp.swapaxes(-1, -2)
+        return _ScalarArray(2, v, d, dd)
+
+    def apply(self, f0, f1=None, f2=None):
+        """Return f(self), given the arrays f0, f1 and f2 with f and its derivatives"""
+        if self.deriv < 1:
+            return _ScalarArray(0, f0)
+        d = f1[..., None]*self.d
+        if self.deriv < 2:
+            return _ScalarArray(1, f0, d)
+        dd = f1[..., None, None]*self.dd
+        dd += f2[..., None, None]*self.d[..., :, None]*self.d[..., None, :]
+        return _ScalarArray(2, f0, d, dd)
+
+    def inv(self):
+        """Return the inverse"""
+        v = 1/self.v
+        return self.apply(v, -v*v, 2*v*v*v)
+
+    def sqrt(self):
+        """Return the square root"""
+        v = np.sqrt(self.v)
+        return self.apply(v, 0.5/v, -0.25/(v*self.v))
+
+
+class _Vector3Array(object):
+    """An array of three dimensional vectors with optional derivatives
+
+       This is the batched counterpart of :class:`Vector3`. The Cartesian
+       components are stored in the axis that follows the batch shape.
+    """
+
+    def __init__(self, deriv, v, d=None, dd=None):
+        self.deriv = deriv
+        self.v = v
+        self.d = d
+        self.dd = dd
+
+    @classmethod
+    def from_input(cls, values, size, offset, deriv):
+        """Create a vector whose components are the inputs offset ... offset+2"""
+        if deriv < 1:
+            return cls(0, values)
+        d = np.zeros((3, size), float)
+        d[:, offset:offset+3] = np.identity(3)
+        d = np.broadcast_to(d, values.shape + (size,))
+        if deriv < 2:
+            return cls(1, values, d)
+        dd = np.broadcast_to(np.zeros(1, float), values.shape + (size, size))
+        return cls(2, values, d, dd)
+
+    def __sub__(self, other):
+        return _Vector3Array(
+            self.deriv, self.v - other.v,
+            None if self.deriv < 1 else self.d - other.d,
+            None if self.deriv < 2 else self.dd - other.dd,
+        )
+
+    def __mul__(self, other):
+        """Multiply with a _ScalarArray"""
+        v = self.v*other.v[..., None]
+        if self.deriv < 1:
+            return _Vector3Array(0, v)
+        d = self.d*other.v[..., None, None] + self.v[..., :, None]*other.d[..., None, :]
+        if self.deriv < 2:
+            return _Vector3Array(1, v, d)
+        tmp = self.d[..., :, :, None]*other.d[..., None, None, :]
+        dd = self.dd*other.v[..., None, None, None]
+        dd += self.v[..., :, None, None]*other.dd[..., None, :, :]
+        dd += tmp
+        dd += tmp.swapaxes(-1, -2)
+        return _Vector3Array(2, v, d, dd)
+
+    def norm(self):
+        """Return a _ScalarArray with the norms of the vectors"""
+        return _dot_array(self, self).sqrt()
+
+
+def _dot_array(r1, r2):
+    """Compute the dot products of two _Vector3Array objects"""
+    v = (r1.v*r2.v).sum(axis=-1)
+    if r1.deriv < 1:
+        return _ScalarArray(0, v)
+    d = np.einsum("...i,...in->...n", r1.v, r2.d)
+    d += np.einsum("...i,...in->...n", r2.v, r1.d)
+    if r1.deriv < 2:
+        return _ScalarArray(1, v, d)
+    tmp = np.einsum("...in,...im->...nm", r1.d, r2.d)
+    dd = np.einsum("...i,...inm->...nm", r1.v, r2.dd)
+    dd += np.einsum("...i,...inm->...nm", r2.v, r1.dd)
+    dd += tmp
+    dd += tmp.swapaxes(-1, -2)
+    return _ScalarArray(2, v, d, dd)
+
+
+def _cross_array(r1, r2):
+    """Compute the cross products of two _Vector3Array objects"""
+    v = np.cross(r1.v, r2.v)
+    if r1.deriv < 1:
+        return _Vector3Array(0, v)
+    d = np.cross(r1.d, r2.v[..., :, None], axis=-2)
+    d += np.cross(r1.v[..., :, None], r2.d, axis=-2)
+    if r1.deriv < 2:
+        return _Vector3Array(1, v, d)
+    dd = np.cross(r1.dd, r2.v[..., :, None, None], axis=-3)
+    dd += np.cross(r1.v[..., :, None, None], r2.dd, axis=-3)
+    dd += np.cross(r1.d[..., :, :, None], r2.d[..., :, None, :], axis=-3)
+    dd += np.cross(r1.d[..., :, None, :], r2.d[..., :, :, None], axis=-3)
+    return _Vector3Array(2, v, d, dd)
+
+
+def _arctan2_array(y, x):
+    """Compute the angles arctan2(y, x) of two _ScalarArray objects"""
+    v = np.arctan2(y.v, x.v)
+    if y.deriv < 1:
+        return _ScalarArray(0, v)
+    r2 = x.v**2 + y.v**2
+    d = (x.v[..., None]*y.d - y.v[..., None]*x.d)/r2[..., None]
+    if y.deriv < 2:
+        return _ScalarArray(1, v, d)
+    tmp = 2*(x.v[..., None]*x.d + y.v[..., None]*y.d)
+    dd = y.d[..., :, None]*x.d[..., None, :]
+    dd -= x.d[..., :, None]*y.d[..., None, :]
+    dd += x.v[..., None, None]*y.dd
+    dd -= y.v[..., None, None]*x.dd
+    dd /= r2[..., None, None]
+    dd -= d[..., :, None]*tmp[..., None, :]/r2[..., None, None]
+    return _ScalarArray(2, v, d, dd)
+
+
+#
+# Batched internal coordinate functions
+#
+
+
+def bond_length_batch(coordinates, indexes, deriv=0):
+    """Compute the distances between many pairs of atoms in many frames
+
+       Arguments:
+        | ``coordinates``  --  an array with shape (N, 3) or (F, N, 3), where N
+                               is the number of atoms and F the number of
+                               frames
+        | ``indexes``  --  an integer array with shape (M, 2), each row defines
+                           one bond length as in :func:`bond_length`
+        | ``deriv``  --  the derivatives to be computed: 0, 1 or 2 [default=0]
+
+       Returns a tuple with the values, an array with shape (F, M), optionally
+       followed by the gradients, shape (F, M, 2, 3), and the Hessians, shape
+       (F, M, 2, 3, 2, 3). The leading axis F is absent when the coordinates
+       of a single frame are given. All other ``_batch`` functions follow the
+       same conventions.
+
+       The memory usage of the Hessians grows quickly. When many frames must
+       be processed, it is best to call this function with chunks of frames.
+    """
+    return _batch_transform(coordinates, indexes, _BOND_RELATIVE, _bond_length_batch_low, deriv)
+
+
+def bend_cos_batch(coordinates, indexes, deriv=0):
+    """Compute many bending cosines, see :func:`bend_cos` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _BEND_RELATIVE, _bend_cos_batch_low, deriv)
+
+
+def bend_angle_batch(coordinates, indexes, deriv=0):
+    """Compute many bending angles, see :func:`bend_angle` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _BEND_RELATIVE, _bend_angle_batch_low, deriv)
+
+
+def dihed_cos_batch(coordinates, indexes, deriv=0):
+    """Compute many dihedral cosines, see :func:`dihed_cos` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _DIHED_RELATIVE, _dihed_cos_batch_low, deriv)
+
+
+def dihed_angle_batch(coordinates, indexes, deriv=0):
+    """Compute many dihedral angles, see :func:`dihed_angle` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _DIHED_RELATIVE, _dihed_angle_batch_low, deriv)
+
+
+def opbend_dist_batch(coordinates, indexes, deriv=0):
+    """Compute many out-of-plane distances, see :func:`opbend_dist` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _OPBEND_RELATIVE, _opdist_batch_low, deriv)
+
+
+def opbend_cos_batch(coordinates, indexes, deriv=0):
+    """Compute many out-of-plane cosines, see :func:`opbend_cos` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _OPBEND_RELATIVE, _opbend_cos_batch_low, deriv)
+
+
+def opbend_angle_batch(coordinates, indexes, deriv=0):
+    """Compute many out-of-plane angles, see :func:`opbend_angle` and :func:`bond_length_batch`"""
+    return _batch_transform(coordinates, indexes, _OPBEND_RELATIVE, _opbend_angle_batch_low, deriv)
+
+
+def opbend_mcos_batch(coordinates, indexes, deriv=0):
+    """Compute many mean out-of-plane cosines, see :func:`opbend_mcos` and :func:`bond_length_batch`"""
+    return _batch_transform_mean(coordinates, indexes, opbend_cos_batch, deriv)
+
+
+def opbend_mangle_batch(coordinates, indexes, deriv=0):
+    """Compute many mean out-of-plane angles, see :func:`opbend_mangle` and :func:`bond_length_batch`"""
+    return _batch_transform_mean(coordinates, indexes, opbend_angle_batch, deriv)
+
+
+#
+# Batched transformers
+#
+
+
+# Each row defines a relative vector as a linear combination of atom positions.
+_BOND_RELATIVE = np.array([[1, -1]], float)
+_BEND_RELATIVE = np.array([[1, -1, 0], [0, -1, 1]], float)
+_DIHED_RELATIVE = np.array([[1, -1, 0, 0], [0, -1, 1, 0], [0, 0, -1, 1]], float)
+_OPBEND_RELATIVE = np.array([[-1, 1, 0, 0], [-1, 0, 1, 0], [-1, 0, 0, 1]], float)
+
+
+def _batch_transform(coordinates, indexes, relative, fn_low, deriv):
+    """Evaluate fn_low on relative vectors and transform to atom derivatives"""
+    if deriv not in (0, 1, 2):
+        raise ValueError("deriv must be 0, 1 or 2.")
+    coordinates = np.asarray(coordinates, float)
+    indexes = np.asarray(indexes, int)
+    nrel, natom = relative.shape
+    if indexes.ndim != 2 or indexes.shape[1] != natom:
+        raise TypeError("The indexes must be an array with shape (M, %i)." % natom)
+    if coordinates.ndim not in (2, 3) or coordinates.shape[-1] != 3:
+        raise TypeError("The coordinates must be an array with shape (N, 3) or (F, N, 3).")
+    rs = coordinates[..., indexes, :]
+    vectors = np.einsum("ji,...ix->...jx", relative, rs)
+    result = fn_low([vectors[..., j, :] for j in range(nrel)], deriv).results()
+    shape = result[0].shape
+    if deriv == 0:
+        return result
+    d = result[1].reshape(shape + (nrel, 3))
+    d = np.einsum("ji,...jx->...ix", relative, d)
+    if deriv == 1:
+        return result[0], d
+    dd = result[2].reshape(shape + (nrel, 3, nrel, 3))
+    dd = np.einsum("ji,lk,...jxly->...ixky", relative, relative, dd, optimize=True)
+    return result[0], d, dd
+
+
+def _batch_transform_mean(coordinates, indexes, fn, deriv):
+    """Compute the mean of fn over the 3 cyclic permutations of the first three atoms"""
+    indexes = np.asarray(indexes, int)
+    result = None
+    for p in np.array([[0, 1, 2, 3], [2, 0, 1, 3], [1, 2, 0, 3]]):
+        # reorder the derivatives to the original order of the atoms
+        inv = p.argsort()
+        opbend = fn(coordinates, indexes[:, p], deriv)
+        terms = [opbend[0]/3]
+        if deriv > 0:
+            terms.append(opbend[1][..., inv, :]/3)
+        if deriv > 1:
+            terms.append(opbend[2][..., inv, :, :, :][..., inv, :]/3)
+        if result is None:
+            result = terms
+        else:
+            for term, total in zip(terms, result):
+                total += term
+    return tuple(result)
+
+
+#
+# Batched low level internal coordinate functions
+#
+
+
+def _bond_length_batch_low(vectors, deriv):
+    """Similar to _bond_length_low, but for arrays of relative vectors"""
+    r = _Vector3Array.from_input(vectors[0], 3, 0, deriv)
+    return r.norm()
+
+
+def _bend_cos_batch_low(vectors, deriv):
+    """Similar to _bend_cos_low, but for arrays of relative vectors"""
+    a = _Vector3Array.from_input(vectors[0], 6, 0, deriv)
+    b = _Vector3Array.from_input(vectors[1], 6, 3, deriv)
+    return _dot_array(a, b)*(a.norm()*b.norm()).inv()
+
+
+def _bend_angle_batch_low(vectors, deriv):
+    """Similar to _bend_angle_low, but for arrays of relative vectors"""
+    c = _bend_cos_batch_low(vectors, deriv)
+    return _cos_to_angle_array(c)
+
+
+def _dihed_angle_batch_low(vectors, deriv):
+    """Similar to _dihed_angle_low, but for arrays of relative vectors
+
+       The angle is computed with arctan2, which is accurate for all angles,
+       such that no switching between arccos and arcsin is needed.
+    """
+    a = _Vector3Array.from_input(vectors[0], 9, 0, deriv)
+    b = _Vector3Array.from_input(vectors[1], 9, 3, deriv)
+    c = _Vector3Array.from_input(vectors[2], 9, 6, deriv)
+    b = b*b.norm().inv()
+    x = _dot_array(a, c) - _dot_array(a, b)*_dot_array(c, b)
+    y = _dot_array(_cross_array(b, a), c)
+    return _arctan2_array(y, x)
+
+
+def _dihed_cos_batch_low(vectors, deriv):
+    """Similar to _dihed_cos_low, but for arrays of relative vectors"""
+    angle = _dihed_angle_batch_low(vectors, deriv)
+    return angle.apply(np.cos(angle.v), -np.sin(angle.v), -np.cos(angle.v))
+
+
+def _opdist_batch_low(vectors, deriv):
+    """Similar to _opdist_low, but for arrays of relative vectors"""
+    a = _Vector3Array.from_input(vectors[0], 9, 0, deriv)
+    b = _Vector3Array.from_input(vectors[1], 9, 3, deriv)
+    c = _Vector3Array.from_input(vectors[2], 9, 6, deriv)
+    n = _cross_array(a, b)
+    return _dot_array(c, n)*n.norm().inv()
+
+
+def _opbend_sin_batch_low(vectors, deriv):
+    """The sine of the out-of-plane angle for arrays of relative vectors"""
+    a = _Vector3Array.from_input(vectors[0], 9, 0, deriv)
+    b = _Vector3Array.from_input(vectors[1], 9, 3, deriv)
+    c = _Vector3Array.from_input(vectors[2], 9, 6, deriv)
+    n = _cross_array(a, b)
+    return _dot_array(c, n)*(n.norm()*c.norm()).inv()
+
+
+def _opbend_cos_batch_low(vectors, deriv):
+    """Similar to _opbend_cos_low, but for arrays of relative vectors"""
+    s = _opbend_sin_batch_low(vectors, deriv)
+    v = np.sqrt(1 - s.v**2)
+    return s.apply(v, -s.v/v, -1/v**3)
+
+
+def _opbend_angle_batch_low(vectors, deriv):
+    """Similar to _opbend_angle_low, but for arrays of relative vectors"""
+    s = _opbend_sin_batch_low(vectors, deriv)
+    v = np.clip(s.v, -1, 1)
+    tmp = 1 - v**2
+    return s.apply(np.arcsin(v), 1/np.sqrt(tmp), v/tmp**1.5)
+
+
+def _cos_to_angle_array(c):
+    """Convert an array of cosines with derivatives to angles with derivatives"""
+    v = np.clip(c.v, -1, 1)
+    tmp = 1 - v**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor1 = np.where(tmp > 0, -1/np.sqrt(tmp), 0.0)
+        factor2 = v*factor1**3
+    return c.apply(np.arccos(v), factor1, factor2)
+
+
+#
+# Sets of internal coordinates
+#
+
+
+class InternalCoordinates(object):
+    """A set of internal coordinates with a sparse Wilson B-matrix
+
+       The internal coordinates are organized in groups. All internal
+       coordinates in one group are computed with the same batched function,
+       e.g. :func:`bond_length_batch`. The order of the internal coordinates
+       is the order of the groups, followed by the order of the rows in the
+       index arrays.
+
+       After a call to update_coordinates, the following attributes are
+       available:
+
+       | ``values`` -- an array with all internal coordinates.
+       | ``bmatrix`` -- the Wilson B-matrix, i.e. the derivatives of the
+                        internal coordinates towards the Cartesian
+                        coordinates, as a scipy.sparse.csr_matrix with shape
+                        (M, 3N).
+
+       The second derivatives (K) are stored per group as dense blocks and
+       can be contracted with a vector of internal gradients with the method
+       contract_k.
+    """
+
+    def __init__(self, size, groups):
+        """
+           Arguments:
+            | ``size`` -- The number of atoms.
+            | ``groups`` -- A list of pairs (icfn_batch, indexes), where
+                            icfn_batch is one of the batched internal
+                            coordinate functions and indexes is an integer
+                            array with shape (M, k).
+        """
+        self.size = size
+        self.groups = [(icfn_batch, np.asarray(indexes, int)) for icfn_batch, indexes in groups]
+        self.offsets = np.cumsum([0] + [len(indexes) for icfn_batch, indexes in self.groups])
+        self.values = None
+        self.bmatrix = None
+        self._hessians = None
+
+    @classmethod
+    def from_graph(cls, graph, bends=True, dihedrals=True, opbends=True):
+        """Construct all valence internal coordinates of a molecular graph
+
+           Arguments:
+            | ``graph`` -- A Graph or MolecularGraph object.
+
+           Optional arguments:
+            | ``bends`` -- Include bending angles. [default=True]
+            | ``dihedrals`` -- Include dihedral angles. [default=True]
+            | ``opbends`` -- Include out-of-plane angles for all atoms with
+                             three neighbors. The second atom of an improper
+                             is the one that moves out of the plane.
+                             [default=True]
+
+           Dihedral angles are ill-defined when one of the bending angles in
+           the dihedral is linear. Such dihedrals should be left out.
+        """
+        groups = [(bond_length_batch, get_bonds(graph))]
+        if bends:
+            groups.append((bend_angle_batch, get_bends(graph)))
+        if dihedrals:
+            groups.append((dihed_angle_batch, get_dihedrals(graph)))
+        if opbends:
+            groups.append((opbend_angle_batch, get_impropers(graph)[:, [0, 2, 3, 1]]))
+        return cls(graph.num_vertices, groups)
+
+    num_ic = property(lambda self: self.offsets[-1])
+
+    def update_coordinates(self, coordinates, deriv=2):
+        """Compute the internal coordinates and their derivatives
+
+           Arguments:
+            | ``coordinates`` -- A numpy array with shape (N, 3).
+
+           Optional argument:
+            | ``deriv`` -- 1 to compute only the B-matrix, 2 to compute also
+                           the second derivatives (K). [default=2]
+        """
+        from scipy.sparse import coo_matrix
+        if deriv not in (1, 2):
+            raise ValueError("deriv must be 1 or 2.")
+        values = []
+        rows = []
+        cols = []
+        data = []
+        hessians = []
+        for offset, (icfn_batch, indexes) in zip(self.offsets, self.groups):
+            result = icfn_batch(coordinates, indexes, deriv)
+            values.append(result[0])
+            ics = np.arange(offset, offset + len(indexes))
+            atom_cols = 3*indexes[:, :, None] + np.arange(3)
+            rows.append(np.repeat(ics, 3*indexes.shape[1]))
+            cols.append(atom_cols.ravel())
+            data.append(result[1].ravel())
+            if deriv == 2:
+                hessians.append(result[2])
+        self.values = np.concatenate(values)
+        self.bmatrix = coo_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(self.num_ic, 3*self.size)
+        ).tocsr()
+        self._hessians = hessians if deriv == 2 else None
+
+    def contract_k(self, gq):
+        """Return sum_i gq[i] K_i as a sparse 3Nx3N matrix
+
+           Arguments:
+            | ``gq`` -- An array with one element per internal coordinate.
+        """
+        from scipy.sparse import coo_matrix
+        if self._hessians is None:
+            raise ValueError("The second derivatives are not computed. Call update_coordinates with deriv=2.")
+        gq = np.asarray(gq, float)
+        rows = []
+        cols = []
+        data = []
+        for offset, (icfn_batch, indexes), hessians in zip(self.offsets, self.groups, self._hessians):
+            blocks = gq[offset:offset + len(indexes), None, None, None, None]*hessians
+            atom_cols = 3*indexes[:, :, None] + np.arange(3)
+            atom_cols = atom_cols.reshape(len(indexes), 3*indexes.shape[1])
+            rows.append(np.repeat(atom_cols, atom_cols.shape[1], axis=1).ravel())
+            cols.append(np.tile(atom_cols, (1, atom_cols.shape[1])).ravel())
+            data.append(blocks.ravel())
+        size = 3*self.size
+        # Duplicate entries are summed in the conversion.
+        return coo_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(size, size)
+        ).tocsr()
+
+    def gradient_to_cartesian(self, gq):
+        """Transform a gradient in internal coordinates to Cartesian coordinates
+
+           Returns an array with shape (N, 3).
+        """
+        return self.bmatrix.T.dot(np.asarray(gq, float)).reshape(-1, 3)
+
+    def gradient_to_internal(self, gx, tol=1e-14):
+        """Transform a Cartesian gradient to internal coordinates
+
+           The least-norm solution of B^T gq = gx is computed. For a redundant
+           set of internal coordinates, this is the same as the transformation
+           with the generalized inverse of B.
+
+           Arguments:
+            | ``gx`` -- An array with 3N elements.
+
+           Optional argument:
+            | ``tol`` -- The relative tolerance of the iterative (LSQR) solver.
+                         [default=1e-14]
+        """
+        from scipy.sparse.linalg import lsqr
+        gx = np.asarray(gx, float).ravel()
+        return lsqr(self.bmatrix.T, gx, atol=tol, btol=tol, iter_lim=10*self.num_ic)[0]
+
+    def hessian_to_cartesian(self, hq, gq=None):
+        """Transform a Hessian in internal coordinates to Cartesian coordinates
+
+           The result is B^T hq B + sum_i gq[i] K_i, as a sparse 3Nx3N matrix.
+
+           Arguments:
+            | ``hq`` -- The Hessian in internal coordinates: a dense or sparse
+                        MxM matrix, or an array with M elements for a diagonal
+                        Hessian, e.g. the force constants of a valence force
+                        field.
+
+           Optional argument:
+            | ``gq`` -- The gradient in internal coordinates. When given, the
+                        contribution of the second derivatives of the internal
+                        coordinates is included.
+        """
+        from scipy.sparse import csr_matrix, diags
+        if isinstance(hq, np.ndarray) and hq.ndim == 1:
+            hq = diags(hq)
+        else:
+            hq = csr_matrix(hq)
+        result = self.bmatrix.T.dot(hq).dot(self.bmatrix).tocsr()
+        if gq is not None:
+            result = result + self.contract_k(gq)
+        return result
+
+    def hessian_to_internal(self, hx, gx=None, rcond=1e-10):
+        """Transform a Cartesian Hessian to internal coordinates
+
+           The result is (B^+)^T (hx - sum_i gq[i] K_i) B^+, where B^+ is the
+           generalized inverse of the B-matrix and gq is the gradient in
+           internal coordinates. The generalized inverse is computed with a
+           dense SVD, so this transformation is best suited for molecules
+           with up to a few thousand atoms.
+
+           Arguments:
+            | ``hx`` -- A dense or sparse 3Nx3N Hessian.
+
+           Optional arguments:
+            | ``gx`` -- The Cartesian gradient. When given, the contribution of
+                        the second derivatives of the internal coordinates is
+                        subtracted first.
+            | ``rcond`` -- Cutoff for small singular values of B.
+
+           Returns a dense MxM array.
+        """
+        from scipy.sparse import issparse
+        binv = np.linalg.pinv(self.bmatrix.toarray(), rcond)
+        if issparse(hx):
+            hx = hx.tocsr()
+        else:
+            hx = np.asarray(hx, float)
+        if gx is not None:
+            gq = np.dot(binv.T, np.asarray(gx, float).ravel())
+            kx = self.contract_k(gq)
+            hx = hx - (kx if issparse(hx) else kx.toarray())
+        # hx is symmetric, hence hx.dot(binv) is the transpose of binv.T hx
+        return np.dot(binv.T, np.asarray(hx.dot(binv)))
@@ -41,11 +41,9 @@ import numpy as np
 
 from molmod.periodic import periodic
 from molmod.units import unified
-from molmod.graphs import CriteriaSet, GraphSearch
-from molmod.molecular_graphs import MolecularGraph, BondPattern, \
-    BendingAnglePattern, DihedralAnglePattern, OutOfPlanePattern, \
-    HasNumNeighbors
+from molmod.molecular_graphs import MolecularGraph
 from molmod.graphs import Graph
+from molmod.topology import get_bonds, get_bends, get_dihedrals, get_impropers
 from molmod.io.common import FileFormatError
 
 
@@ -326,66 +324,25 @@ class PSFFile(object):
 
     def _add_graph_bonds(self, molecular_graph, offset, atom_types, molecule):
         # add bonds
-        match_generator = GraphSearch(BondPattern([CriteriaSet()]))
-        tmp = sorted([(
-            match.get_destination(0),
-            match.get_destination(1),
-        ) for match in match_generator(molecular_graph)])
-        new = len(tmp)
-        if new > 0:
-            prev = len(self.bonds)
-            self.bonds.resize((prev + len(tmp), 2))
-            self.bonds[-len(tmp):] = tmp
-            self.bonds[-len(tmp):] += offset
+        self.bonds = self._extend(self.bonds, get_bonds(molecular_graph), offset)
 
     def _add_graph_bends(self, molecular_graph, offset, atom_types, molecule):
         # add bends
-        match_generator = GraphSearch(BendingAnglePattern([CriteriaSet()]))
-        tmp = sorted([(
-            match.get_destination(0),
-            match.get_destination(1),
-            match.get_destination(2),
-        ) for match in match_generator(molecular_graph)])
-        new = len(tmp)
-        if new > 0:
-            prev = len(self.bends)
-            self.bends.resize((prev + len(tmp), 3))
-            self.bends[-len(tmp):] = tmp
-            self.bends[-len(tmp):] += offset
+        self.bends = self._extend(self.bends, get_bends(molecular_graph), offset)
 
     def _add_graph_dihedrals(self, molecular_graph, offset, atom_types, molecule):
         # add dihedrals
-        match_generator = GraphSearch(DihedralAnglePattern([CriteriaSet()]))
-        tmp = sorted([(
-            match.get_destination(0),
-            match.get_destination(1),
-            match.get_destination(2),
-            match.get_destination(3),
-        ) for match in match_generator(molecular_graph)])
-        new = len(tmp)
-        if new > 0:
-            prev = len(self.dihedrals)
-            self.dihedrals.resize((prev + len(tmp), 4))
-            self.dihedrals[-len(tmp):] = tmp
-            self.dihedrals[-len(tmp):] += offset
+        self.dihedrals = self._extend(self.dihedrals, get_dihedrals(molecular_graph), offset)
 
     def _add_graph_impropers(self, molecular_graph, offset, atom_types, molecule):
         # add improper dihedrals, only when center has three bonds
-        match_generator = GraphSearch(OutOfPlanePattern([CriteriaSet(
-            vertex_criteria={0: HasNumNeighbors(3)},
-        )], vertex_tags={1:1}))
-        tmp = sorted([(
-            match.get_destination(0),
-            match.get_destination(1),
-            match.get_destination(2),
-            match.get_destination(3),
-        ) for match in match_generator(molecular_graph)])
-        new = len(tmp)
-        if new > 0:
-            prev = len(self.impropers)
-            self.impropers.resize((prev + len(tmp), 4))
-            self.impropers[-len(tmp):] = tmp
-            self.impropers[-len(tmp):] += offset
+        self.impropers = self._extend(self.impropers, get_impropers(molecular_graph, 3), offset)
+
+    def _extend(self, terms, new, offset):
+        """Append new valence terms with the given offset to an array"""
+        if len(new) == 0:
+            return terms
+        return np.concatenate([terms.reshape(-1, new.shape[1]), new + offset])
 
     def get_graph(self):
         """Return the bond graph represented by the data structure"""
@@ -86,3 +86,37 @@ class PSFTestCase(BaseTestCase):
             psf.write_to_file("%s/tmp_impropers.psf" % dn)
             psf2 = PSFFile("%s/tmp_impropers.psf" % dn)
         self.assertArraysEqual(psf.impropers, psf2.impropers)
+
+    def test_dump_valence_terms(self):
+        # The valence terms are written in the canonical orientation of
+        # molmod.topology: bonds (i<j), bends (i<k), dihedrals (j<k) and
+        # impropers (k<l), sorted per section.
+        molecule = Molecule.from_file(pkg_resources.resource_filename(__name__, "../../data/test/ethene.xyz"))
+        psf = PSFFile()
+        psf.add_molecule(molecule)
+        with tmpdir(__name__, 'test_dump_valence_terms') as dn:
+            psf.write_to_file("%s/ethene.psf" % dn)
+            with open("%s/ethene.psf" % dn) as f:
+                content = f.read()
+        start = content.index("!NBOND") - 8
+        end = content.index("!NDON") - 8
+        self.assertEqual(content[start:end].split("\n"), [
+            "      5 !NBOND",
+            "      1       2       1       3       1       4       4       5",
+            "      4       6",
+            "",
+            "      6 !NTHETA",
+            "      1      4      5      1      4      6      2      1      3",
+            "      2      1      4      3      1      4      5      4      6",
+            "",
+            "      4 !NPHI",
+            "      2      1      4      5      2      1      4      6",
+            "      3      1      4      5      3      1      4      6",
+            "",
+            "      6 !NIMPHI",
+            "      1      2      3      4      1      3      2      4",
+            "      1      4      2      3      4      1      5      6",
+            "      4      5      1      6      4      6      1      5",
+            "",
+            "",
+        ])
@@ -30,11 +30,12 @@ import numpy as np
 
 from molmod.graphs import cached, Graph, CustomPattern
 from molmod.utils import ReadOnlyAttribute
-from molmod.binning import PairSearchIntra
+from molmod.binning import PairSearchIntra, NeighborList
+from molmod.units import angstrom
 
 
 __all__ = [
-    "MolecularGraph",
+    "MolecularGraph", "TopologyTracker",
     "HasAtomNumber", "HasNumNeighbors", "HasNeighborNumbers", "HasNeighbors",
     "BondLongerThan", "atom_criteria",
     "BondPattern", "BendingAnglePattern", "DihedralAnglePattern",
@@ -99,71 +100,38 @@ class MolecularGraph(Graph):
         """
         from molmod.bonds import bonds
 
-        unit_cell = molecule.unit_cell
+        # The cutoff only has to include the elements in the molecule.
+        cutoff = max(bonds.get_max_cutoff(molecule.numbers)*scaling, 1e-3)
+        if molecule.unit_cell is None:
+            # Bins as large as the short cutoff keep the grid dense, even for
+            # large systems, which is much faster than the default grid.
+            grid = cutoff
+        else:
+            grid = None
         pair_search = PairSearchIntra(
-            molecule.coordinates,
-            bonds.max_length*bonds.bond_tolerance,
-            unit_cell
+            molecule.coordinates, cutoff, molecule.unit_cell, grid
         )
-
-        orders = []
-        lengths = []
-        edges = []
-
-        for i0, i1, delta, distance in pair_search:
-            bond_order = bonds.bonded(molecule.numbers[i0], molecule.numbers[i1], distance/scaling)
-            if bond_order is not None:
-                if do_orders:
-                    orders.append(bond_order)
-                lengths.append(distance)
-                edges.append((i0,i1))
-
-        if do_orders:
-            result = cls(edges, molecule.numbers, orders, symbols=molecule.symbols)
-        else:
-            result = cls(edges, molecule.numbers, symbols=molecule.symbols)
+        indexes0, indexes1, deltas, distances = pair_search.arrays()
+        orders = bonds.bonded_array(
+            molecule.numbers[indexes0], molecule.numbers[indexes1],
+            distances/scaling
+        )
+        mask = orders > 0
+        edges = np.array([indexes0[mask], indexes1[mask]]).T
+        orders = orders[mask]
+        deltas = deltas[mask]
+        lengths = distances[mask]
 
         # run a check on all neighbors. if two bonds point in a direction that
-        # differs only by 45 deg. the longest of the two is discarded. the
-        # double loop over the neighbors is done such that the longest bonds
-        # are eliminated first
-        slated_for_removal = set([])
-        threshold = 0.5**0.5
-        for c, ns in result.neighbors.items():
-            lengths_ns = []
-            for n in ns:
-                delta = molecule.coordinates[n] - molecule.coordinates[c]
-                if unit_cell is not None:
-                    delta = unit_cell.shortest_vector(delta)
-                length = np.linalg.norm(delta)
-                lengths_ns.append([length, delta, n])
-            lengths_ns.sort(reverse=True, key=(lambda r: r[0]))
-            for i0, (length0, delta0, n0) in enumerate(lengths_ns):
-                for i1, (length1, delta1, n1) in enumerate(lengths_ns[:i0]):
-                    if length1 == 0.0:
-                        continue
-                    cosine = np.dot(delta0, delta1)/length0/length1
-                    if cosine > threshold:
-                        # length1 > length0
-                        slated_for_removal.add((c,n1))
-                        lengths_ns[i1][0] = 0.0
-        # construct a mask
-        mask = np.ones(len(edges), bool)
-        for i0, i1 in slated_for_removal:
-            edge_index = result.edge_index.get(frozenset([i0,i1]))
-            if edge_index is None:
-                raise ValueError('Could not find edge that has to be removed: %i %i' % (i0, i1))
-            mask[edge_index] = False
+        # differs only by 45 deg. the longest of the two is discarded.
+        mask = _get_parallel_bond_mask(edges, deltas, lengths)
+
         # actual removal
-        edges = [edges[i] for i in range(len(edges)) if mask[i]]
         if do_orders:
-            bond_order = [bond_order[i] for i in range(len(bond_order)) if mask[i]]
-            result = cls(edges, molecule.numbers, orders)
+            result = cls(edges[mask], molecule.numbers, orders[mask].astype(float), symbols=molecule.symbols)
         else:
-            result = cls(edges, molecule.numbers)
-
-        lengths = [lengths[i] for i in range(len(lengths)) if mask[i]]
-        result.bond_lengths = np.array(lengths)
+            result = cls(edges[mask], molecule.numbers, symbols=molecule.symbols)
+        result.bond_lengths = lengths[mask]
 
         return result
 
@@ -337,6 +305,176 @@ class MolecularGraph(Graph):
 
 # basic criteria for molecular patterns
 
+def _get_parallel_bond_mask(edges, deltas, lengths):
+    """Find bonds that are nearly parallel to a shorter bond of the same atom
+
+       Arguments:
+        | ``edges``  --  An (M, 2) integer array with the atoms of each bond.
+        | ``deltas``  --  An (M, 3) array with the relative vectors.
+        | ``lengths``  --  An (M,) array with the bond lengths.
+
+       Returns a boolean mask that is False for the bonds to be removed. When
+       two bonds of the same atom point in directions that differ less than 45
+       deg, the longest of the two is discarded.
+    """
+    # Each bond appears twice, once for each atom, with opposite relative
+    # vectors. The cosines between bonds of the same atom do not depend on the
+    # sign convention of the relative vectors.
+    centers = edges.ravel()
+    signs = np.tile([1.0, -1.0], len(edges))
+    half_deltas = np.repeat(deltas, 2, axis=0)*signs[:,None]
+    half_lengths = np.repeat(lengths, 2)
+    # sort by center and then by decreasing length
+    order = np.lexsort((-half_lengths, centers))
+    centers = centers[order]
+    # all pairs (longer, shorter) of bonds that share a center
+    ends = np.searchsorted(centers, centers, side='right')
+    counts = ends - np.arange(len(centers)) - 1
+    longer = np.repeat(np.arange(len(centers)), counts)
+    shorter = longer + 1 + np.arange(len(longer)) - np.repeat(counts.cumsum() - counts, counts)
+    longer = order[longer]
+    shorter = order[shorter]
+    norms = half_lengths[longer]*half_lengths[shorter]
+    nonzero = norms > 0
+    longer = longer[nonzero]
+    shorter = shorter[nonzero]
+    cosines = (half_deltas[longer]*half_deltas[shorter]).sum(axis=1)/norms[nonzero]
+    mask = np.ones(len(edges), bool)
+    mask[longer[cosines > 0.5**0.5]//2] = False
+    return mask
+
+
+class TopologyTracker(object):
+    """Follow the bonds in a molecule along a trajectory
+
+       Bonds are detected with the same criteria as in
+       :meth:`MolecularGraph.from_geometry`, but the pairs of atoms are taken
+       from a Verlet neighbor list that is reused for many frames. To avoid
+       that bonds flicker when their length is close to the threshold, an
+       existing bond is only broken when its length exceeds the threshold for
+       bond formation, multiplied by ``1 + hysteresis``.
+
+       Example usage::
+
+           tracker = TopologyTracker(molecule)
+           for frame, formed, broken, graph in tracker.iter_events(trajectory):
+               print frame, formed, broken
+    """
+
+    def __init__(self, molecule, do_orders=False, scaling=1.0, hysteresis=0.1,
+                 skin=1.0*angstrom):
+        """
+           Argument:
+            | ``molecule``  --  The molecule in the first frame. Its atom
+                                numbers, symbols and unit cell are used for all
+                                frames.
+
+           Optional arguments:
+            | ``do_orders``  --  set to True to estimate the bond orders
+            | ``scaling``  --  scale the threshold for the bond formation, see
+                               :meth:`MolecularGraph.from_geometry`
+            | ``hysteresis``  --  the relative margin on the threshold for
+                                  breaking an existing bond. [default=0.1]
+            | ``skin``  --  the skin of the neighbor list.
+                            [default=1.0*angstrom]
+
+           The attribute ``graph`` contains the MolecularGraph of the current
+           frame. With a zero hysteresis, this is the same graph as the one
+           from :meth:`MolecularGraph.from_geometry`.
+        """
+        from molmod.bonds import bonds
+        if hysteresis < 0:
+            raise ValueError("The hysteresis must not be negative.")
+        self.numbers = molecule.numbers
+        self.symbols = molecule.symbols
+        self.do_orders = do_orders
+        self.scaling = scaling
+        self.hysteresis = hysteresis
+        cutoff = max(bonds.get_max_cutoff(self.numbers)*scaling*(1 + hysteresis), 1e-3)
+        if molecule.unit_cell is None:
+            # See MolecularGraph.from_geometry
+            grid = cutoff + skin
+        else:
+            grid = None
+        self.neighbor_list = NeighborList(cutoff, skin, molecule.unit_cell, grid)
+        # sorted array with the keys i*N+j (i<j) of the current bonds
+        self.keys = np.zeros(0, int)
+        self.graph = None
+        self.update(molecule.coordinates)
+
+    def _get_keys(self, indexes0, indexes1):
+        """Return a unique integer for each pair of atoms"""
+        return np.minimum(indexes0, indexes1)*len(self.numbers) + np.maximum(indexes0, indexes1)
+
+    def update(self, coordinates):
+        """Detect changes in the topology for a new geometry
+
+           Argument:
+            | ``coordinates``  --  A Nx3 numpy array with Cartesian coordinates
+
+           Returns: ``formed``, ``broken``. These are (K, 2) integer arrays
+           with the atoms of the new and the broken bonds, sorted such that
+           the first atom has the lowest index. When the topology changes, the
+           attribute ``graph`` is replaced by a new MolecularGraph. Otherwise
+           it is kept, together with its bond orders and lengths of the last
+           change.
+        """
+        from molmod.bonds import bonds
+        indexes0, indexes1, deltas, distances = self.neighbor_list.update(coordinates)
+        numbers0 = self.numbers[indexes0]
+        numbers1 = self.numbers[indexes1]
+        orders = bonds.bonded_array(numbers0, numbers1, distances/self.scaling)
+        keys = self._get_keys(indexes0, indexes1)
+        if self.hysteresis > 0 and len(self.keys) > 0:
+            existing = np.in1d(keys, self.keys, assume_unique=True)
+            old_orders = bonds.bonded_array(
+                numbers0[existing], numbers1[existing],
+                distances[existing]/(self.scaling*(1 + self.hysteresis))
+            )
+            orders[existing] = np.where(orders[existing] > 0, orders[existing], old_orders)
+        mask = orders > 0
+        edges = np.array([indexes0[mask], indexes1[mask]]).T
+        mask[mask] = _get_parallel_bond_mask(edges, deltas[mask], distances[mask])
+
+        new_keys = keys[mask]
+        order = new_keys.argsort()
+        new_keys = new_keys[order]
+        if self.graph is not None and len(new_keys) == len(self.keys) and (new_keys == self.keys).all():
+            empty = np.zeros((0, 2), int)
+            return empty, empty
+
+        size = len(self.numbers)
+        formed = np.setdiff1d(new_keys, self.keys, assume_unique=True)
+        broken = np.setdiff1d(self.keys, new_keys, assume_unique=True)
+        self.keys = new_keys
+        edges = np.array([indexes0[mask], indexes1[mask]]).T[order]
+        if self.do_orders:
+            self.graph = MolecularGraph(edges, self.numbers, orders[mask][order].astype(float), symbols=self.symbols)
+        else:
+            self.graph = MolecularGraph(edges, self.numbers, symbols=self.symbols)
+        self.graph.bond_lengths = distances[mask][order]
+        return (
+            np.array([formed//size, formed%size]).T,
+            np.array([broken//size, broken%size]).T,
+        )
+
+    def iter_events(self, frames):
+        """Iterate over the frames in which the topology changes
+
+           Argument:
+            | ``frames``  --  An iterable over Nx3 arrays with Cartesian
+                              coordinates
+
+           Yields: ``index``, ``formed``, ``broken``, ``graph``, where
+           ``index`` is the position of the frame in ``frames``. See
+           :meth:`update` for the other items.
+        """
+        for index, coordinates in enumerate(frames):
+            formed, broken = self.update(coordinates)
+            if len(formed) > 0 or len(broken) > 0:
+                yield index, formed, broken, self.graph
+
+
 class HasAtomNumber(object):
     """Criterion for the atom number of a vertex"""
 
@@ -24,6 +24,12 @@
 
    The main purpose of this implementation is reliability, not speed. These
    routines can be used to validate an efficient low level implementation.
+
+   Force fields that implement :meth:`PairFF.yield_pair_terms` also have a
+   vectorized code path, which evaluates all pairs at once with NumPy array
+   operations. It is used by default for the force fields in this module and
+   can be disabled with the ``vectorized`` argument to compare with the
+   reference implementation.
 """
 
 
@@ -32,6 +38,8 @@ from __future__ import division
 from builtins import range
 import numpy as np
 
+from molmod.ewald import ewald_parameters, EwaldReciprocal, SPMEReciprocal
+
 __all__ = [
     "PairFF", "CoulombFF", "DispersionFF", "PauliFF", "ExpRepFF",
 ]
@@ -47,22 +55,118 @@ class PairFF(object):
        s and v for a given r_ij.
     """
 
-    def __init__(self, scaling, coordinates=None):
+    def __init__(self, scaling, coordinates=None, vectorized=False, cutoff=None, unit_cell=None):
         """Initialize a pair potential object
 
            Arguments:
              scaling  --  symmetric NxN array with pairwise scaling factors.
                           When an element is set to zero, it will be excluded.
+                          In sparse mode (see cutoff), this may also be a
+                          tuple (pairs, factors) with a Kx2 integer array of
+                          atom pairs and the corresponding K scaling factors.
+                          All other pairs have a scaling factor of one. None
+                          is equivalent to an empty exclusion list.
 
            Optional argument:
              coordinates  --  the initial Cartesian coordinates of the system,
                               which can be updated with the update_coordinates
                               method
+             vectorized  --  when True, the energy, gradient and hessian are
+                             computed with the vectorized code path. This
+                             requires an implementation of yield_pair_terms.
+             cutoff  --  when given, the sparse mode is used: only pairs with
+                         a distance below the cutoff interact. The pair list
+                         is constructed with molmod.binning and no NxN arrays
+                         are allocated, provided that the pair parameters of
+                         the derived classes are given per atom type or as a
+                         function (see _lookup_pair_parameters). The sparse
+                         mode is always vectorized and the hessian is a
+                         scipy.sparse matrix.
+             unit_cell  --  the periodic boundary conditions for the sparse
+                            mode. The minimum image convention is applied.
         """
+        self.cutoff = cutoff
+        self.unit_cell = unit_cell
+        if cutoff is None:
+            if unit_cell is not None:
+                raise ValueError("A unit cell can only be used in combination with a cutoff.")
+            self.vectorized = vectorized
+            self.scaling = scaling
+            self.scaling.ravel()[::len(self.scaling)+1] = 0
+        else:
+            self.vectorized = True
+            self.scaling_pairs, self.scaling_factors = self._get_exclusions(scaling)
         if coordinates is not None:
             self.update_coordinates(coordinates)
-        self.scaling = scaling
-        self.scaling.ravel()[::len(self.scaling)+1] = 0
+
+    sparse = property(lambda self: self.cutoff is not None)
+
+    def _get_exclusions(self, scaling):
+        """Convert the scaling argument to a sorted exclusion list
+
+           Returns a Kx2 array of atom pairs (with the largest index first),
+           sorted in lexicographical order, and an array with the
+           corresponding scaling factors.
+        """
+        if scaling is None:
+            pairs = np.zeros((0, 2), int)
+            factors = np.zeros(0, float)
+        elif isinstance(scaling, tuple):
+            pairs, factors = scaling
+            pairs = np.asarray(pairs, int).reshape(-1, 2)
+            factors = np.asarray(factors, float)
+            if len(factors) != len(pairs):
+                raise TypeError("The number of pairs and scaling factors must be the same.")
+        else:
+            pairs = np.array(np.tril(scaling != 1, -1).nonzero()).T
+            factors = scaling[pairs[:, 0], pairs[:, 1]]
+        pairs = np.array([pairs.max(axis=1), pairs.min(axis=1)]).T
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        pairs = pairs[order]
+        factors = factors[order]
+        if len(pairs) > 1 and (pairs[1:] == pairs[:-1]).all(axis=1).any():
+            raise ValueError("The exclusion list contains duplicate pairs.")
+        return pairs, factors
+
+    def _lookup_scaling(self, indexes1, indexes2):
+        """Return the scaling factors for the given pairs in sparse mode"""
+        result = np.ones(len(indexes1), float)
+        if len(self.scaling_pairs) > 0:
+            keys = self.scaling_pairs[:, 0]*self.numc + self.scaling_pairs[:, 1]
+            pair_keys = indexes1*self.numc + indexes2
+            positions = np.searchsorted(keys, pair_keys).clip(0, len(keys)-1)
+            mask = keys[positions] == pair_keys
+            result[mask] = self.scaling_factors[positions[mask]]
+        return result
+
+    def _lookup_pair_parameters(self, parameters, indexes1, indexes2):
+        """Return the pair parameters for the given pairs of atoms
+
+           Arguments:
+             parameters  --  the pair parameters in one of the following
+                             forms: a symmetric NxN array, a tuple (types,
+                             table) with an array of N integer atom types and
+                             a symmetric table with the parameters for each
+                             pair of types, or a function f(indexes1,
+                             indexes2) that returns the parameters for
+                             arrays of atom indexes
+             indexes1, indexes2  --  the integer arrays with the atom
+                                     indexes of the pairs
+        """
+        if isinstance(parameters, tuple):
+            types, table = parameters
+            types = np.asarray(types)
+            return np.asarray(table)[types[indexes1], types[indexes2]]
+        elif callable(parameters):
+            return parameters(indexes1, indexes2)
+        else:
+            return parameters[indexes1, indexes2]
+
+    def _lookup_pair_parameter(self, parameters, index1, index2):
+        """Return the pair parameter for a single pair of atoms"""
+        if isinstance(parameters, np.ndarray):
+            return parameters[index1, index2]
+        return self._lookup_pair_parameters(parameters, np.array([index1]), np.array([index2]))[0]
 
     def update_coordinates(self, coordinates=None):
         """Update the coordinates (and derived quantities)
@@ -73,20 +177,153 @@ class PairFF(object):
         if coordinates is not None:
             self.coordinates = coordinates
         self.numc = len(self.coordinates)
-        self.distances = np.zeros((self.numc, self.numc), float)
-        self.deltas = np.zeros((self.numc, self.numc, 3), float)
+        if self.sparse:
+            from molmod.binning import PairSearchIntra
+            indexes1, indexes2, deltas, distances = PairSearchIntra(
+                self.coordinates, self.cutoff, self.unit_cell
+            ).arrays()
+            scaling = self._lookup_scaling(indexes1, indexes2)
+            mask = scaling > 0
+            self.pair_indexes1 = indexes1[mask]
+            self.pair_indexes2 = indexes2[mask]
+            # molmod.binning returns r_j - r_i, while r_i - r_j is used here.
+            self.pair_deltas = -deltas[mask]
+            self.pair_distances = distances[mask]
+            self.pair_scaling = scaling[mask]
+            return
+        self.deltas = self.coordinates[:, np.newaxis, :] - self.coordinates[np.newaxis, :, :]
+        self.distances = np.sqrt((self.deltas**2).sum(axis=2))
         self.directions = np.zeros((self.numc, self.numc, 3), float)
-        self.dirouters = np.zeros((self.numc, self.numc, 3, 3), float)
-        for index1, coordinate1 in enumerate(self.coordinates):
-            for index2, coordinate2 in enumerate(self.coordinates):
-                delta = coordinate1 - coordinate2
-                self.deltas[index1, index2] = delta
-                distance = np.linalg.norm(delta)
-                self.distances[index1, index2] = distance
-                if index1 != index2:
-                    tmp = delta/distance
-                    self.directions[index1, index2] = tmp
-                    self.dirouters[index1, index2] = np.outer(tmp, tmp)
+        mask = ~np.identity(self.numc, bool)
+        self.directions[mask] = self.deltas[mask]/self.distances[mask, np.newaxis]
+        self.dirouters = self.directions[:, :, :, np.newaxis]*self.directions[:, :, np.newaxis, :]
+
+    def get_pairs(self):
+        """Return the indexes of all interacting pairs
+
+           Returns two integer arrays, ``indexes1`` and ``indexes2``, with
+           ``indexes1 > indexes2``.
+        """
+        if self.sparse:
+            return self.pair_indexes1, self.pair_indexes2
+        return np.tril(self.scaling > 0, -1).nonzero()
+
+    def _iter_pair_terms(self):
+        """Iterate over the terms of the vectorized code path
+
+           This method yields the same tuples as yield_pair_terms, except that
+           all terms are broadcast to full arrays and scaled. The last element
+           of each tuple are the pair directions.
+        """
+        indexes1, indexes2 = self.get_pairs()
+        if self.sparse:
+            deltas = self.pair_deltas
+            distances = self.pair_distances
+            scaling = self.pair_scaling
+        else:
+            deltas = self.deltas[indexes1, indexes2]
+            distances = self.distances[indexes1, indexes2]
+            scaling = self.scaling[indexes1, indexes2]
+        directions = deltas/distances[:, np.newaxis]
+        npair = len(indexes1)
+        for se, ve, sg, vg, sh, vh in self.yield_pair_terms(indexes1, indexes2, deltas, distances):
+            yield (
+                indexes1, indexes2, distances,
+                np.broadcast_to(se, (npair,))*scaling,
+                np.broadcast_to(ve, (npair,)),
+                np.broadcast_to(sg, (npair,))*scaling,
+                np.broadcast_to(vg, (npair, 3)),
+                np.broadcast_to(sh, (npair,))*scaling,
+                np.broadcast_to(vh, (npair, 3, 3)),
+                directions,
+            )
+
+    def yield_pair_terms(self, indexes1, indexes2, deltas, distances):
+        """Vectorized counterpart of the yield_pair_* methods
+
+           Arguments:
+             indexes1, indexes2  --  arrays with the atom indexes of M pairs
+             deltas  --  Mx3 array with relative vectors, r_i - r_j
+             distances  --  array with the corresponding M distances
+
+           Yields tuples (s, v, s', grad_i v, s'', grad_i (x) grad_i v) with
+           arrays for all M pairs, in the same order as the yield_pair_*
+           methods. Each element may also be a scalar (or zero) that can be
+           broadcast to an array with the proper shape.
+        """
+        raise NotImplementedError
+
+    def _energy_vectorized(self):
+        """Compute the energy of the system with the vectorized code path"""
+        result = 0.0
+        for indexes1, indexes2, distances, se, ve, sg, vg, sh, vh, directions in self._iter_pair_terms():
+            result += (se*ve).sum()
+        return result
+
+    def _gradient_vectorized(self):
+        """Compute the gradient with the vectorized code path"""
+        result = np.zeros((self.numc, 3), float)
+        for indexes1, indexes2, distances, se, ve, sg, vg, sh, vh, directions in self._iter_pair_terms():
+            pair_gradient = (sg*ve)[:, np.newaxis]*directions + se[:, np.newaxis]*vg
+            for c in range(3):
+                result[:, c] += np.bincount(indexes1, pair_gradient[:, c], self.numc)
+                result[:, c] -= np.bincount(indexes2, pair_gradient[:, c], self.numc)
+        return result
+
+    def _iter_pair_hessians(self):
+        """Iterate over the 3x3 hessian blocks of all pairs
+
+           Yields triplets (indexes1, indexes2, pair_hessian), where the last
+           element is an Mx3x3 array with the second derivatives towards the
+           coordinates of the first atom in each pair.
+        """
+        identity = np.identity(3, float)
+        for indexes1, indexes2, distances, se, ve, sg, vg, sh, vh, directions in self._iter_pair_terms():
+            dirouters = directions[:, :, np.newaxis]*directions[:, np.newaxis, :]
+            outer = directions[:, :, np.newaxis]*vg[:, np.newaxis, :]
+            pair_hessian = (
+                +(sh*ve)[:, np.newaxis, np.newaxis]*dirouters
+                +(sg*ve/distances)[:, np.newaxis, np.newaxis]*(identity - dirouters)
+                +sg[:, np.newaxis, np.newaxis]*(outer + outer.transpose(0, 2, 1))
+                +se[:, np.newaxis, np.newaxis]*vh
+            )
+            yield indexes1, indexes2, pair_hessian
+
+    def _hessian_vectorized(self):
+        """Compute the hessian with the vectorized code path"""
+        result = np.zeros((self.numc, self.numc, 3, 3), float)
+        for indexes1, indexes2, pair_hessian in self._iter_pair_hessians():
+            np.add.at(result, (indexes1, indexes1), pair_hessian)
+            np.add.at(result, (indexes2, indexes2), pair_hessian)
+            result[indexes1, indexes2] -= pair_hessian
+            result[indexes2, indexes1] -= pair_hessian.transpose(0, 2, 1)
+        return result.transpose(0, 2, 1, 3)
+
+    def _hessian_sparse(self):
+        """Compute the hessian as a sparse 3Nx3N matrix with 3x3 blocks"""
+        from scipy.sparse import coo_matrix
+        block_rows = []
+        block_cols = []
+        blocks = []
+        for indexes1, indexes2, pair_hessian in self._iter_pair_hessians():
+            block_rows.extend([indexes1, indexes2, indexes1, indexes2])
+            block_cols.extend([indexes1, indexes2, indexes2, indexes1])
+            blocks.extend([pair_hessian, pair_hessian, -pair_hessian, -pair_hessian.transpose(0, 2, 1)])
+        size = 3*self.numc
+        if len(blocks) == 0:
+            return coo_matrix((size, size)).tobsr(blocksize=(3, 3))
+        block_rows = np.concatenate(block_rows)
+        block_cols = np.concatenate(block_cols)
+        blocks = np.concatenate(blocks)
+        offsets = np.arange(3)
+        rows = 3*block_rows[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis]
+        cols = 3*block_cols[:, np.newaxis, np.newaxis] + offsets
+        rows, cols = np.broadcast_arrays(rows, cols)
+        result = coo_matrix(
+            (blocks.ravel(), (rows.ravel(), cols.ravel())), shape=(size, size)
+        )
+        # Duplicate entries are summed in the conversion.
+        return result.tocsr().tobsr(blocksize=(3, 3))
 
     def yield_pair_energies(self, index1, index2):
         """Yields pairs ((s(r_ij), v(bar{r}_ij))"""
@@ -102,6 +339,8 @@ class PairFF(object):
 
     def energy(self):
         """Compute the energy of the system"""
+        if self.vectorized:
+            return self._energy_vectorized()
         result = 0.0
         for index1 in range(self.numc):
             for index2 in range(index1):
@@ -121,6 +360,8 @@ class PairFF(object):
 
     def gradient(self):
         """Compute the gradient of the energy for all atoms"""
+        if self.vectorized:
+            return self._gradient_vectorized()
         result = np.zeros((self.numc, 3), float)
         for index1 in range(self.numc):
             result[index1] = self.gradient_component(index1)
@@ -162,7 +403,15 @@ class PairFF(object):
         return result
 
     def hessian(self):
-        """Compute the hessian of the energy"""
+        """Compute the hessian of the energy
+
+           In dense mode, the result is an Nx3xNx3 array. In sparse mode, it
+           is a 3Nx3N scipy.sparse.bsr_matrix with 3x3 blocks.
+        """
+        if self.sparse:
+            return self._hessian_sparse()
+        if self.vectorized:
+            return self._hessian_vectorized()
         result = np.zeros((self.numc, 3, self.numc, 3), float)
         for index1 in range(self.numc):
             for index2 in range(self.numc):
@@ -174,14 +423,16 @@ class PairFF(object):
         return self.gradient().ravel()
 
     def hessian_flat(self):
-        """Return the hessian a 3N x 3N array"""
+        """Return the hessian a 3N x 3N array (sparse in sparse mode)"""
+        if self.sparse:
+            return self.hessian()
         return self.hessian().reshape((self.numc*3, self.numc*3))
 
 
 class CoulombFF(PairFF):
     """Computes the electrostatic interactions using charges and point dipoles"""
 
-    def __init__(self, scaling, charges=None, dipoles=None, coordinates=None):
+    def __init__(self, scaling, charges=None, dipoles=None, coordinates=None, vectorized=True, cutoff=None, unit_cell=None, ewald=None, accuracy=1e-8):
         """Initialize a CoulombFF object
 
            Arguments:
@@ -194,11 +445,158 @@ class CoulombFF(PairFF):
              coordinates  --  the initial Cartesian coordinates of the system,
                               which can be updated with the update_coordinates
                               method
+             vectorized  --  when False, the reference implementation is used
+                             for the energy, gradient and hessian
+             cutoff, unit_cell  --  see PairFF
+             ewald  --  the method for the periodic electrostatics in a
+                        three-dimensional unit cell: None (minimum image
+                        convention only), "ewald" (conventional Ewald
+                        summation) or "spme" (smooth particle-mesh Ewald).
+                        This requires a cutoff for the real-space part and a
+                        unit cell. Only charges are supported.
+             accuracy  --  the relative magnitude of the neglected terms in
+                           the Ewald summation [default=1e-8]
+
+           In Ewald mode, the energy, gradient, esp and efield include all
+           periodic images. Scaling factors different from one are applied
+           to the minimum image of the corresponding pair only. The esp and
+           efield at the atoms are consistent with the energy, i.e. scaling
+           factors are included. The hessian is not available in this mode.
         """
-        PairFF.__init__(self, scaling, coordinates)
+        if ewald is not None:
+            if cutoff is None or unit_cell is None:
+                raise ValueError("The Ewald summation requires a cutoff and a unit cell.")
+            if dipoles is not None:
+                raise NotImplementedError("The Ewald summation is only implemented for charges.")
+            if cutoff > 0.5*unit_cell.spacings.min():
+                raise ValueError("The cutoff must not exceed half of the smallest spacing between crystal planes.")
+            alpha, kcut = ewald_parameters(cutoff, accuracy)
+            if ewald == "ewald":
+                self.reciprocal = EwaldReciprocal(unit_cell, alpha, kcut)
+            elif ewald == "spme":
+                self.reciprocal = SPMEReciprocal(unit_cell, alpha, kcut)
+            else:
+                raise ValueError("Unknown Ewald method: %s" % ewald)
+        self.ewald = ewald
+        PairFF.__init__(self, scaling, coordinates, vectorized, cutoff, unit_cell)
         self.charges = charges
         self.dipoles = dipoles
 
+    def _erfc_terms(self, distances):
+        """Return erfc(alpha*r)/r and its derivative towards r"""
+        from scipy.special import erfc
+        alpha = self.reciprocal.alpha
+        d_1 = 1/distances
+        values = erfc(alpha*distances)*d_1
+        derivatives = -(values + 2*alpha/np.sqrt(np.pi)*np.exp(-(alpha*distances)**2))*d_1
+        return values, derivatives
+
+    def _ewald_atoms(self):
+        """Compute the periodic esp and efield at the atoms
+
+           The contribution of the atom itself is excluded and the scaling
+           factors are taken into account, such that the energy is
+           0.5*dot(charges, esp) and the gradient is -charges*efield.
+        """
+        charges = self.charges
+        esp, efield = self.reciprocal.compute(self.coordinates, charges, self.coordinates, True)
+        esp -= self.reciprocal.self_potential(charges)
+
+        def add_pairs(indexes1, indexes2, deltas, distances, factors, values, derivatives):
+            tmp = factors*values
+            esp[:] += np.bincount(indexes1, tmp*charges[indexes2], self.numc)
+            esp[:] += np.bincount(indexes2, tmp*charges[indexes1], self.numc)
+            tmp = -(factors*derivatives/distances)[:, np.newaxis]*deltas
+            for c in range(3):
+                efield[:, c] += np.bincount(indexes1, tmp[:, c]*charges[indexes2], self.numc)
+                efield[:, c] -= np.bincount(indexes2, tmp[:, c]*charges[indexes1], self.numc)
+
+        # real-space part
+        values, derivatives = self._erfc_terms(self.pair_distances)
+        add_pairs(
+            self.pair_indexes1, self.pair_indexes2, self.pair_deltas,
+            self.pair_distances, self.pair_scaling, values, derivatives
+        )
+        # Remove the reciprocal-space part, erf(alpha*r)/r, of the scaled
+        # pairs, using their minimum image.
+        if len(self.scaling_pairs) > 0:
+            indexes1, indexes2 = self.scaling_pairs.T
+            deltas = self.unit_cell.shortest_vector(
+                self.coordinates[indexes1] - self.coordinates[indexes2]
+            )
+            distances = np.sqrt((deltas**2).sum(axis=1))
+            values, derivatives = self._erfc_terms(distances)
+            d_1 = 1/distances
+            add_pairs(
+                indexes1, indexes2, deltas, distances,
+                self.scaling_factors - 1, d_1 - values, -d_1*d_1 - derivatives
+            )
+        return esp, efield
+
+    def _ewald_points(self, points):
+        """Compute the periodic esp and efield at arbitrary points"""
+        from molmod.binning import PairSearchInter
+        esp, efield = self.reciprocal.compute(self.coordinates, self.charges, points, True)
+        indexes0, indexes1, deltas, distances = PairSearchInter(
+            points, self.coordinates, self.cutoff, self.unit_cell
+        ).arrays()
+        values, derivatives = self._erfc_terms(distances)
+        charges = self.charges[indexes1]
+        esp += np.bincount(indexes0, charges*values, len(points))
+        # deltas point from the points to the atoms
+        tmp = (charges*derivatives/distances)[:, np.newaxis]*deltas
+        for c in range(3):
+            efield[:, c] += np.bincount(indexes0, tmp[:, c], len(points))
+        return esp, efield
+
+    def energy(self):
+        """Compute the energy of the system"""
+        if self.ewald is not None:
+            return 0.5*np.dot(self.charges, self._ewald_atoms()[0])
+        return PairFF.energy(self)
+
+    def gradient(self):
+        """Compute the gradient of the energy for all atoms"""
+        if self.ewald is not None:
+            return -self.charges[:, np.newaxis]*self._ewald_atoms()[1]
+        return PairFF.gradient(self)
+
+    def hessian(self):
+        """Compute the hessian of the energy"""
+        if self.ewald is not None:
+            raise NotImplementedError("The hessian is not available with the Ewald summation.")
+        return PairFF.hessian(self)
+
+    def yield_pair_terms(self, indexes1, indexes2, deltas, distances):
+        """Vectorized counterpart of the yield_pair_* methods"""
+        d_1 = 1/distances
+        d_2 = d_1*d_1
+        d_3 = d_2*d_1
+        if self.charges is not None:
+            c1 = self.charges[indexes1]
+            c2 = self.charges[indexes2]
+            yield c1*c2*d_1, 1, -c1*c2*d_2, 0, 2*c1*c2*d_3, 0
+        if self.dipoles is not None:
+            d_4 = d_2*d_2
+            d_5 = d_4*d_1
+            d_6 = d_4*d_2
+            d_7 = d_6*d_1
+            p1 = self.dipoles[indexes1]
+            p2 = self.dipoles[indexes2]
+            p1p2 = (p1*p2).sum(axis=1)
+            p1delta = (p1*deltas).sum(axis=1)
+            p2delta = (p2*deltas).sum(axis=1)
+            outer = p1[:, :, np.newaxis]*p2[:, np.newaxis, :]
+            yield d_3*p1p2, 1, -3*d_4*p1p2, 0, 12*d_5*p1p2, 0
+            yield (
+                -3*d_5, p1delta*p2delta,
+                15*d_6, p1*p2delta[:, np.newaxis] + p2*p1delta[:, np.newaxis],
+                -90*d_7, outer + outer.transpose(0, 2, 1),
+            )
+            if self.charges is not None:
+                yield c1*d_3, p2delta, -3*c1*d_4, p2, 12*c1*d_5, 0
+                yield c2*d_3, -p1delta, -3*c2*d_4, -p1, 12*c2*d_5, 0
+
     def yield_pair_energies(self, index1, index2):
         """Yields pairs ((s(r_ij), v(bar{r}_ij))"""
         d_1 = 1/self.distances[index1, index2]
@@ -257,6 +655,8 @@ class CoulombFF(PairFF):
                 yield 12*c2*d_5, np.zeros((3, 3))
 
     def esp_point(self, point):
+        if self.ewald is not None:
+            return self._ewald_points(np.array([point], float))[0][0]
         result = 0.0
         for index2 in range(self.numc):
             delta = point - self.coordinates[index2]
@@ -281,12 +681,18 @@ class CoulombFF(PairFF):
 
     def esp(self):
         """Compute the electrostatic potential at each atom due to other atoms"""
+        if self.ewald is not None:
+            return self._ewald_atoms()[0]
+        if self.vectorized:
+            return self._esp_efield_vectorized()[0]
         result = np.zeros(self.numc, float)
         for index1 in range(self.numc):
             result[index1] = self.esp_component(index1)
         return result
 
     def efield_point(self, point):
+        if self.ewald is not None:
+            return self._ewald_points(np.array([point], float))[1][0]
         result = 0.0
         for index2 in range(self.numc):
             delta = point - self.coordinates[index2]
@@ -314,48 +720,191 @@ class CoulombFF(PairFF):
 
     def efield(self):
         """Compute the electrostatic potential at each atom due to other atoms"""
+        if self.ewald is not None:
+            return self._ewald_atoms()[1]
+        if self.vectorized:
+            return self._esp_efield_vectorized()[1]
         result = np.zeros((self.numc,3), float)
         for index1 in range(self.numc):
             result[index1] = self.efield_component(index1)
         return result
 
+    def _esp_efield_vectorized(self):
+        """Compute the esp and efield at each atom with array operations"""
+        indexes1, indexes2 = self.get_pairs()
+        if self.sparse:
+            deltas = self.pair_deltas
+            distances = self.pair_distances
+        else:
+            deltas = self.deltas[indexes1, indexes2]
+            distances = self.distances[indexes1, indexes2]
+        d_1 = 1/distances
+        directions = deltas*d_1[:, np.newaxis]
+        esp = np.zeros(self.numc, float)
+        efield = np.zeros((self.numc, 3), float)
+        # contributions of the second atom to the first (sign=1) and vice
+        # versa (sign=-1)
+        for sign, indexes_to, indexes_from in (1, indexes1, indexes2), (-1, indexes2, indexes1):
+            pair_esp = np.zeros(len(distances), float)
+            pair_efield = np.zeros((len(distances), 3), float)
+            if self.charges is not None:
+                charges = self.charges[indexes_from]
+                pair_esp += charges*d_1
+                pair_efield += (sign*charges*d_1*d_1)[:, np.newaxis]*directions
+            if self.dipoles is not None:
+                dipoles = self.dipoles[indexes_from]
+                dots = (dipoles*directions).sum(axis=1)
+                pair_esp += sign*dots*d_1*d_1
+                pair_efield += ((3*dots[:, np.newaxis]*directions - dipoles)*(d_1**3)[:, np.newaxis])
+            esp += np.bincount(indexes_to, pair_esp, self.numc)
+            for c in range(3):
+                efield[:, c] += np.bincount(indexes_to, pair_efield[:, c], self.numc)
+        return esp, efield
+
+    point_chunk_size = 4096
+
+    def _map_points(self, function, points, n_workers):
+        """Apply a function to chunks of points, optionally in a thread pool
+
+           The points are given as a contiguous array with three elements in
+           the last axis. A list with the results for each chunk is returned.
+        """
+        if points.ndim == 0 or points.shape[-1] != 3:
+            raise TypeError("The last axis of the points array must have three elements.")
+        points = points.reshape(-1, 3)
+        chunks = [
+            points[begin:begin+self.point_chunk_size]
+            for begin in range(0, len(points), self.point_chunk_size)
+        ]
+        if n_workers > 1 and len(chunks) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(n_workers)
+            try:
+                results = pool.map(function, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [function(chunk) for chunk in chunks]
+        return results
+
+    def _esp_efield_chunk(self, points, do_esp, do_efield):
+        """Compute the esp and/or efield at a chunk of points"""
+        if self.ewald is not None:
+            return self._ewald_points(points)
+        from molmod.ext import ff_esp_points
+        esp = np.zeros(len(points), float) if do_esp else None
+        efield = np.zeros((len(points), 3), float) if do_efield else None
+        charges = None
+        if self.charges is not None:
+            charges = np.ascontiguousarray(self.charges, dtype=float)
+        dipoles = None
+        if self.dipoles is not None:
+            dipoles = np.ascontiguousarray(self.dipoles, dtype=float)
+        ff_esp_points(
+            np.ascontiguousarray(self.coordinates, dtype=float), points,
+            charges, dipoles, esp, efield
+        )
+        return esp, efield
+
+    def esp_points(self, points, n_workers=1):
+        """Compute the electrostatic potential at many points
+
+           Arguments:
+            | ``points``  --  an array with shape (M, 3), or any other shape
+                              with three elements in the last axis, e.g. the
+                              result of Cube.get_points()
+
+           Optional argument:
+            | ``n_workers``  --  the number of threads that process chunks of
+                                 points in parallel [default=1]
+
+           This is the array counterpart of esp_point. The points are
+           processed in chunks of ``point_chunk_size`` with the C extension
+           (or the Ewald summation in Ewald mode). The result has the same
+           shape as ``points``, without the last axis.
+        """
+        points = np.ascontiguousarray(points, dtype=float)
+        results = self._map_points(
+            lambda chunk: self._esp_efield_chunk(chunk, True, False)[0],
+            points, n_workers
+        )
+        if len(results) == 0:
+            return np.zeros(points.shape[:-1], float)
+        return np.concatenate(results).reshape(points.shape[:-1])
+
+    def efield_points(self, points, n_workers=1):
+        """Compute the electric field at many points
+
+           Arguments:
+            | ``points``  --  an array with shape (M, 3) or any other shape
+                              with three elements in the last axis
+
+           Optional argument:
+            | ``n_workers``  --  the number of threads that process chunks of
+                                 points in parallel [default=1]
+
+           This is the array counterpart of efield_point. See esp_points for
+           more details. The result has the same shape as ``points``.
+        """
+        points = np.ascontiguousarray(points, dtype=float)
+        results = self._map_points(
+            lambda chunk: self._esp_efield_chunk(chunk, False, True)[1],
+            points, n_workers
+        )
+        if len(results) == 0:
+            return np.zeros(points.shape, float)
+        return np.concatenate(results).reshape(points.shape)
+
 
 
 class DispersionFF(PairFF):
     """Computes the London dispersion interaction"""
 
-    def __init__(self, scaling, strengths, coordinates=None):
+    def __init__(self, scaling, strengths, coordinates=None, vectorized=True, cutoff=None, unit_cell=None):
         """Initialize a DispersionFF object
 
            Arguments:
              scaling  --  symmetric NxN array with pairwise scaling factors.
                           When an element is set to zero, it will be excluded.
              strengths  --  a symmetric with linear coefficients in front of
-                            r**-6 for each atom pair
+                            r**-6 for each atom pair. In sparse mode, use a
+                            tuple (types, table) or a function instead of an
+                            NxN array (see PairFF._lookup_pair_parameters).
 
            Optional arguments:
              coordinates  --  the initial Cartesian coordinates of the system,
                               which can be updated with the update_coordinates
                               method
+             vectorized  --  when False, the reference implementation is used
+                             for the energy, gradient and hessian
+             cutoff, unit_cell  --  see PairFF
         """
-        PairFF.__init__(self, scaling, coordinates)
+        PairFF.__init__(self, scaling, coordinates, vectorized, cutoff, unit_cell)
         self.strengths = strengths
 
+    def yield_pair_terms(self, indexes1, indexes2, deltas, distances):
+        """Vectorized counterpart of the yield_pair_* methods"""
+        strengths = self._lookup_pair_parameters(self.strengths, indexes1, indexes2)
+        d_2 = distances**(-2)
+        d_6 = d_2*d_2*d_2
+        yield strengths*d_6, 1, -6*strengths*d_6/distances, 0, 42*strengths*d_6*d_2, 0
+
     def yield_pair_energies(self, index1, index2):
         """Yields pairs ((s(r_ij), v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield strength*distance**(-6), 1
 
     def yield_pair_gradients(self, index1, index2):
         """Yields pairs ((s'(r_ij), grad_i v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield -6*strength*distance**(-7), np.zeros(3)
 
     def yield_pair_hessians(self, index1, index2):
         """Yields pairs ((s''(r_ij), grad_i (x) grad_i v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield 42*strength*distance**(-8), np.zeros((3, 3))
 
@@ -363,38 +912,50 @@ class DispersionFF(PairFF):
 class PauliFF(PairFF):
     """Computes the Pauli repulsion interaction"""
 
-    def __init__(self, scaling, strengths, coordinates=None):
+    def __init__(self, scaling, strengths, coordinates=None, vectorized=True, cutoff=None, unit_cell=None):
         """Initialize a PauliFF
 
            Arguments:
              scaling  --  symmetric NxN array with pairwise scaling factors.
                           When an element is set to zero, it will be excluded.
              strengths  --  a symmetric with linear coefficients in front of
-                            r**-12 for each atom pair
+                            r**-12 for each atom pair. In sparse mode, use a
+                            tuple (types, table) or a function instead of an
+                            NxN array (see PairFF._lookup_pair_parameters).
 
            Optional arguments:
              coordinates  --  the initial Cartesian coordinates of the system,
                               which can be updated with the update_coordinates
                               method
+             vectorized  --  when False, the reference implementation is used
+                             for the energy, gradient and hessian
+             cutoff, unit_cell  --  see PairFF
         """
-        PairFF.__init__(self, scaling, coordinates)
+        PairFF.__init__(self, scaling, coordinates, vectorized, cutoff, unit_cell)
         self.strengths = strengths
 
+    def yield_pair_terms(self, indexes1, indexes2, deltas, distances):
+        """Vectorized counterpart of the yield_pair_* methods"""
+        strengths = self._lookup_pair_parameters(self.strengths, indexes1, indexes2)
+        d_2 = distances**(-2)
+        d_12 = (d_2*d_2*d_2)**2
+        yield strengths*d_12, 1, -12*strengths*d_12/distances, 0, 12*13*strengths*d_12*d_2, 0
+
     def yield_pair_energies(self, index1, index2):
         """Yields pairs ((s(r_ij), v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield strength*distance**(-12), 1
 
     def yield_pair_gradients(self, index1, index2):
         """Yields pairs ((s'(r_ij), grad_i v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield -12*strength*distance**(-13), np.zeros(3)
 
     def yield_pair_hessians(self, index1, index2):
         """Yields pairs ((s''(r_ij), grad_i (x) grad_i v(bar{r}_ij))"""
-        strength = self.strengths[index1, index2]
+        strength = self._lookup_pair_parameter(self.strengths, index1, index2)
         distance = self.distances[index1, index2]
         yield 12*13*strength*distance**(-14), np.zeros((3, 3))
 
@@ -402,7 +963,7 @@ class PauliFF(PairFF):
 class ExpRepFF(PairFF):
     """Computes the exponential repulsion interaction"""
 
-    def __init__(self, scaling, As, Bs, coordinates=None):
+    def __init__(self, scaling, As, Bs, coordinates=None, vectorized=True, cutoff=None, unit_cell=None):
         """Initialize a ExpRepFF
 
            Arguments:
@@ -411,34 +972,47 @@ class ExpRepFF(PairFF):
              As  --  A matrix with pre-exponential factors
              Bs  --  A matrix with exponents
 
+           In sparse mode, As and Bs can also be given as a tuple (types,
+           table) or as a function (see PairFF._lookup_pair_parameters).
+
            The repulsion has the form A*exp(-B*r)
 
            Optional arguments:
              coordinates  --  the initial Cartesian coordinates of the system,
                               which can be updated with the update_coordinates
                               method
+             vectorized  --  when False, the reference implementation is used
+                             for the energy, gradient and hessian
+             cutoff, unit_cell  --  see PairFF
         """
-        PairFF.__init__(self, scaling, coordinates)
+        PairFF.__init__(self, scaling, coordinates, vectorized, cutoff, unit_cell)
         self.As = As
         self.Bs = Bs
 
+    def yield_pair_terms(self, indexes1, indexes2, deltas, distances):
+        """Vectorized counterpart of the yield_pair_* methods"""
+        A = self._lookup_pair_parameters(self.As, indexes1, indexes2)
+        B = self._lookup_pair_parameters(self.Bs, indexes1, indexes2)
+        tmp = A*np.exp(-B*distances)
+        yield tmp, 1, -B*tmp, 0, B*B*tmp, 0
+
     def yield_pair_energies(self, index1, index2):
         """Yields pairs ((s(r_ij), v(bar{r}_ij))"""
-        A = self.As[index1, index2]
-        B = self.Bs[index1, index2]
+        A = self._lookup_pair_parameter(self.As, index1, index2)
+        B = self._lookup_pair_parameter(self.Bs, index1, index2)
         distance = self.distances[index1, index2]
         yield A*np.exp(-B*distance), 1
 
     def yield_pair_gradients(self, index1, index2):
         """Yields pairs ((s'(r_ij), grad_i v(bar{r}_ij))"""
-        A = self.As[index1, index2]
-        B = self.Bs[index1, index2]
+        A = self._lookup_pair_parameter(self.As, index1, index2)
+        B = self._lookup_pair_parameter(self.Bs, index1, index2)
         distance = self.distances[index1, index2]
         yield -B*A*np.exp(-B*distance), np.zeros(3)
 
     def yield_pair_hessians(self, index1, index2):
         """Yields pairs ((s''(r_ij), grad_i (x) grad_i v(bar{r}_ij))"""
-        A = self.As[index1, index2]
-        B = self.Bs[index1, index2]
+        A = self._lookup_pair_parameter(self.As, index1, index2)
+        B = self._lookup_pair_parameter(self.Bs, index1, index2)
         distance = self.distances[index1, index2]
         yield B*B*A*np.exp(-B*distance), np.zeros((3, 3))
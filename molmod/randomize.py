@@ -31,8 +31,10 @@ import copy
 
 import numpy as np
 
+from molmod.binning import PairSearchIntra
 from molmod.molecules import Molecule
 from molmod.graphs import GraphError
+from molmod.topology import get_bends
 from molmod.transformations import Translation, Complete
 from molmod.vectors import random_orthonormal, random_unit
 
@@ -215,23 +217,20 @@ def iter_halfs_bond(graph):
 
 def iter_halfs_bend(graph):
     """Select randomly two consecutive bonds that divide the molecule in two"""
-    for atom2 in range(graph.num_vertices):
-        neighbors = list(graph.neighbors[atom2])
-        for index1, atom1 in enumerate(neighbors):
-            for atom3 in neighbors[index1+1:]:
-                try:
-                    affected_atoms = graph.get_halfs(atom2, atom1)[0]
-                    # the affected atoms never contain atom1!
-                    yield affected_atoms, (atom1, atom2, atom3)
-                    continue
-                except GraphError:
-                    pass
-                try:
-                    affected_atoms = graph.get_halfs(atom2, atom3)[0]
-                    # the affected atoms never contain atom3!
-                    yield affected_atoms, (atom3, atom2, atom1)
-                except GraphError:
-                    pass
+    for atom1, atom2, atom3 in get_bends(graph).tolist():
+        try:
+            affected_atoms = graph.get_halfs(atom2, atom1)[0]
+            # the affected atoms never contain atom1!
+            yield affected_atoms, (atom1, atom2, atom3)
+            continue
+        except GraphError:
+            pass
+        try:
+            affected_atoms = graph.get_halfs(atom2, atom3)[0]
+            # the affected atoms never contain atom3!
+            yield affected_atoms, (atom3, atom2, atom1)
+        except GraphError:
+            pass
 
 
 def iter_halfs_double(graph):
@@ -340,13 +339,16 @@ def check_nonbond(molecule, thresholds):
        a coarse guess of a proper threshold value.
     """
 
-    # check that no atoms overlap
-    for atom1 in range(molecule.graph.num_vertices):
-        for atom2 in range(atom1):
-            if molecule.graph.distances[atom1, atom2] > 2:
-                distance = np.linalg.norm(molecule.coordinates[atom1] - molecule.coordinates[atom2])
-                if distance < thresholds[frozenset([molecule.numbers[atom1], molecule.numbers[atom2]])]:
-                    return False
+    # check that no atoms overlap. Only pairs of atoms in the same molecule
+    # that are separated by more than two bonds are tested.
+    graph = molecule.graph
+    pair_search = PairSearchIntra(molecule.coordinates, max(thresholds.values()))
+    atoms1, atoms2, deltas, distances = pair_search.arrays()
+    mask = graph.component_labels[atoms1] == graph.component_labels[atoms2]
+    mask &= graph.get_pair_distances(atoms1, atoms2, 2) == 0
+    for atom1, atom2, distance in zip(atoms1[mask], atoms2[mask], distances[mask]):
+        if distance < thresholds[frozenset([molecule.numbers[atom1], molecule.numbers[atom2]])]:
+            return False
     return True
 
 
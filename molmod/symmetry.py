@@ -23,6 +23,8 @@
 """Tools to analyze the symmetry of molecules"""
 
 
+import numpy as np
+
 from molmod.units import angstrom
 from molmod.transformations import fit_rmsd
 
@@ -41,9 +43,27 @@ def compute_rotsym(molecule, graph, threshold=1e-3*angstrom):
         | ``threshold``  --  only when a rotation results in an rmsd below the
                              given threshold, the rotation is considered to
                              transform the molecule onto itself.
+
+       The graph symmetries are generated from the generators of the
+       automorphism group. Partial symmetries that change the distances
+       between the atoms whose images are already fixed by more than the rmsd
+       threshold permits, are skipped without generating their completions.
     """
+    coordinates = molecule.coordinates
+    # No atom can move more than sqrt(N)*threshold in a match with an rmsd
+    # below the threshold.
+    tolerance = 2*np.sqrt(molecule.size)*threshold
+
+    def prune(images):
+        """Return True when the partial symmetry is not a rigid motion"""
+        atoms = np.array(list(images.keys()))
+        new_atoms = np.array(list(images.values()))
+        distances = np.linalg.norm(coordinates[atoms] - coordinates[atoms[:,None]], axis=2)
+        new_distances = np.linalg.norm(coordinates[new_atoms] - coordinates[new_atoms[:,None]], axis=2)
+        return abs(distances - new_distances).max() > tolerance
+
     result = 0
-    for match in graph.symmetries:
+    for match in graph.iter_symmetries(prune):
         permutation = list(j for i,j in sorted(match.forward.items()))
         new_coordinates = molecule.coordinates[permutation]
         rmsd = fit_rmsd(molecule.coordinates, new_coordinates)[2]
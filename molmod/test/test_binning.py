@@ -32,6 +32,7 @@ from nose.plugins.skip import SkipTest
 from molmod import *
 from molmod.io import *
 from molmod.periodic import periodic
+from molmod.binning import Binning
 from molmod.test.test_unit_cells import get_random_uc
 
 
@@ -64,7 +65,7 @@ class BinningTestCase(unittest.TestCase):
                 fast_distance = distances.get(identifier)
                 if fast_distance is None:
                     missing_pairs.append(tuple(identifier) + (distance,))
-                elif fast_distance != distance:
+                elif abs(fast_distance - distance) > 1e-12:
                     wrong_distances.append(tuple(identifier) + (fast_distance, distance))
                 else:
                     num_correct += 1
@@ -80,7 +81,7 @@ class BinningTestCase(unittest.TestCase):
             message += "%10s %10s: \t % 10.7f != % 10.7f\n" % wrong_distance
         message += "UNWANTED PAIRS: %i\n" % len(distances)
         for identifier, fast_distance in distances.items():
-            message += "%10s %10s: \t % 10.7f\n" % (identifier, fast_distance)
+            message += "%10s %10s: \t % 10.7f\n" % (tuple(identifier) + (fast_distance,))
         message += "TOTAL PAIRS: %i\n" % num_total
         message += "CORRECT PAIRS: %i\n" % num_correct
         message += "-"*50+"\n"
@@ -219,3 +220,218 @@ class BinningTestCase(unittest.TestCase):
                 in pair_search
             ]
             self.verify_distances_inter(coordinates0, coordinates1, cutoff, distances, unit_cell)
+
+    def verify_arrays(self, pair_search):
+        indexes0, indexes1, deltas, distances = pair_search.arrays()
+        self.assertEqual(indexes0.shape, distances.shape)
+        self.assertEqual(indexes1.shape, distances.shape)
+        self.assertEqual(deltas.shape, (len(distances), 3))
+        self.assert_((distances <= pair_search.cutoff).all())
+        np.testing.assert_almost_equal(np.sqrt((deltas**2).sum(axis=1)), distances)
+        pairs = list(pair_search)
+        self.assertEqual(len(pairs), len(distances))
+        for k, (i0, i1, delta, distance) in enumerate(pairs):
+            self.assertEqual(i0, indexes0[k])
+            self.assertEqual(i1, indexes1[k])
+            self.assert_((delta == deltas[k]).all())
+            self.assertEqual(distance, distances[k])
+
+    def test_arrays_intra(self):
+        coordinates = np.random.uniform(0, 5, (50, 3))
+        pair_search = PairSearchIntra(coordinates, 2.0)
+        self.verify_arrays(pair_search)
+        self.assert_((pair_search.arrays()[0] > pair_search.arrays()[1]).all())
+
+    def test_arrays_intra_lau_periodic(self):
+        coordinates = XYZFile(pkg_resources.resource_filename(__name__, "../data/test/lau.xyz")).geometries[0]
+        unit_cell = UnitCell.from_parameters3(
+            np.array([14.59, 12.88, 7.61])*angstrom,
+            np.array([ 90.0, 111.0, 90.0])*deg,
+        )
+        pair_search = PairSearchIntra(coordinates, periodic.max_radius*2, unit_cell)
+        self.verify_arrays(pair_search)
+        indexes0, indexes1, deltas, distances = pair_search.arrays()
+        for i0, i1, delta in zip(indexes0, indexes1, deltas):
+            np.testing.assert_almost_equal(
+                delta, unit_cell.shortest_vector(coordinates[i1] - coordinates[i0])
+            )
+
+    def test_arrays_inter(self):
+        coordinates0 = np.random.uniform(0, 5, (30, 3))
+        coordinates1 = np.random.uniform(0, 5, (40, 3))
+        self.verify_arrays(PairSearchInter(coordinates0, coordinates1, 2.0))
+
+    def test_arrays_empty(self):
+        indexes0, indexes1, deltas, distances = PairSearchIntra(np.zeros((0, 3)), 2.0).arrays()
+        self.assertEqual(len(distances), 0)
+        self.assertEqual(deltas.shape, (0, 3))
+
+    def test_arrays_chunks(self):
+        coordinates = np.random.uniform(0, 5, (100, 3))
+        pair_search = PairSearchIntra(coordinates, 3.0)
+        indexes0, indexes1, deltas, distances = pair_search.arrays()
+        pair_search.chunk_size = 1
+        indexes0_bis, indexes1_bis, deltas_bis, distances_bis = pair_search.arrays()
+        self.assert_((indexes0 == indexes0_bis).all())
+        self.assert_((indexes1 == indexes1_bis).all())
+        self.assert_((distances == distances_bis).all())
+
+    def verify_neighbor_list(self, neighbor_list, coordinates, unit_cell=None):
+        indexes0, indexes1, deltas, distances = neighbor_list.update(coordinates)
+        expected = PairSearchIntra(coordinates, neighbor_list.cutoff, unit_cell).arrays()
+        self.assertEqual(
+            set(zip(indexes0, indexes1)),
+            set(zip(expected[0], expected[1])),
+        )
+        order = np.lexsort([indexes1, indexes0])
+        expected_order = np.lexsort([expected[1], expected[0]])
+        np.testing.assert_almost_equal(deltas[order], expected[2][expected_order])
+        np.testing.assert_almost_equal(distances[order], expected[3][expected_order])
+
+    def test_neighbor_list(self):
+        coordinates = np.random.uniform(0, 5, (50, 3))
+        neighbor_list = NeighborList(2.0, 0.5)
+        self.verify_neighbor_list(neighbor_list, coordinates)
+        self.assertEqual(neighbor_list.nbuild, 1)
+        # small displacements, no rebuild
+        for i in range(5):
+            coordinates += np.random.uniform(-0.02, 0.02, coordinates.shape)
+            self.verify_neighbor_list(neighbor_list, coordinates)
+        self.assertEqual(neighbor_list.nbuild, 1)
+        # large displacement, rebuild
+        coordinates[0] += 0.3
+        self.verify_neighbor_list(neighbor_list, coordinates)
+        self.assertEqual(neighbor_list.nbuild, 2)
+
+    def test_neighbor_list_periodic(self):
+        unit_cell = UnitCell(np.identity(3, float)*6.0)
+        coordinates = np.random.uniform(0, 6, (50, 3))
+        neighbor_list = NeighborList(2.0, 0.5, unit_cell)
+        self.verify_neighbor_list(neighbor_list, coordinates, unit_cell)
+        # wrapping an atom into the periodic image does not trigger a rebuild
+        coordinates[1] += unit_cell.matrix[:, 0]
+        self.verify_neighbor_list(neighbor_list, coordinates, unit_cell)
+        self.assertEqual(neighbor_list.nbuild, 1)
+        for i in range(10):
+            coordinates += np.random.uniform(-0.1, 0.1, coordinates.shape)
+            self.verify_neighbor_list(neighbor_list, coordinates, unit_cell)
+        self.assert_(neighbor_list.nbuild > 1)
+
+    def verify_binning(self, bins, coordinates):
+        self.assertEqual(bins.offsets[0], 0)
+        self.assertEqual(bins.offsets[-1], len(coordinates))
+        self.assertEqual(sorted(bins.order), list(range(len(coordinates))))
+        self.assert_((bins.offsets[1:] > bins.offsets[:-1]).all())
+        keys = np.floor(bins.grid_cell.to_fractional(coordinates)).astype(int)
+        if bins.integer_cell is not None:
+            keys = bins.wrap_keys(keys)
+        for cell, (key, indexes) in enumerate(bins):
+            self.assert_((keys[indexes] == key).all())
+            self.assertEqual(bins.lookup(np.array([key]))[0], cell)
+            # within a bin, the original order is preserved
+            self.assert_((indexes[1:] > indexes[:-1]).all())
+
+    def test_binning_dense(self):
+        coordinates = np.random.uniform(0, 5, (100, 3))
+        grid_cell = UnitCell(np.identity(3, float)*0.7)
+        self.verify_binning(Binning(coordinates, 2.0, grid_cell), coordinates)
+
+    def test_binning_sparse(self):
+        coordinates = np.random.uniform(0, 5, (100, 3))
+        coordinates[:50] += 1000
+        grid_cell = UnitCell(np.identity(3, float)*0.7)
+        bins = Binning(coordinates, 2.0, grid_cell)
+        self.assertEqual(bins.lookup_table, None)
+        self.verify_binning(bins, coordinates)
+        self.assertEqual(bins.lookup(np.array([[-100, 0, 0]]))[0], -1)
+
+    def test_binning_periodic(self):
+        coordinates = np.random.uniform(-10, 10, (100, 3))
+        grid_cell = UnitCell(np.identity(3, float)*1.5)
+        integer_cell = UnitCell(np.identity(3, float)*4)
+        bins = Binning(coordinates, 2.0, grid_cell, integer_cell)
+        self.verify_binning(bins, coordinates)
+        self.assert_((bins.keys >= -2).all())
+        self.assert_((bins.keys < 2).all())
+
+    def test_distances_intra_sparse(self):
+        coordinates = np.random.uniform(0, 5, (30, 3))
+        coordinates[:10] += 1000
+        distances = [
+            (frozenset([i0, i1]), distance)
+            for i0, i1, delta, distance
+            in PairSearchIntra(coordinates, 2.0)
+        ]
+        self.verify_distances_intra(coordinates, 2.0, distances)
+
+    def test_distances_intra_triclinic_periodic(self):
+        unit_cell = UnitCell.from_parameters3(
+            np.array([15.0, 14.0, 13.0]), np.array([80.0, 100.0, 95.0])*deg
+        )
+        coordinates = unit_cell.to_cartesian(np.random.uniform(0, 2, (100, 3)))
+        pair_search = PairSearchIntra(coordinates, 4.0, unit_cell)
+        distances = [
+            (frozenset([i0, i1]), distance)
+            for i0, i1, delta, distance
+            in pair_search
+        ]
+        self.verify_distances_intra(coordinates, 4.0, distances, unit_cell)
+
+    def verify_n_workers(self, make_pair_search):
+        expected = make_pair_search(1).arrays()
+        for n_workers in 2, 3:
+            result = make_pair_search(n_workers).arrays()
+            for array, expected_array in zip(result, expected):
+                self.assert_((array == expected_array).all())
+
+    def test_n_workers_intra(self):
+        coordinates = np.random.uniform(0, 8, (200, 3))
+        self.verify_n_workers(lambda n_workers: PairSearchIntra(
+            coordinates, 2.0, n_workers=n_workers))
+
+    def test_n_workers_intra_periodic(self):
+        coordinates = XYZFile(pkg_resources.resource_filename(__name__, "../data/test/lau.xyz")).geometries[0]
+        unit_cell = UnitCell.from_parameters3(
+            np.array([14.59, 12.88, 7.61])*angstrom,
+            np.array([ 90.0, 111.0, 90.0])*deg,
+        )
+        self.verify_n_workers(lambda n_workers: PairSearchIntra(
+            coordinates, periodic.max_radius*2, unit_cell, n_workers=n_workers))
+
+    def test_n_workers_inter(self):
+        coordinates0 = np.random.uniform(0, 8, (100, 3))
+        coordinates1 = np.random.uniform(0, 8, (150, 3))
+        self.verify_n_workers(lambda n_workers: PairSearchInter(
+            coordinates0, coordinates1, 2.0, n_workers=n_workers))
+
+    def test_exact_mic_skewed(self):
+        unit_cell = UnitCell(np.array([[10.0, 0, 0], [9.0, 3.0, 0], [2.0, 1.0, 8.0]]).transpose())
+        coordinates = unit_cell.to_cartesian(np.random.uniform(0, 1, (100, 3)))
+        cutoff = 2.5
+        distances = [
+            (frozenset([i0, i1]), distance)
+            for i0, i1, delta, distance
+            in PairSearchIntra(coordinates, cutoff, unit_cell, exact_mic=True)
+        ]
+        expected = []
+        for i0 in range(len(coordinates)):
+            for i1 in range(i0):
+                delta = unit_cell.shortest_vector(coordinates[i1] - coordinates[i0], exact=True)
+                distance = np.linalg.norm(delta)
+                if distance <= cutoff:
+                    expected.append((frozenset([i0, i1]), distance))
+        self.assertEqual(len(distances), len(expected))
+        expected = dict(expected)
+        for key, distance in distances:
+            self.assertAlmostEqual(distance, expected[key])
+
+    def test_exact_mic_neighbor_list(self):
+        unit_cell = UnitCell(np.array([[10.0, 0, 0], [9.0, 3.0, 0], [2.0, 1.0, 8.0]]).transpose())
+        coordinates = unit_cell.to_cartesian(np.random.uniform(0, 1, (100, 3)))
+        neighbor_list = NeighborList(2.0, 0.5, unit_cell, exact_mic=True)
+        indexes0, indexes1, deltas, distances = neighbor_list.update(coordinates)
+        expected = PairSearchIntra(coordinates, 2.0, unit_cell, exact_mic=True).arrays()
+        self.assertEqual(
+            set(zip(indexes0, indexes1)),
+            set(zip(expected[0], expected[1])),
+        )
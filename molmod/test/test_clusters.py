@@ -67,3 +67,75 @@ class ClusterTestCase(unittest.TestCase):
         self.assertEqual(clusters[0].rules, ["u=v"])
         self.assertEqual(clusters[1].items, set(["x", "y", "z"]))
         self.assertEqual(clusters[1].rules, ["x*z=2", "x+y=1"])
+
+    def test_even_odd_streaming(self):
+        cf = ClusterFactory(streaming=True)
+        for counter in range(10000):
+            a = np.random.randint(0, 200)
+            b = np.random.randint(0, 200)
+            if (a+b)%2 == 0:
+                cf.add_related(a, b)
+        clusters = cf.get_clusters()
+        self.assertEqual(len(clusters), 2)
+        for cluster in clusters:
+            tmp = np.array(list(cluster.items)) % 2
+            self.assert_((tmp == 0).all() or (tmp == 1).all())
+            self.assertEqual(len(cluster.items), 100)
+
+    def test_rule_cluster_streaming(self):
+        cf = ClusterFactory(RuleCluster, streaming=True)
+        cf.add_related(RuleCluster(["x", "y"], ["x+y=1"]))
+        cf.add_related(RuleCluster(["x", "z"], ["x*z=2"]))
+        cf.add_related(RuleCluster(["u", "v"], ["u=v"]))
+        cf.add_related("v", "w")
+        clusters = list(cf.get_clusters())
+        self.assertEqual(len(clusters), 2)
+        clusters.sort(key=lambda x: min(x.items))
+        for cluster in clusters:
+            cluster.rules.sort()
+        self.assertEqual(clusters[0].items, set(["u", "v", "w"]))
+        self.assertEqual(clusters[0].rules, ["u=v"])
+        self.assertEqual(clusters[1].items, set(["x", "y", "z"]))
+        self.assertEqual(clusters[1].rules, ["x*z=2", "x+y=1"])
+
+    def test_union_find(self):
+        uf = UnionFind()
+        for item in "abcdef":
+            uf.add(item)
+        uf.union(uf.add("a"), uf.add("c"))
+        uf.union(uf.add("e"), uf.add("c"))
+        uf.union(uf.add("b"), uf.add("f"))
+        self.assertEqual(len(uf), 6)
+        groups = sorted(sorted(group) for group in uf.get_groups().values())
+        self.assertEqual(groups, [["a", "c", "e"], ["b", "f"], ["d"]])
+        labels = uf.get_labels()
+        self.assertEqual(labels[0], labels[2])
+        self.assertNotEqual(labels[0], labels[1])
+
+    def test_connected_components(self):
+        for counter in range(20):
+            n = np.random.randint(1, 300)
+            edges = np.random.randint(0, n, (np.random.randint(0, n), 2))
+            labels = connected_components(edges, n)
+            # reference with the slow union-find
+            uf = UnionFind()
+            for i in range(n):
+                uf.add(i)
+            for i, j in edges:
+                uf.union(i, j)
+            expected = uf.get_labels()
+            self.assertEqual(labels.shape, (n,))
+            # same partitioning
+            for i, j in edges:
+                self.assertEqual(labels[i], labels[j])
+            self.assertEqual(
+                len(set(zip(labels, expected))), len(set(expected))
+            )
+            self.assertEqual(labels.max()+1, len(set(expected)))
+            # components are numbered in the order of their smallest item
+            firsts = [np.where(labels == label)[0][0] for label in range(labels.max()+1)]
+            self.assertEqual(firsts, sorted(firsts))
+
+    def test_connected_components_no_edges(self):
+        labels = connected_components(np.zeros((0, 2), int), 4)
+        self.assertEqual(labels.tolist(), [0, 1, 2, 3])
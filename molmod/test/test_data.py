@@ -26,7 +26,10 @@ from __future__ import division
 
 import unittest
 
+import numpy as np
+
 from molmod import *
+from molmod.bonds import bonds
 from molmod.periodic import periodic
 from molmod.isotopes import ame2003, nubtab03
 
@@ -61,3 +64,20 @@ class DataTestCase(unittest.TestCase):
 
     def test_nubtab03(self):
         self.assertAlmostEqual(nubtab03.abundances[1][1], 99.9885)
+
+    def test_bonded_array(self):
+        numbers1 = np.random.randint(0, 120, 1000)
+        numbers2 = np.random.randint(1, 60, 1000)
+        distances = np.random.uniform(0.5, 3.5, 1000)*angstrom
+        bond_types = bonds.bonded_array(numbers1, numbers2, distances)
+        for n1, n2, distance, bond_type in zip(numbers1, numbers2, distances, bond_types):
+            expected = bonds.bonded(n1, n2, distance)
+            if expected is None:
+                self.assertEqual(bond_type, 0)
+            else:
+                self.assertEqual(bond_type, expected)
+        self.assertAlmostEqual(
+            bonds.get_max_cutoff([1, 6]),
+            max(bonds.get_length(1, 1), bonds.get_length(1, 6),
+                bonds.get_length(6, 6))*bonds.bond_tolerance
+        )
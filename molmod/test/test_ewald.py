@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# MolMod is a collection of molecular modelling tools for python.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MolMod.
+#
+# MolMod is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# MolMod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+from builtins import range
+import numpy as np
+
+from molmod.test.common import BaseTestCase
+from molmod.ewald import _bspline_weights
+from molmod import *
+
+
+__all__ = ["EwaldTestCase"]
+
+
+class EwaldTestCase(BaseTestCase):
+    def make_system(self):
+        np.random.seed(3)
+        unit_cell = UnitCell(np.array([
+            [5.0, 0.3, -0.4],
+            [0.0, 4.5, 0.6],
+            [0.2, 0.0, 5.5],
+        ]))
+        coordinates = unit_cell.to_cartesian(np.random.uniform(0, 1, (20, 3)))
+        charges = np.random.normal(0, 1, 20)
+        return unit_cell, coordinates, charges
+
+    def test_parameters(self):
+        alpha, kcut = ewald_parameters(2.0, 1e-8)
+        self.assertAlmostEqual(alpha*2.0, np.sqrt(-np.log(1e-8)))
+        self.assertAlmostEqual(kcut, 2*alpha*np.sqrt(-np.log(1e-8)))
+        with self.assertRaises(ValueError):
+            ewald_parameters(2.0, 1.5)
+        with self.assertRaises(ValueError):
+            ewald_parameters(-1.0, 1e-8)
+
+    def test_bspline_weights(self):
+        frac = np.random.uniform(0, 1, 100)
+        for order in 2, 4, 6, 8:
+            weights, derivatives = _bspline_weights(frac, order)
+            # partition of unity
+            self.assertArraysAlmostEqual(weights.sum(axis=1), np.ones(100), 1e-12)
+            self.assertArraysAlmostEqual(derivatives.sum(axis=1), np.zeros(100), 1e-12, doabs=True)
+            # finite differences
+            eps = 1e-6
+            weights_eps = _bspline_weights(frac + eps, order)[0]
+            self.assertArraysAlmostEqual((weights_eps - weights)/eps, derivatives, 1e-4, doabs=True)
+
+    def test_two_dimensional(self):
+        unit_cell = UnitCell(np.identity(3, float)*5, np.array([True, True, False]))
+        with self.assertRaises(ValueError):
+            EwaldReciprocal(unit_cell, 1.0, 5.0)
+
+    def test_spme_ewald(self):
+        unit_cell, coordinates, charges = self.make_system()
+        alpha, kcut = ewald_parameters(2.0, 1e-10)
+        points = np.random.uniform(-5, 10, (50, 3))
+        esp_ewald, efield_ewald = EwaldReciprocal(unit_cell, alpha, kcut).compute(
+            coordinates, charges, points, True)
+        esp_spme, efield_spme = SPMEReciprocal(unit_cell, alpha, kcut).compute(
+            coordinates, charges, points, True)
+        self.assertArraysAlmostEqual(esp_ewald, esp_spme, 1e-6)
+        self.assertArraysAlmostEqual(efield_ewald, efield_spme, 1e-6)
+
+    def check_field(self, reciprocal, coordinates, charges):
+        points = np.random.uniform(-5, 10, (10, 3))
+        esp, efield = reciprocal.compute(coordinates, charges, points, True)
+        eps = 1e-5
+        for i in range(3):
+            points_eps = points.copy()
+            points_eps[:, i] += eps
+            esp_eps = reciprocal.compute(coordinates, charges, points_eps)
+            self.assertArraysAlmostEqual(-(esp_eps - esp)/eps, efield[:, i], 1e-3)
+
+    def test_field_ewald(self):
+        unit_cell, coordinates, charges = self.make_system()
+        alpha, kcut = ewald_parameters(2.0, 1e-8)
+        self.check_field(EwaldReciprocal(unit_cell, alpha, kcut), coordinates, charges)
+
+    def test_field_spme(self):
+        unit_cell, coordinates, charges = self.make_system()
+        alpha, kcut = ewald_parameters(2.0, 1e-8)
+        self.check_field(SPMEReciprocal(unit_cell, alpha, kcut), coordinates, charges)
+
+    def test_translation(self):
+        # The potential is periodic.
+        unit_cell, coordinates, charges = self.make_system()
+        alpha, kcut = ewald_parameters(2.0, 1e-8)
+        points = np.random.uniform(0, 5, (10, 3))
+        for reciprocal in EwaldReciprocal(unit_cell, alpha, kcut), SPMEReciprocal(unit_cell, alpha, kcut):
+            esp = reciprocal.compute(coordinates, charges, points)
+            esp_shift = reciprocal.compute(coordinates, charges, points + unit_cell.matrix[:, 1])
+            self.assertArraysAlmostEqual(esp, esp_shift, 1e-8)
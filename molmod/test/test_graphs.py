@@ -297,6 +297,165 @@ class GraphTestCase(unittest.TestCase):
         self.assertEqual(expecting.shape,graph.distances.shape)
         self.assert_((expecting==graph.distances).all())
 
+    def test_distances_floyd_warshall(self):
+        from molmod.ext import graphs_floyd_warshall
+        for case in self.iter_cases(disconnected=True):
+            g = case.graph
+            expecting = np.zeros((g.num_vertices,)*2, dtype=int)
+            for i, j in g.edges:
+                expecting[i, j] = 1
+                expecting[j, i] = 1
+            graphs_floyd_warshall(expecting)
+            self.assert_((expecting == g.distances).all(), case.name)
+
+    def test_distances_truncated(self):
+        graph = Graph([(0,1), (1,2), (2,3), (3,4), (4,0), (2,5), (3,6), (3,7)])
+        for max_distance in range(4):
+            distances = graph.get_distances(max_distance=max_distance)
+            self.assertEqual(distances.dtype, np.uint8)
+            expecting = graph.distances.copy()
+            expecting[expecting > max_distance] = 0
+            self.assert_((expecting == distances).all())
+        distances = graph.get_distances(sources=[5, 2], max_distance=2, dtype=np.uint16)
+        self.assertEqual(distances.dtype, np.uint16)
+        self.assertEqual(distances.shape, (2, 8))
+        self.assert_((distances == [[0, 2, 1, 2, 0, 0, 0, 0], [2, 1, 0, 1, 2, 1, 2, 2]]).all())
+        self.assertRaises(ValueError, graph.get_distances, max_distance=-1)
+
+    def check_distances_within(self, graph, max_distance):
+        indptr, indices, distances = graph.distances_within(max_distance)
+        expecting = graph.distances.copy()
+        expecting[expecting > max_distance] = 0
+        result = np.zeros(expecting.shape, int)
+        for vertex in range(graph.num_vertices):
+            row_indices = indices[indptr[vertex]:indptr[vertex+1]]
+            self.assert_((row_indices[1:] > row_indices[:-1]).all())
+            result[vertex, row_indices] = distances[indptr[vertex]:indptr[vertex+1]]
+        self.assert_((expecting == result).all())
+        vertices1, vertices2 = np.indices(expecting.shape).reshape(2, -1)
+        pair_distances = graph.get_pair_distances(vertices1, vertices2, max_distance)
+        self.assert_((pair_distances == expecting.ravel()).all())
+
+    def test_distances_within(self):
+        for case in self.iter_cases(disconnected=True):
+            for max_distance in 3, 0, 1, 2, 4:
+                self.check_distances_within(case.graph, max_distance)
+        # a star is processed in several chunks
+        star = Graph([(0, i) for i in range(1, 50)])
+        self.check_distances_within(star, 2)
+        self.assertRaises(ValueError, star.distances_within, -1)
+
+    def test_component_labels(self):
+        for case in self.iter_cases(disconnected=True):
+            labels = case.graph.component_labels
+            for label, group in enumerate(case.graph.independent_vertices):
+                self.assert_((labels[group] == label).all())
+
+    def test_iter_distance_rows(self):
+        graph = Graph([(0,1), (1,2), (3,4)])
+        graph.distance_block_size = 2
+        sources = []
+        for source, row in graph.iter_distance_rows():
+            sources.append(source)
+            self.assert_((row == graph.distances[source]).all())
+        self.assertEqual(sources, list(range(5)))
+        sources = [source for source, row in graph.iter_distance_rows(sources=[4, 0, 2])]
+        self.assertEqual(sources, [4, 0, 2])
+
+    def test_eccentricities(self):
+        for case in self.iter_cases(disconnected=True):
+            g = case.graph
+            self.assert_((g.eccentricities == g.distances.max(axis=1)).all())
+            self.assertEqual(g.max_distance, g.distances.max())
+
+    def test_from_edge_array(self):
+        for case in self.iter_cases(disconnected=True):
+            g = case.graph
+            edge_array = np.array([sorted(edge) for edge in g.edges])
+            g2 = Graph.from_edge_array(edge_array, g.num_vertices)
+            self.assertEqual(g2.num_vertices, g.num_vertices)
+            self.assertEqual(g2.num_edges, g.num_edges)
+            self.assert_((g2.edge_array == edge_array).all())
+            self.assertEqual(g2.neighbors, g.neighbors)
+            self.assertEqual(g2.edges, g.edges)
+            self.assert_((g2.distances == g.distances).all())
+        g = Graph.from_edge_array(np.zeros((0, 2), int))
+        self.assertEqual(g.num_vertices, 0)
+        self.assertEqual(g.edges, ())
+        self.assertRaises(ValueError, Graph.from_edge_array, np.array([[0, 1], [2, 2]]))
+        self.assertRaises(TypeError, Graph.from_edge_array, np.array([[0, 1], [-1, 2]]))
+        self.assertRaises(TypeError, Graph.from_edge_array, np.array([[0, 1, 2]]))
+        self.assertRaises(TypeError, Graph.from_edge_array, np.array([[0.0, 1.0]]))
+        self.assertRaises(ValueError, Graph.from_edge_array, np.array([[0, 3]]), 2)
+
+    def test_csr(self):
+        g = Graph([(0,1), (1,2), (2,3), (3,4), (4,0), (2,5), (3,6), (3,7)])
+        indptr, indices, edge_indexes = g.csr
+        self.assertEqual(indptr.dtype, np.int32)
+        self.assertEqual(indices.dtype, np.int32)
+        self.assertEqual(edge_indexes.dtype, np.int32)
+        self.assertEqual(indptr.tolist(), [0, 2, 4, 7, 11, 13, 14, 15, 16])
+        for vertex in range(g.num_vertices):
+            neighbors = g.get_neighbors(vertex)
+            self.assertEqual(neighbors.tolist(), sorted(g.neighbors[vertex]))
+            for neighbor in neighbors:
+                index = g.get_edge_index(vertex, neighbor)
+                self.assertEqual(index, g.edge_index[frozenset([vertex, neighbor])])
+        self.assertEqual(g.get_edge_index(0, 3), None)
+        self.assertEqual(g.get_edge_index(7, 0), None)
+
+    def test_canonical_order(self):
+        for case in self.iter_cases(disconnected=True):
+            g0 = case.graph
+            if g0.num_edges == 0:
+                continue
+            permutation = np.random.permutation(g0.num_vertices)
+            new_edges = tuple((permutation[i], permutation[j]) for i,j in g0.edges)
+            g1 = Graph(new_edges, g0.num_vertices)
+            g0_bis = g0.get_subgraph(g0.canonical_order, normalize=True)
+            g1_bis = g1.get_subgraph(g1.canonical_order, normalize=True)
+            self.assertEqual(g0_bis.edges, g1_bis.edges)
+            self.assertEqual(g0.canonical_hash, g1.canonical_hash)
+            self.assertEqual(sorted(g0.canonical_order), sorted(set(g0.edge_array.ravel())))
+
+    def test_canonical_order_symmetric(self):
+        # The Petersen graph and the cube are vertex-transitive.
+        petersen = Graph([
+            (0,1),(1,2),(2,3),(3,4),(4,0),(0,5),(1,6),(2,7),(3,8),(4,9),
+            (5,7),(7,9),(9,6),(6,8),(8,5),
+        ])
+        cube = Graph([
+            (0,1),(0,2),(0,3),(1,4),(1,5),(2,4),(2,6),(3,5),(3,6),(4,7),
+            (5,7),(6,7),
+        ])
+        for g0 in petersen, cube:
+            for i in range(5):
+                permutation = np.random.permutation(g0.num_vertices)
+                new_edges = tuple((permutation[i], permutation[j]) for i,j in g0.edges)
+                g1 = Graph(new_edges, g0.num_vertices)
+                self.assertEqual(g0.canonical_hash, g1.canonical_hash)
+        self.assertNotEqual(petersen.canonical_hash, cube.canonical_hash)
+
+    def test_pickle(self):
+        import pickle
+        g = Graph.from_edge_array(np.array([[0, 1], [1, 2], [3, 4]]))
+        g2 = pickle.loads(pickle.dumps(g))
+        self.assertEqual(g2.edges, g.edges)
+        self.assertEqual(g2.num_vertices, g.num_vertices)
+        self.assert_((g2.edge_array == g.edge_array).all())
+
+    def test_pickle_molecular_graph_orders(self):
+        import pickle
+        g = MolecularGraph([(0, 1), (1, 2)], [6, 8, 1], orders=[1, 2])
+        g2 = pickle.loads(pickle.dumps(g))
+        self.assertEqual(g2.edges, g.edges)
+        self.assert_((g2.edge_array == g.edge_array).all())
+        self.assert_((g2.orders == g.orders).all())
+        self.assert_((g2.numbers == g.numbers).all())
+        mol = Molecule(g.numbers, np.zeros((3, 3)), graph=g)
+        mol2 = pickle.loads(pickle.dumps(mol))
+        self.assert_((mol2.graph.orders == g.orders).all())
+
     def test_neighbors(self):
         for case in self.iter_cases():
             g = case.graph
@@ -332,6 +491,28 @@ class GraphTestCase(unittest.TestCase):
             for i in range(g0.num_vertices):
                 self.assert_((g0.vertex_fingerprints[i]==g1.vertex_fingerprints[permutation[i]]).all())
 
+    def test_fingerprints_num_iter(self):
+        for case in self.iter_cases():
+            g0 = case.graph
+            permutation = np.random.permutation(g0.num_vertices)
+            new_edges = tuple((permutation[i], permutation[j]) for i,j in g0.edges)
+            g1 = Graph(new_edges, g0.num_vertices)
+            for num_iter in 0, 1, 3:
+                fp0 = g0.get_vertex_fingerprints([""]*g0.num_vertices, [""]*g0.num_edges, num_iter)
+                fp1 = g1.get_vertex_fingerprints([""]*g1.num_vertices, [""]*g1.num_edges, num_iter)
+                self.assert_((fp0 == fp1[permutation]).all())
+
+    def test_fingerprints_stable(self):
+        # The fingerprints must not depend on the platform or the run.
+        graph = Graph([(0,1),(1,2),(2,3),(3,4),(4,5),(5,0),(0,6)])
+        self.assertEqual(
+            graph.vertex_fingerprints[[0, 6]].tobytes(),
+            bytes.fromhex(
+                "55d2b881c5ea15a486ea40443c1f58f01a05139c"
+                "90927255eebb9f7ec6098a0038703103d6c7c1ea"
+            )
+        )
+
     def test_symmetries(self):
         cases = self.iter_cases()
         for case in cases:
@@ -383,6 +564,42 @@ class GraphTestCase(unittest.TestCase):
             self.assert_(len(unexpected) == 0, message())
             self.assert_(len(unsatisfied) == 0, message())
 
+    def test_symmetry_generators(self):
+        for case in self.iter_cases(disconnected=False):
+            g = case.graph
+            def to_permutations(matches):
+                return set(
+                    tuple(j for i, j in sorted(match.forward.items()))
+                    for match in matches
+                )
+            expected = to_permutations(GraphSearch(EqualPattern(g))(g))
+            self.assertEqual(g.num_symmetries, len(expected))
+            self.assertEqual(to_permutations(g.symmetries), expected)
+            # the generators must generate the full group
+            group = set([tuple(range(g.num_vertices))])
+            todo = list(group)
+            generators = to_permutations(g.symmetry_generators)
+            for element in todo:
+                for generator in generators:
+                    product = tuple(element[i] for i in generator)
+                    if product not in group:
+                        group.add(product)
+                        todo.append(product)
+            self.assertEqual(len(group), g.num_symmetries)
+
+    def test_iter_symmetries_prune(self):
+        cube = Graph([
+            (0,1),(0,2),(0,3),(1,4),(1,5),(2,4),(2,6),(3,5),(3,6),(4,7),
+            (5,7),(6,7),
+        ])
+        self.assertEqual(cube.num_symmetries, 48)
+        self.assertEqual(len(list(cube.iter_symmetries())), 48)
+        fixed = list(cube.iter_symmetries(
+            lambda images: any(i != j for i, j in images.items())
+        ))
+        self.assertEqual(len(fixed), 1)
+        self.assertEqual(fixed[0].forward, dict((i, i) for i in range(8)))
+
     def test_equivalent_vertices(self):
         for case in self.iter_cases(disconnected=False):
             g = case.graph
@@ -608,6 +825,32 @@ class GraphTestCase(unittest.TestCase):
                 self.assert_(match.ring_vertices in case.rings)
         self.check_graph_search(RingPattern(10), callback=callback)
 
+    def test_iter_strong_rings(self):
+        for case in self.iter_cases():
+            expected = [match.ring_vertices for match in GraphSearch(RingPattern(10))(case.graph)]
+            rings = list(case.graph.iter_strong_rings(10))
+            self.assertEqual([tuple(ring) for ring in rings], expected)
+            for ring in rings:
+                self.assertEqual(ring.dtype, int)
+        self.assertRaises(ValueError, (lambda: list(Graph([(0, 1)]).iter_strong_rings(2))))
+
+    def test_vf2_graph_search(self):
+        for case in self.iter_cases():
+            graph = case.graph
+            patterns = [
+                lambda: RingPattern(10),
+                lambda: CustomPattern(Graph([(0, 1), (1, 2), (2, 0)])),
+                lambda: CustomPattern(Graph([(0, 1), (1, 2), (2, 3)])),
+            ]
+            if len(graph.independent_vertices) == 1:
+                patterns.append(lambda: EqualPattern(graph))
+            for pattern in patterns:
+                expected = [match.forward for match in GraphSearch(pattern())(graph)]
+                matches = [match.forward for match in VF2GraphSearch(pattern())(graph)]
+                self.assertEqual(len(matches), len(expected))
+                for forward in matches:
+                    self.assert_(forward in expected)
+
     def test_custom_pattern(self):
         # just run through the code
         for case in self.iter_cases():
@@ -671,3 +914,5 @@ class GraphTestCase(unittest.TestCase):
             sizes.sort()
             sizes = tuple(sizes)
             self.assertEqual(sizes, expected_sizes)
+            rings = [tuple(ring) for ring in mol.graph.iter_strong_rings(12)]
+            self.assertEqual(rings, [match.ring_vertices for match in gs(mol.graph)])
@@ -249,3 +249,159 @@ def test_opbend_ethene():
         ]
         assert abs(ic.opbend_cos([c[0], c[5], c[4], c[3]])[0] - np.cos(angle)) < 1e-5
         assert abs(ic.opbend_angle([c[0], c[5], c[4], c[3]])[0] - angle) < 1e-5
+
+
+def test_backends():
+    cases = [
+        (ic.bond_length, iter_bonds), (ic.bend_cos, iter_bends),
+        (ic.bend_angle, iter_bends), (ic.dihed_cos, iter_diheds),
+        (ic.dihed_angle, iter_diheds), (ic.dihed_angle, iter_diheds_special),
+        (ic.opbend_dist, iter_diheds), (ic.opbend_cos, iter_diheds),
+        (ic.opbend_angle, iter_diheds), (ic.opbend_mcos, iter_diheds),
+        (ic.opbend_mangle, iter_diheds),
+    ]
+    for icfn, iterp in cases:
+        for ps in iterp():
+            for deriv in range(3):
+                try:
+                    ic.set_backend("python")
+                    expected = icfn(ps, deriv)
+                finally:
+                    ic.set_backend("ext")
+                result = icfn(ps, deriv)
+                assert len(result) == deriv+1
+                for q in range(deriv+1):
+                    assert np.shape(result[q]) == np.shape(expected[q])
+                    assert abs(result[q] - expected[q]).max() < 1e-10
+
+
+def check_batch_ic(icfn, icfn_batch, iterp):
+    coordinates = np.array(list(iterp()), float) # shape (count, k, 3)
+    count, size = coordinates.shape[:2]
+    indexes = np.arange(count*size).reshape(count, size)
+    # three frames: the original, a translated and a permuted copy
+    frames = np.array([
+        coordinates.reshape(-1, 3),
+        coordinates.reshape(-1, 3) + np.random.normal(0, big, 3),
+        coordinates[::-1].reshape(-1, 3),
+    ])
+    for deriv in range(3):
+        result = icfn_batch(frames, indexes, deriv)
+        assert len(result) == deriv+1
+        assert result[0].shape == (3, count)
+        if deriv > 0:
+            assert result[1].shape == (3, count, size, 3)
+        if deriv > 1:
+            assert result[2].shape == (3, count, size, 3, size, 3)
+        for m in range(count):
+            for iframe, mframe in (0, m), (1, m), (2, count-1-m):
+                expected = icfn(coordinates[mframe], deriv)
+                for q in range(deriv+1):
+                    assert abs(result[q][iframe, m] - expected[q]).max() < 1e-8
+        # single frame
+        single = icfn_batch(frames[0], indexes, deriv)
+        for q in range(deriv+1):
+            assert abs(single[q] - result[q][0]).max() < 1e-10
+
+
+def test_batch_bond():
+    check_batch_ic(ic.bond_length, ic.bond_length_batch, iter_bonds)
+
+
+def test_batch_bend():
+    check_batch_ic(ic.bend_cos, ic.bend_cos_batch, iter_bends)
+    check_batch_ic(ic.bend_angle, ic.bend_angle_batch, iter_bends)
+
+
+def test_batch_dihed():
+    check_batch_ic(ic.dihed_cos, ic.dihed_cos_batch, iter_diheds)
+    check_batch_ic(ic.dihed_angle, ic.dihed_angle_batch, iter_diheds)
+    check_batch_ic(ic.dihed_angle, ic.dihed_angle_batch, iter_diheds_special)
+
+
+def test_batch_opbend():
+    check_batch_ic(ic.opbend_dist, ic.opbend_dist_batch, iter_diheds)
+    check_batch_ic(ic.opbend_cos, ic.opbend_cos_batch, iter_diheds)
+    check_batch_ic(ic.opbend_angle, ic.opbend_angle_batch, iter_diheds)
+    check_batch_ic(ic.opbend_mcos, ic.opbend_mcos_batch, iter_diheds)
+    check_batch_ic(ic.opbend_mangle, ic.opbend_mangle_batch, iter_diheds)
+
+
+def test_batch_errors():
+    coordinates = np.random.normal(0, big, (5, 3))
+    for args, error in [
+        ((coordinates, np.zeros((2, 3), int)), TypeError),
+        ((coordinates[:, :2], np.zeros((2, 2), int)), TypeError),
+        ((coordinates, np.zeros((2, 2), int), 3), ValueError),
+    ]:
+        try:
+            ic.bond_length_batch(*args)
+            assert False, "bond_length_batch should have raised a %s." % error.__name__
+        except error:
+            pass
+
+
+def get_reference_derivatives(ics, coordinates):
+    icfns = {
+        ic.bond_length_batch: ic.bond_length,
+        ic.bend_angle_batch: ic.bend_angle,
+        ic.dihed_angle_batch: ic.dihed_angle,
+        ic.opbend_angle_batch: ic.opbend_angle,
+    }
+    size = coordinates.size
+    bmatrix = []
+    kblocks = []
+    for icfn_batch, indexes in ics.groups:
+        for row in indexes:
+            q, g, h = icfns[icfn_batch](coordinates[row], 2)
+            b = np.zeros(size, float)
+            k = np.zeros((size, size), float)
+            for i0, j0 in enumerate(row):
+                b[3*j0:3*j0+3] += g[i0]
+                for i1, j1 in enumerate(row):
+                    k[3*j0:3*j0+3, 3*j1:3*j1+3] += h[i0, :, i1, :]
+            bmatrix.append(b)
+            kblocks.append(k)
+    return np.array(bmatrix), np.array(kblocks)
+
+
+def test_internal_coordinates_bmatrix():
+    for fn in "thf_single.xyz", "tpa.xyz", "ethene.xyz":
+        mol = Molecule.from_file(pkg_resources.resource_filename(__name__, "../data/test/" + fn))
+        mol.set_default_graph()
+        ics = ic.InternalCoordinates.from_graph(mol.graph)
+        # avoid exactly planar geometries, where opbend_angle has no gradient
+        coordinates = mol.coordinates + np.random.normal(0, 0.1, mol.coordinates.shape)
+        ics.update_coordinates(coordinates)
+        bmatrix, kblocks = get_reference_derivatives(ics, coordinates)
+        assert ics.values.shape == (ics.num_ic,)
+        assert ics.bmatrix.shape == (ics.num_ic, mol.size*3)
+        assert abs(ics.bmatrix.toarray() - bmatrix).max() < 1e-10
+        gq = np.random.normal(0, 1, ics.num_ic)
+        assert abs(ics.contract_k(gq).toarray() - np.tensordot(gq, kblocks, 1)).max() < 1e-8
+
+
+def test_internal_coordinates_transforms():
+    mol = Molecule.from_file(pkg_resources.resource_filename(__name__, "../data/test/thf_single.xyz"))
+    mol.set_default_graph()
+    ics = ic.InternalCoordinates.from_graph(mol.graph)
+    ics.update_coordinates(mol.coordinates)
+    bmatrix = ics.bmatrix.toarray()
+    binv = np.linalg.pinv(bmatrix, 1e-10)
+    # projection on the non-redundant part of the internal coordinates
+    projection = np.dot(bmatrix, binv)
+    gq = np.dot(projection, np.random.normal(0, 1, ics.num_ic))
+    hq = np.random.uniform(0, 1, ics.num_ic)
+    # from internal to Cartesian
+    gx = ics.gradient_to_cartesian(gq)
+    assert gx.shape == (mol.size, 3)
+    assert abs(gx.ravel() - np.dot(bmatrix.T, gq)).max() < 1e-10
+    hx = ics.hessian_to_cartesian(hq, gq)
+    expected = np.dot(bmatrix.T*hq, bmatrix) + ics.contract_k(gq).toarray()
+    assert abs(hx.toarray() - expected).max() < 1e-10
+    assert abs(ics.hessian_to_cartesian(np.diag(hq), gq).toarray() - expected).max() < 1e-10
+    # and back
+    assert abs(ics.gradient_to_internal(gx) - gq).max() < 1e-8
+    expected = np.dot(projection.T*hq, projection)
+    assert abs(ics.hessian_to_internal(hx, gx) - expected).max() < 1e-8
+    assert abs(ics.hessian_to_internal(hx.toarray(), gx) - expected).max() < 1e-8
@@ -85,7 +85,7 @@ class MolecularGraphTestCase(unittest.TestCase):
             self.assertEqual(len(unexpected), 0, message)
             self.assertEqual(len(unsatisfied), 0, message)
 
-    def test_bonds_tpa(self):
+    def check_bonds_tpa(self, graph_search_class):
         molecule = self.load_molecule("tpa.xyz")
         pattern = BondPattern([
             CriteriaSet(atom_criteria(1, 6), tag="HC"),
@@ -122,7 +122,7 @@ class MolecularGraphTestCase(unittest.TestCase):
             ])
         }
         test_results = dict((key, []) for key in expected_results)
-        graph_search = GraphSearch(pattern, debug=False)
+        graph_search = graph_search_class(pattern, debug=False)
         for match in graph_search(molecule.graph):
             test_results[match.tag].append(tuple(match.get_destination(index) for index in range(len(match))))
 
@@ -134,6 +134,12 @@ class MolecularGraphTestCase(unittest.TestCase):
 
         self.verify_graph_search(molecule.graph, expected_results, test_results, iter_alternatives)
 
+    def test_bonds_tpa(self):
+        self.check_bonds_tpa(GraphSearch)
+
+    def test_bonds_tpa_vf2(self):
+        self.check_bonds_tpa(VF2GraphSearch)
+
     def test_bending_angles_tpa(self):
         molecule = self.load_molecule("tpa.xyz")
         pattern = BendingAnglePattern([
@@ -233,7 +239,7 @@ class MolecularGraphTestCase(unittest.TestCase):
 
         self.verify_graph_search(molecule.graph, expected_results, test_results, iter_alternatives)
 
-    def test_tetra_tpa(self):
+    def check_tetra_tpa(self, graph_search_class):
         molecule = self.load_molecule("tpa.xyz")
         pattern = TetraPattern([
             CriteriaSet(atom_criteria(6, 1, 6, 6, 1), tag="C-(HCCH)")
@@ -245,7 +251,7 @@ class MolecularGraphTestCase(unittest.TestCase):
             ]),
         }
         test_results = dict((key, []) for key in expected_results)
-        graph_search = GraphSearch(pattern, debug=False)
+        graph_search = graph_search_class(pattern, debug=False)
         for match in graph_search(molecule.graph):
             test_results[match.tag].append(tuple(match.get_destination(index) for index in range(len(match))))
 
@@ -266,7 +272,13 @@ class MolecularGraphTestCase(unittest.TestCase):
 
         self.verify_graph_search(molecule.graph, expected_results, test_results, iter_alternatives)
 
-    def test_dihedral_angles_precursor(self):
+    def test_tetra_tpa(self):
+        self.check_tetra_tpa(GraphSearch)
+
+    def test_tetra_tpa_vf2(self):
+        self.check_tetra_tpa(VF2GraphSearch)
+
+    def check_dihedral_angles_precursor(self, graph_search_class):
         molecule = self.load_molecule("precursor.xyz")
         pattern = DihedralAnglePattern([CriteriaSet(tag="all")])
         # construct all dihedral angles:
@@ -281,7 +293,7 @@ class MolecularGraphTestCase(unittest.TestCase):
             'all': all_dihedrals,
         }
         test_results = dict((key, []) for key in expected_results)
-        graph_search = GraphSearch(pattern, debug=False)
+        graph_search = graph_search_class(pattern, debug=False)
         for match in graph_search(molecule.graph):
             test_results[match.tag].append(tuple(match.get_destination(index) for index in range(len(match))))
 
@@ -292,6 +304,12 @@ class MolecularGraphTestCase(unittest.TestCase):
 
         self.verify_graph_search(molecule.graph, expected_results, test_results, iter_alternatives)
 
+    def test_dihedral_angles_precursor(self):
+        self.check_dihedral_angles_precursor(GraphSearch)
+
+    def test_dihedral_angles_precursor_vf2(self):
+        self.check_dihedral_angles_precursor(VF2GraphSearch)
+
     def test_rings_5ringOH(self):
         molecule = self.load_molecule("5ringOH.xyz")
         pattern = NRingPattern(10, [CriteriaSet(tag="all")])
@@ -364,6 +382,71 @@ class MolecularGraphTestCase(unittest.TestCase):
             self.assertEqual(check.orders.shape,check_orders.shape)
             self.assert_((check.orders==check_orders).all())
 
+    def test_from_geometry(self):
+        from molmod.bonds import bonds
+        for molecule in self.iter_molecules(allow_multi=True):
+            # brute force reference, without the binning module
+            expected = {}
+            for i0 in range(molecule.size):
+                for i1 in range(i0):
+                    delta = molecule.coordinates[i1] - molecule.coordinates[i0]
+                    distance = np.linalg.norm(delta)
+                    bond_type = bonds.bonded(molecule.numbers[i0], molecule.numbers[i1], distance)
+                    if bond_type is not None:
+                        expected[frozenset([i0, i1])] = (bond_type, distance)
+            removed = set([])
+            for c in range(molecule.size):
+                ns = [(expected[frozenset([c, n])][1], n) for n in range(molecule.size)
+                      if frozenset([c, n]) in expected]
+                ns.sort(reverse=True)
+                for k0, (length0, n0) in enumerate(ns):
+                    delta0 = molecule.coordinates[n0] - molecule.coordinates[c]
+                    for length1, n1 in ns[:k0]:
+                        delta1 = molecule.coordinates[n1] - molecule.coordinates[c]
+                        if np.dot(delta0, delta1)/length0/length1 > 0.5**0.5:
+                            removed.add(frozenset([c, n1]))
+            for edge in removed:
+                del expected[edge]
+
+            graph = MolecularGraph.from_geometry(molecule, do_orders=True)
+            self.assertEqual(set(graph.edges), set(expected))
+            for edge, order, length in zip(graph.edges, graph.orders, graph.bond_lengths):
+                self.assertEqual(order, expected[edge][0])
+                self.assertAlmostEqual(length, expected[edge][1])
+            self.assertEqual(graph.symbols, molecule.symbols)
+
+    def test_topology_tracker(self):
+        for molecule in self.iter_molecules(allow_multi=True):
+            tracker = TopologyTracker(molecule, do_orders=True, hysteresis=0.0)
+            edges = set(tracker.graph.edges)
+            for counter in range(5):
+                coordinates = molecule.coordinates + np.random.normal(0, 0.3, molecule.coordinates.shape)
+                formed, broken = tracker.update(coordinates)
+                expected = MolecularGraph.from_geometry(Molecule(molecule.numbers, coordinates), do_orders=True)
+                self.assertEqual(set(tracker.graph.edges), set(expected.edges))
+                edges -= set(frozenset(edge) for edge in broken)
+                edges |= set(frozenset(edge) for edge in formed)
+                self.assertEqual(edges, set(tracker.graph.edges))
+
+    def test_topology_tracker_hysteresis(self):
+        from molmod.bonds import bonds
+        length = bonds.get_length(1, 1)
+        molecule = Molecule([1, 1], np.array([[0.0, 0.0, 0.0], [length, 0.0, 0.0]]))
+        tracker = TopologyTracker(molecule, hysteresis=0.1)
+        self.assertEqual(tracker.graph.num_edges, 1)
+        scales = [1.0, 1.1, 1.25, 1.3, 1.25, 1.35, 1.3, 1.1, 1.25, 1.0]
+        frames = [np.array([[0.0, 0.0, 0.0], [scale*length, 0.0, 0.0]]) for scale in scales]
+        events = list(tracker.iter_events(frames))
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0][0], 5)
+        self.assertEqual(events[0][1].tolist(), [])
+        self.assertEqual(events[0][2].tolist(), [[0, 1]])
+        self.assertEqual(events[0][3].num_edges, 0)
+        self.assertEqual(events[1][0], 7)
+        self.assertEqual(events[1][1].tolist(), [[0, 1]])
+        self.assertEqual(events[1][2].tolist(), [])
+        self.assertEqual(events[1][3].num_edges, 1)
+
     def test_fingerprints(self):
         for mol in self.iter_molecules():
             g0 = mol.graph
@@ -444,23 +527,56 @@ class MolecularGraphTestCase(unittest.TestCase):
             self.assertEqual(len(match), g.num_vertices)
 
     def test_canonical_order(self):
-        # TODO: analogous tests voor pure graphs + fixen
         for molecule in self.iter_molecules():
-            try:
-                g0 = molecule.graph
-                order0 = g0.canonical_order
-                g0_bis = g0.get_subgraph(order0, normalize=True)
-
-                permutation = np.random.permutation(g0.num_vertices)
-                g1 = g0.get_subgraph(permutation, normalize=True)
-                order1 = g1.canonical_order
-                g1_bis = g1.get_subgraph(order1, normalize=True)
-
-                self.assertEqual(str(g0_bis), str(g1_bis))
-                self.assert_((g0_bis.numbers==g1_bis.numbers).all())
-                self.assert_((g0_bis.orders==g1_bis.orders).all())
-            except NotImplementedError:
-                pass
+            g0 = molecule.graph
+            order0 = g0.canonical_order
+            g0_bis = g0.get_subgraph(order0, normalize=True)
+
+            permutation = np.random.permutation(g0.num_vertices)
+            g1 = g0.get_subgraph(permutation, normalize=True)
+            order1 = g1.canonical_order
+            g1_bis = g1.get_subgraph(order1, normalize=True)
+
+            self.assertEqual(str(g0_bis), str(g1_bis))
+            self.assert_((g0_bis.numbers==g1_bis.numbers).all())
+            self.assert_((g0_bis.orders==g1_bis.orders).all())
+            self.assertEqual(g0.canonical_hash, g1.canonical_hash)
+
+    def test_canonical_hash(self):
+        # all test molecules are different
+        hashes = [molecule.graph.canonical_hash for molecule in self.iter_molecules()]
+        self.assertEqual(len(hashes), len(set(hashes)))
+        # ethane and ethene only differ in the number of hydrogens
+        ethane = self.load_molecule("ethane.xyz").graph
+        ethene = self.load_molecule("ethene.xyz").graph
+        self.assertNotEqual(ethane.canonical_hash, ethene.canonical_hash)
+        # same connectivity, different atom numbers
+        graph0 = MolecularGraph([(0, 1), (1, 2)], [8, 6, 8])
+        graph1 = MolecularGraph([(0, 1), (1, 2)], [6, 8, 8])
+        self.assertNotEqual(graph0.canonical_hash, graph1.canonical_hash)
+
+    def test_canonical_hash_many_components(self):
+        # 30 disjoint water molecules must not trigger a search over all
+        # permutations of the identical components.
+        import time
+        edges = [(3*i, 3*i+j) for i in range(30) for j in (1, 2)]
+        g0 = MolecularGraph(edges, [8, 1, 1]*30)
+        start = time.time()
+        hash0 = g0.canonical_hash
+        self.assert_(time.time() - start < 2.0)
+        permutation = np.random.permutation(g0.num_vertices)
+        g1 = g0.get_subgraph(permutation, normalize=True)
+        self.assertEqual(g1.canonical_hash, hash0)
+        # components with the same connectivity but different atom numbers
+        numbers = [8, 1, 1]*15 + [16, 1, 1]*15
+        g2 = MolecularGraph(edges, numbers)
+        g3 = g2.get_subgraph(permutation, normalize=True)
+        self.assertEqual(g2.canonical_hash, g3.canonical_hash)
+        self.assertNotEqual(g2.canonical_hash, hash0)
+        g2_bis = g2.get_subgraph(g2.canonical_order, normalize=True)
+        g3_bis = g3.get_subgraph(g3.canonical_order, normalize=True)
+        self.assertEqual(str(g2_bis), str(g3_bis))
+        self.assert_((g2_bis.numbers == g3_bis.numbers).all())
 
     def test_blob(self):
         for molecule in self.iter_molecules(allow_multi=True):
@@ -33,7 +33,7 @@ from molmod.test.common import BaseTestCase
 from molmod import *
 
 
-__all__ = ["PairFFTestCase", "CoulombFFTestCase"]
+__all__ = ["PairFFTestCase", "SparsePairFFTestCase", "CoulombFFTestCase", "EwaldCoulombFFTestCase"]
 
 
 class Debug1FF(PairFF):
@@ -245,6 +245,34 @@ class PairFFTestCase(unittest.TestCase):
     def test_debug4ff(self):
         self.check_ff(self.make_debug4ff())
 
+    def check_vectorized(self, ff):
+        self.assertTrue(ff.vectorized)
+        energy = ff.energy()
+        gradient = ff.gradient()
+        hessian = ff.hessian()
+        ff.vectorized = False
+        self.assertAlmostEqual(energy, ff.energy(), 10)
+        assert abs(gradient - ff.gradient()).max() < 1e-10
+        assert abs(hessian - ff.hessian()).max() < 1e-10
+
+    def test_vectorized_coulombff_c(self):
+        self.check_vectorized(self.make_coulombff(True, False))
+
+    def test_vectorized_coulombff_d(self):
+        self.check_vectorized(self.make_coulombff(False, True))
+
+    def test_vectorized_coulombff_cd(self):
+        self.check_vectorized(self.make_coulombff(True, True))
+
+    def test_vectorized_dispersionff(self):
+        self.check_vectorized(self.make_dispersionff())
+
+    def test_vectorized_pauliff(self):
+        self.check_vectorized(self.make_pauliff())
+
+    def test_vectorized_exprepff(self):
+        self.check_vectorized(self.make_exprepff())
+
     def check_ff(self, ff):
         coordinates = ff.coordinates
         numc = len(coordinates)
@@ -386,6 +414,139 @@ class PairFFTestCase(unittest.TestCase):
         self.assertAlmostEqual(error, 0.0, 3, "2b) The off-diagonal blocks of the analytical hessian are incorrect: % 12.8f / %12.8f" % (error, reference))
 
 
+class SparsePairFFTestCase(unittest.TestCase):
+    def make_system(self, size=30):
+        np.random.seed(5)
+        coordinates = np.random.uniform(0, 6, (size, 3))
+        charges = np.random.normal(0, 1, size)
+        dipoles = np.random.normal(0, 0.3, (size, 3))
+        # a few excluded and scaled pairs
+        pairs = np.array([[1, 0], [2, 0], [2, 1], [7, 3], [4, 12]])
+        factors = np.array([0.0, 0.0, 0.5, 0.2, 0.0])
+        return coordinates, charges, dipoles, pairs, factors
+
+    def make_dense_scaling(self, coordinates, pairs, factors, cutoff):
+        size = len(coordinates)
+        scaling = np.ones((size, size), float)
+        scaling[pairs[:, 0], pairs[:, 1]] = factors
+        scaling[pairs[:, 1], pairs[:, 0]] = factors
+        distances = np.sqrt(((coordinates[:, np.newaxis] - coordinates)**2).sum(axis=2))
+        scaling[distances >= cutoff] = 0.0
+        return scaling
+
+    def check_sparse(self, ff_sparse, ff_dense):
+        self.assertTrue(ff_sparse.sparse)
+        self.assertFalse(ff_dense.sparse)
+        self.assertAlmostEqual(ff_sparse.energy(), ff_dense.energy(), 10)
+        assert abs(ff_sparse.gradient() - ff_dense.gradient()).max() < 1e-10
+        hessian = ff_sparse.hessian()
+        self.assertEqual(hessian.shape, (3*ff_sparse.numc, 3*ff_sparse.numc))
+        self.assertEqual(hessian.blocksize, (3, 3))
+        assert abs(hessian.toarray() - ff_dense.hessian_flat()).max() < 1e-10
+
+    def test_coulombff(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        cutoff = 3.0
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, cutoff)
+        ff_sparse = CoulombFF((pairs, factors), charges, dipoles, coordinates, cutoff=cutoff)
+        ff_dense = CoulombFF(scaling, charges, dipoles, coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+
+    def test_dispersionff(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        strengths = np.outer(abs(charges), abs(charges))
+        cutoff = 3.0
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, cutoff)
+        ff_sparse = DispersionFF((pairs, factors), strengths, coordinates, cutoff=cutoff)
+        ff_dense = DispersionFF(scaling, strengths, coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+
+    def check_no_square_arrays(self, ff_sparse):
+        size = ff_sparse.numc
+        for value in vars(ff_sparse).values():
+            if isinstance(value, np.ndarray):
+                self.assertLess(value.size, size*size)
+
+    def test_dispersionff_types(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        types = np.arange(len(coordinates)) % 3
+        table = np.array([[1.0, 0.5, 0.2], [0.5, 2.0, 0.7], [0.2, 0.7, 0.3]])
+        cutoff = 3.0
+        ff_sparse = DispersionFF((pairs, factors), (types, table), coordinates, cutoff=cutoff)
+        self.check_no_square_arrays(ff_sparse)
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, cutoff)
+        ff_dense = DispersionFF(scaling, table[types][:, types], coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+        # the type table also works in the dense reference implementation
+        ff_reference = DispersionFF(scaling, (types, table), coordinates, vectorized=False)
+        self.assertAlmostEqual(ff_reference.energy(), ff_dense.energy(), 10)
+
+    def test_exprepff_function(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        atom_As = abs(charges) + 1.0
+        atom_Bs = abs(dipoles).sum(axis=1) + 1.0
+        def As(indexes1, indexes2):
+            return np.sqrt(atom_As[indexes1]*atom_As[indexes2])
+        def Bs(indexes1, indexes2):
+            return 0.5*(atom_Bs[indexes1] + atom_Bs[indexes2])
+        cutoff = 3.0
+        ff_sparse = ExpRepFF((pairs, factors), As, Bs, coordinates, cutoff=cutoff)
+        self.check_no_square_arrays(ff_sparse)
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, cutoff)
+        dense_As = np.sqrt(np.outer(atom_As, atom_As))
+        dense_Bs = 0.5*(atom_Bs[:, np.newaxis] + atom_Bs)
+        ff_dense = ExpRepFF(scaling, dense_As, dense_Bs, coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+
+    def test_dense_scaling_argument(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        cutoff = 2.5
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, 100.0)
+        ff_sparse = CoulombFF(scaling.copy(), charges, None, coordinates, cutoff=cutoff)
+        self.assertEqual(len(ff_sparse.scaling_pairs), len(pairs))
+        ff_dense = CoulombFF(self.make_dense_scaling(coordinates, pairs, factors, cutoff), charges, None, coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+
+    def test_update_coordinates(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        cutoff = 3.0
+        ff_sparse = CoulombFF((pairs, factors), charges, None, coordinates, cutoff=cutoff)
+        coordinates = coordinates + np.random.normal(0, 0.3, coordinates.shape)
+        ff_sparse.update_coordinates(coordinates)
+        scaling = self.make_dense_scaling(coordinates, pairs, factors, cutoff)
+        ff_dense = CoulombFF(scaling, charges, None, coordinates)
+        self.check_sparse(ff_sparse, ff_dense)
+
+    def test_periodic(self):
+        coordinates, charges, dipoles, pairs, factors = self.make_system()
+        unit_cell = UnitCell(np.identity(3, float)*6.0)
+        cutoff = 2.9
+        ff_sparse = DispersionFF((pairs, factors), np.ones((30, 30)), coordinates, cutoff=cutoff, unit_cell=unit_cell)
+        # brute force reference with the minimum image convention
+        energy = 0.0
+        for i in range(len(coordinates)):
+            for j in range(i):
+                delta = unit_cell.shortest_vector(coordinates[i] - coordinates[j])
+                distance = np.linalg.norm(delta)
+                if distance < cutoff:
+                    energy += ff_sparse._lookup_scaling(np.array([i]), np.array([j]))[0]*distance**-6
+        self.assertAlmostEqual(ff_sparse.energy(), energy, 8)
+        # translating an atom over a lattice vector does not change anything
+        gradient = ff_sparse.gradient()
+        coordinates[3] += unit_cell.matrix[:, 1]
+        ff_sparse.update_coordinates(coordinates)
+        self.assertAlmostEqual(ff_sparse.energy(), energy, 8)
+        assert abs(ff_sparse.gradient() - gradient).max() < 1e-10
+
+    def test_exclusion_errors(self):
+        with self.assertRaises(ValueError):
+            CoulombFF((np.array([[1, 0], [0, 1]]), np.array([0.0, 0.0])), cutoff=3.0)
+        with self.assertRaises(TypeError):
+            CoulombFF((np.array([[1, 0]]), np.array([0.0, 0.0])), cutoff=3.0)
+        with self.assertRaises(ValueError):
+            CoulombFF(np.ones((3, 3)), unit_cell=UnitCell(np.identity(3)))
+
+
 class CoulombFFTestCase(BaseTestCase):
     def test_cc1(self):
         coordinates = np.array([
@@ -533,3 +694,186 @@ class CoulombFFTestCase(BaseTestCase):
         ff2 = CoulombFF(scaling, charges=charges, dipoles=dipoles, coordinates=coordinates)
         self.assertArraysAlmostEqual(ff1.gradient()[0], -ff1.efield()[0])
         self.assertArraysAlmostEqual(ff1.gradient()[0], -ff2.efield_point(point))
+
+    def make_random(self):
+        np.random.seed(11)
+        coordinates = np.random.uniform(-2, 2, (7, 3))
+        scaling = 1 - np.identity(7, float)
+        scaling[1, 0] = scaling[0, 1] = 0.0
+        scaling[4, 2] = scaling[2, 4] = 0.5
+        charges = np.random.uniform(-1, 1, 7)
+        dipoles = np.random.uniform(-1, 1, (7, 3))
+        return CoulombFF(scaling, charges=charges, dipoles=dipoles, coordinates=coordinates)
+
+    def test_esp_efield_vectorized(self):
+        ff = self.make_random()
+        esp = ff.esp()
+        efield = ff.efield()
+        ff.vectorized = False
+        self.assertArraysAlmostEqual(esp, ff.esp(), 1e-10)
+        self.assertArraysAlmostEqual(efield, ff.efield(), 1e-10)
+
+    def test_esp_efield_points(self):
+        ff = self.make_random()
+        points = np.random.uniform(-3, 3, (50, 3))
+        esp = ff.esp_points(points)
+        efield = ff.efield_points(points)
+        self.assertEqual(esp.shape, (50,))
+        self.assertEqual(efield.shape, (50, 3))
+        for i in range(len(points)):
+            self.assertAlmostEqual(esp[i], ff.esp_point(points[i]), 10)
+            self.assertArraysAlmostEqual(efield[i], ff.efield_point(points[i]), 1e-10)
+        # charges or dipoles only
+        for charges, dipoles in (ff.charges, None), (None, ff.dipoles):
+            ff_part = CoulombFF(ff.scaling, charges, dipoles, ff.coordinates)
+            esp = ff_part.esp_points(points)
+            for i in range(len(points)):
+                self.assertAlmostEqual(esp[i], ff_part.esp_point(points[i]), 10)
+
+    def test_esp_efield_points_chunks(self):
+        ff = self.make_random()
+        ff.point_chunk_size = 7
+        points = np.random.uniform(-3, 3, (4, 5, 6, 3))
+        esp = ff.esp_points(points)
+        efield = ff.efield_points(points, n_workers=3)
+        self.assertEqual(esp.shape, (4, 5, 6))
+        self.assertEqual(efield.shape, (4, 5, 6, 3))
+        self.assertArraysAlmostEqual(esp.ravel(), ff.esp_points(points.reshape(-1, 3), n_workers=2), 1e-15)
+        self.assertArraysAlmostEqual(efield[1, 2, 3], ff.efield_point(points[1, 2, 3]), 1e-10)
+        self.assertEqual(ff.esp_points(np.zeros((0, 3))).shape, (0,))
+        with self.assertRaises(TypeError):
+            ff.esp_points(np.zeros((5, 2)))
+
+
+class EwaldCoulombFFTestCase(BaseTestCase):
+    def make_rock_salt(self, method, cutoff=1.9, accuracy=1e-10):
+        # 2x2x2 conventional cells with a nearest neighbor distance of one
+        base = np.array([[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]], float)
+        coordinates = []
+        charges = []
+        for offset in np.array(list(np.ndindex(2, 2, 2)))*2.0:
+            for position in base + offset:
+                coordinates.append(position)
+                charges.append(1.0)
+                coordinates.append(position + [1, 0, 0])
+                charges.append(-1.0)
+        coordinates = np.array(coordinates)
+        charges = np.array(charges)
+        unit_cell = UnitCell(np.identity(3, float)*4.0)
+        return CoulombFF(
+            None, charges, coordinates=coordinates, cutoff=cutoff,
+            unit_cell=unit_cell, ewald=method, accuracy=accuracy
+        )
+
+    def make_random(self, method, scaling=None, cutoff=2.0):
+        np.random.seed(7)
+        unit_cell = UnitCell(np.array([
+            [5.0, 0.3, -0.4],
+            [0.0, 4.5, 0.6],
+            [0.2, 0.0, 5.5],
+        ]))
+        coordinates = unit_cell.to_cartesian(np.random.uniform(0, 1, (16, 3)))
+        charges = np.random.normal(0, 1, 16)
+        return CoulombFF(
+            scaling, charges, coordinates=coordinates, cutoff=cutoff,
+            unit_cell=unit_cell, ewald=method, accuracy=1e-10
+        )
+
+    def test_madelung_ewald(self):
+        ff = self.make_rock_salt("ewald")
+        self.assertAlmostEqual(ff.energy()/32, -1.747564594633, 9)
+        self.assertArraysAlmostEqual(ff.gradient(), np.zeros((64, 3)), 1e-10, doabs=True)
+        self.assertArraysAlmostEqual(ff.esp(), -1.747564594633*ff.charges, 1e-9)
+
+    def test_madelung_spme(self):
+        ff = self.make_rock_salt("spme")
+        self.assertAlmostEqual(ff.energy()/32, -1.747564594633, 6)
+        self.assertArraysAlmostEqual(ff.esp(), -1.747564594633*ff.charges, 1e-6)
+
+    def test_cutoff_independence(self):
+        # The result does not depend on the splitting parameter.
+        for method in "ewald", "spme":
+            energy1 = self.make_random(method, cutoff=1.5).energy()
+            energy2 = self.make_random(method, cutoff=2.2).energy()
+            self.assertAlmostEqual(energy1, energy2, 6)
+
+    def test_spme_ewald(self):
+        ff_ewald = self.make_random("ewald")
+        ff_spme = self.make_random("spme")
+        self.assertAlmostEqual(ff_ewald.energy(), ff_spme.energy(), 6)
+        self.assertArraysAlmostEqual(ff_ewald.gradient(), ff_spme.gradient(), 1e-6)
+        self.assertArraysAlmostEqual(ff_ewald.esp(), ff_spme.esp(), 1e-6)
+        point = np.array([1.0, 2.0, 3.0])
+        self.assertAlmostEqual(ff_ewald.esp_point(point), ff_spme.esp_point(point), 6)
+
+    def test_gradient(self):
+        for method in "ewald", "spme":
+            ff = self.make_random(method, (np.array([[1, 0], [5, 3]]), np.array([0.0, 0.5])))
+            coordinates = ff.coordinates.copy()
+            energy = ff.energy()
+            gradient = ff.gradient()
+            eps = 1e-6
+            for i in 0, 1, 3, 9:
+                for c in range(3):
+                    coordinates_eps = coordinates.copy()
+                    coordinates_eps[i, c] += eps
+                    ff.update_coordinates(coordinates_eps)
+                    self.assertAlmostEqual((ff.energy() - energy)/eps, gradient[i, c], 4)
+            ff.update_coordinates(coordinates)
+
+    def test_esp_charge_derivative(self):
+        ff = self.make_random("ewald", (np.array([[1, 0], [5, 3]]), np.array([0.0, 0.5])))
+        energy = ff.energy()
+        esp = ff.esp()
+        charges = ff.charges.copy()
+        eps = 1e-6
+        for i in range(len(charges)):
+            ff.charges = charges.copy()
+            ff.charges[i] += eps
+            self.assertAlmostEqual((ff.energy() - energy)/eps, esp[i], 4)
+
+    def test_exclusion(self):
+        ff_full = self.make_random("ewald")
+        ff_excl = self.make_random("ewald", (np.array([[1, 0]]), np.array([0.0])))
+        delta = ff_full.unit_cell.shortest_vector(ff_full.coordinates[1] - ff_full.coordinates[0])
+        expected = ff_full.energy() - ff_full.charges[0]*ff_full.charges[1]/np.linalg.norm(delta)
+        self.assertAlmostEqual(ff_excl.energy(), expected, 9)
+
+    def test_efield_point(self):
+        ff = self.make_random("ewald")
+        eps = 1e-6
+        for i in range(5):
+            point = np.random.uniform(0, 5, 3)
+            efield0 = ff.efield_point(point)
+            for j in range(3):
+                point_plus = point.copy()
+                point_plus[j] += eps
+                point_min = point.copy()
+                point_min[j] -= eps
+                self.assertAlmostEqual(-efield0[j], (ff.esp_point(point_plus) - ff.esp_point(point_min))/(2*eps), 6)
+
+    def test_esp_efield_points(self):
+        ff = self.make_random("spme")
+        ff.point_chunk_size = 4
+        points = np.random.uniform(0, 5, (10, 3))
+        esp = ff.esp_points(points, n_workers=2)
+        efield = ff.efield_points(points)
+        for i in range(len(points)):
+            self.assertAlmostEqual(esp[i], ff.esp_point(points[i]), 10)
+            self.assertArraysAlmostEqual(efield[i], ff.efield_point(points[i]), 1e-10)
+
+    def test_efield_atoms(self):
+        ff = self.make_random("ewald")
+        self.assertArraysAlmostEqual(ff.gradient(), -ff.charges[:, np.newaxis]*ff.efield(), 1e-10)
+
+    def test_errors(self):
+        unit_cell = UnitCell(np.identity(3, float)*4.0)
+        charges = np.ones(2)
+        with self.assertRaises(ValueError):
+            CoulombFF(None, charges, unit_cell=unit_cell, ewald="ewald")
+        with self.assertRaises(ValueError):
+            CoulombFF(None, charges, cutoff=3.0, unit_cell=unit_cell, ewald="ewald")
+        with self.assertRaises(ValueError):
+            CoulombFF(None, charges, cutoff=1.0, unit_cell=unit_cell, ewald="foo")
+        with self.assertRaises(NotImplementedError):
+            CoulombFF(None, charges, np.ones((2, 3)), cutoff=1.0, unit_cell=unit_cell, ewald="ewald")
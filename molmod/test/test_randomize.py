@@ -25,6 +25,7 @@
 from builtins import range
 import os
 
+import numpy as np
 import pkg_resources
 
 from molmod.test.common import *
@@ -95,3 +96,18 @@ class RandomizeTestCase(BaseTestCase):
                 self.assertEqual(mol_transformation.affected_atoms, check_transformation.affected_atoms)
                 self.assertArraysAlmostEqual(mol_transformation.transformation.r, check_transformation.transformation.r, 1e-5, doabs=True)
                 self.assertArraysAlmostEqual(mol_transformation.transformation.t, check_transformation.transformation.t, 1e-5, doabs=True)
+
+    def test_check_nonbond(self):
+        for molecule in self.iter_test_molecules():
+            for i in range(20):
+                coordinates = molecule.coordinates + np.random.normal(0, 0.3*angstrom, molecule.coordinates.shape)
+                distorted = molecule.copy_with(coordinates=coordinates)
+                # brute force reference
+                expected = True
+                for atom1 in range(molecule.size):
+                    for atom2 in range(atom1):
+                        if molecule.graph.distances[atom1, atom2] > 2:
+                            distance = np.linalg.norm(coordinates[atom1] - coordinates[atom2])
+                            if distance < nonbond_thresholds[frozenset([molecule.numbers[atom1], molecule.numbers[atom2]])]:
+                                expected = False
+                self.assertEqual(check_nonbond(distorted, nonbond_thresholds), expected)
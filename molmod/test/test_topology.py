@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# MolMod is a collection of molecular modelling tools for python.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MolMod.
+#
+# MolMod is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# MolMod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+import unittest
+
+import pkg_resources
+
+from molmod import *
+
+
+__all__ = ["TopologyTestCase"]
+
+
+class TopologyTestCase(unittest.TestCase):
+    def iter_graphs(self):
+        fns = [
+            "water.xyz", "cyclopentane.xyz", "ethene.xyz", "funny.xyz",
+            "tea.xyz", "tpa.xyz", "thf_single.xyz", "precursor.xyz",
+            "formol.xyz", "example.sdf", "SID_55127927.sdf",
+        ]
+        for fn in fns:
+            molecule = Molecule.from_file(pkg_resources.resource_filename(__name__, "../data/test/" + fn))
+            if molecule.graph is None:
+                molecule.set_default_graph()
+            yield molecule.graph
+        yield Graph([(0, 1), (1, 2), (2, 0), (2, 3)])
+        yield Graph([(0, 1), (2, 3)], 6)
+
+    def check_terms(self, terms, pattern, graph, normalize):
+        expected = set([])
+        for match in GraphSearch(pattern)(graph):
+            expected.add(normalize(tuple(match.forward[i] for i in range(len(match)))))
+        rows = [tuple(row) for row in terms.tolist()]
+        self.assertEqual(rows, sorted(rows))
+        self.assertEqual(set(rows), expected)
+        self.assertEqual(len(rows), len(expected))
+
+    def test_bonds(self):
+        for graph in self.iter_graphs():
+            self.check_terms(
+                get_bonds(graph), BondPattern([CriteriaSet()]), graph,
+                lambda row: tuple(sorted(row))
+            )
+
+    def test_bends(self):
+        for graph in self.iter_graphs():
+            self.check_terms(
+                get_bends(graph), BendingAnglePattern([CriteriaSet()]), graph,
+                lambda row: row if row[0] < row[2] else row[::-1]
+            )
+
+    def test_dihedrals(self):
+        for graph in self.iter_graphs():
+            self.check_terms(
+                get_dihedrals(graph), DihedralAnglePattern([CriteriaSet()]), graph,
+                lambda row: row if row[1] < row[2] else row[::-1]
+            )
+
+    def test_impropers(self):
+        for graph in self.iter_graphs():
+            pattern = OutOfPlanePattern([CriteriaSet(
+                vertex_criteria={0: HasNumNeighbors(3)},
+            )], vertex_tags={1: 1})
+            self.check_terms(
+                get_impropers(graph), pattern, graph,
+                lambda row: row[:2] + tuple(sorted(row[2:]))
+            )
+            pattern = OutOfPlanePattern([CriteriaSet()], vertex_tags={1: 1})
+            self.check_terms(
+                get_impropers(graph, None), pattern, graph,
+                lambda row: row[:2] + tuple(sorted(row[2:]))
+            )
+
+    def test_shapes_empty(self):
+        graph = Graph([], 3)
+        self.assertEqual(get_bonds(graph).shape, (0, 2))
+        self.assertEqual(get_bends(graph).shape, (0, 3))
+        self.assertEqual(get_dihedrals(graph).shape, (0, 4))
+        self.assertEqual(get_impropers(graph).shape, (0, 4))
@@ -474,6 +474,44 @@ class UnitCellTestCase(BaseTestCase):
         ])
         self.assertArraysAlmostEqual(uc.matrix, expected_matrix)
 
+    def test_reduced(self):
+        for i in range(100):
+            uc = get_random_uc(num_active=np.random.randint(1, 4), min_spacing=0.3)
+            reduced = uc.reduced
+            self.assertArraysEqual(reduced.active, uc.active)
+            self.assertAlmostEqual(reduced.volume, uc.volume)
+            self.assert_(np.linalg.det(reduced.matrix)*np.linalg.det(uc.matrix) > 0)
+            # same lattice
+            for matrix0, cell1 in (reduced.matrix, uc), (uc.matrix, reduced):
+                indexes = cell1.to_fractional(matrix0.transpose()*uc.active[:, np.newaxis])
+                self.assertArraysAlmostEqual(indexes, np.round(indexes), 1e-6, doabs=True)
+            # Minkowski conditions
+            active = uc.active_inactive[0]
+            lengths = np.sqrt((reduced.matrix[:, active]**2).sum(axis=0))
+            for image in reduced.mic_images[1:]:
+                self.assert_(np.linalg.norm(image) >= lengths.min()*(1 - 1e-6))
+
+    def test_shortest_vector_exact(self):
+        for i in range(20):
+            uc = get_random_uc(num_active=np.random.randint(1, 4), min_spacing=0.3)
+            deltas = uc.shortest_vector(np.random.normal(0, 5, (10, 3)))
+            exact = uc.shortest_vector(deltas, exact=True)
+            # brute force comparison
+            radius = np.sqrt((deltas**2).sum(axis=1)).max()
+            ranges = [
+                np.arange(-int(0.5 + radius/spacing) - 1, int(0.5 + radius/spacing) + 2)
+                if active else [0]
+                for active, spacing in zip(uc.active, uc.spacings)
+            ]
+            indexes = np.array(np.meshgrid(*ranges)).reshape(3, -1).transpose()
+            images = uc.to_cartesian(indexes.astype(float))
+            for j in range(10):
+                self.assertArraysAlmostEqual(exact[j], uc.shortest_vector(deltas[j], exact=True))
+                lattice = uc.to_fractional(deltas[j] - exact[j])
+                self.assertArraysAlmostEqual(lattice, np.round(lattice), 1e-6, doabs=True)
+                brute = np.sqrt(((deltas[j] - images)**2).sum(axis=1)).min()
+                self.assertAlmostEqual(np.linalg.norm(exact[j]), brute)
+
     def test_shortest_vector_aperiodic(self):
         unit_cell = UnitCell(np.identity(3, float), np.zeros(3, bool))
         shortest = unit_cell.shortest_vector(np.ones(3, float))
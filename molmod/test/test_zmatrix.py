@@ -26,13 +26,77 @@ import numpy as np
 import pkg_resources
 
 from molmod.test.common import BaseTestCase
+from molmod.vectors import random_orthonormal
 from molmod import *
+import molmod.ic as ic
 
 
 
 __all__ = ["ZMatrixTestCase"]
 
 
+def cart_to_zmat_reference(zmat_gen, coordinates):
+    """Straightforward loop over the atoms, used to validate cart_to_zmat_batch"""
+    N = len(coordinates)
+    result = np.zeros(N, dtype=zmat_gen.dtype)
+    for i in range(N):
+        ref0 = zmat_gen.old_index[i]
+        ref1, ref2, ref3 = zmat_gen.refs[i]
+        rel1, rel2, rel3 = -1, -1, -1
+        distance, angle, dihed = 0, 0, 0
+        if i > 0:
+            distance = np.linalg.norm(coordinates[ref0] - coordinates[ref1])
+            rel1 = i - zmat_gen.new_index[ref1]
+        if i > 1:
+            angle, = ic.bend_angle(coordinates[[ref0, ref1, ref2]])
+            rel2 = i - zmat_gen.new_index[ref2]
+        if i > 2:
+            dihed, = ic.dihed_angle(coordinates[[ref0, ref1, ref2, ref3]])
+            rel3 = i - zmat_gen.new_index[ref3]
+        result[i] = (zmat_gen.graph.numbers[i], distance, rel1, angle, rel2, dihed, rel3)
+    return result
+
+
+def zmat_to_cart_reference(zmat):
+    """Sequential construction of the atoms, used to validate zmat_to_cart_batch"""
+    numbers = zmat["number"]
+    N = len(numbers)
+    coordinates = np.zeros((N, 3), float)
+    coordinates[1, 2] = zmat["distance"][1]
+    if zmat["rel1"][2] == 1:
+        sign = -1
+    else:
+        sign = 1
+    coordinates[2, 2] = zmat["distance"][2]*sign*np.cos(zmat["angle"][2])
+    coordinates[2, 1] = zmat["distance"][2]*sign*np.sin(zmat["angle"][2])
+    coordinates[2] += coordinates[2-zmat["rel1"][2]]
+    for ref0 in range(3, N):
+        number, distance, rel1, angle, rel2, dihed, rel3 = zmat[ref0]
+        ref1 = max(ref0 - rel1, 0)
+        ref2 = max(ref0 - rel2, 0)
+        ref3 = max(ref0 - rel3, 0)
+        origin = coordinates[ref1]
+        new_z = coordinates[ref2] - origin
+        norm_z = np.linalg.norm(new_z)
+        if norm_z < 1e-15:
+            new_z = np.array([0, 0, 1], float)
+        else:
+            new_z /= norm_z
+        new_x = coordinates[ref3] - origin
+        new_x -= np.dot(new_x, new_z)*new_z
+        norm_x = np.linalg.norm(new_x)
+        if norm_x < 1e-15:
+            new_x = random_orthonormal(new_z)
+        else:
+            new_x /= norm_x
+        new_y = -np.cross(new_z, new_x)
+        x = distance*np.cos(dihed)*np.sin(angle)
+        y = distance*np.sin(dihed)*np.sin(angle)
+        z = distance*np.cos(angle)
+        coordinates[ref0] = origin + x*new_x + y*new_y + z*new_z
+    return numbers, coordinates
+
+
 class ZMatrixTestCase(BaseTestCase):
     def test_constency(self):
         def test_one(xyz_fn, checks, reorder=False):
@@ -104,3 +168,34 @@ class ZMatrixTestCase(BaseTestCase):
         ]
         test_one("tpa.xyz", checks)
         test_one("thf_single.xyz", [], reorder=True)
+
+    def test_batch(self):
+        xyz_fns = [
+            "tpa.xyz", "thf_single.xyz", "precursor.xyz", "dopamine.xyz",
+            "octane.xyz", "funny.xyz", "cyclopentane.xyz", "5ringOH.xyz",
+        ]
+        for xyz_fn in xyz_fns:
+            mol = Molecule.from_file(pkg_resources.resource_filename(__name__, "../data/test/" + xyz_fn))
+            mol.set_default_graph()
+            zmat_gen = ZMatrixGenerator(mol.graph)
+            self.assertEqual(zmat_gen.refs.shape, (mol.size, 3))
+            frames = mol.coordinates + np.random.normal(0, 0.1, (5, mol.size, 3))
+            zmats = zmat_gen.cart_to_zmat_batch(frames)
+            self.assertEqual(zmats.shape, (5, mol.size))
+            numbers, coordinates = zmat_to_cart_batch(zmats)
+            self.assertEqual(coordinates.shape, (5, mol.size, 3))
+            for frame, zmat, new_frame in zip(frames, zmats, coordinates):
+                expected = cart_to_zmat_reference(zmat_gen, frame)
+                for field in "number", "rel1", "rel2", "rel3":
+                    self.assertArraysEqual(zmat[field], expected[field])
+                for field in "distance", "angle", "dihed":
+                    self.assertArraysAlmostEqual(zmat[field], expected[field], 1e-10)
+                expected_numbers, expected_frame = zmat_to_cart_reference(zmat)
+                self.assertArraysEqual(numbers, expected_numbers)
+                self.assertArraysAlmostEqual(new_frame, expected_frame, 1e-10)
+                # the internal coordinates are preserved
+                new_zmat = zmat_gen.cart_to_zmat(new_frame[zmat_gen.new_index])
+                for field in "distance", "angle":
+                    self.assertArraysAlmostEqual(new_zmat[field], zmat[field], 1e-8)
+            zmats["rel1"][1, 4] += 1
+            self.assertRaises(ValueError, zmat_to_cart_batch, zmats)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# MolMod is a collection of molecular modelling tools for python.
+# Copyright (C) 2007 - 2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, Center
+# for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all rights
+# reserved unless otherwise stated.
+#
+# This file is part of MolMod.
+#
+# MolMod is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# MolMod is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+"""Enumeration of valence terms in molecular graphs
+
+   The functions in this module list all bonds, bending angles, dihedral
+   angles and improper (out-of-plane) quartets of a graph as integer arrays.
+   They work directly on the compressed sparse row representation of the
+   graph (see :attr:`molmod.graphs.Graph.csr`) and are much faster for large
+   graphs than a :class:`molmod.graphs.GraphSearch` with a
+   :class:`BondPattern`, :class:`BendingAnglePattern`,
+   :class:`DihedralAnglePattern` or :class:`OutOfPlanePattern`.
+
+   The set of terms is the same as with the GraphSearch, but the orientation
+   of each term is different. The GraphSearch returns each term in the
+   orientation in which it was first found, which depends on the order of
+   the search. Here each term is listed once, in a canonical orientation:
+   bonds (i, j) with i < j, bends (i, j, k) with i < k, dihedrals
+   (i, j, k, l) with j < k and impropers (i, j, k, l) with k < l. The rows
+   of the result are sorted.
+"""
+
+
+import numpy as np
+
+
+__all__ = ["get_bonds", "get_bends", "get_dihedrals", "get_impropers"]
+
+
+def _expand(counts):
+    """Enumerate the elements of consecutive groups
+
+       Argument:
+        | ``counts``  --  the number of elements in each group
+
+       Returns: ``groups``, ``locals``. For each element, the index of the
+       group and the position within the group.
+    """
+    groups = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    return groups, np.arange(len(groups)) - offsets[groups]
+
+
+def _sort_rows(rows):
+    """Sort the rows of an integer array lexicographically"""
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+def _get_adjacency(graph):
+    """Return the arrays indptr, indices and degrees of a graph"""
+    indptr, indices = graph.csr[:2]
+    indptr = indptr.astype(int)
+    indices = indices.astype(int)
+    return indptr, indices, indptr[1:] - indptr[:-1]
+
+
+def get_bonds(graph):
+    """Return an (M, 2) array with all bonds (i, j), with i < j"""
+    edges = np.sort(graph.edge_array, axis=1)
+    return _sort_rows(edges.reshape(-1, 2))
+
+
+def get_bends(graph):
+    """Return an (M, 3) array with all bending angles (i, j, k), with i < k
+
+       The central atom j is bonded to both i and k.
+    """
+    indptr, indices, degrees = _get_adjacency(graph)
+    # all pairs of positions within the neighbors of each center
+    centers, positions = _expand(degrees**2)
+    first = positions//degrees[centers]
+    second = positions%degrees[centers]
+    mask = first < second
+    centers = centers[mask]
+    first = indices[indptr[centers] + first[mask]]
+    second = indices[indptr[centers] + second[mask]]
+    # neighbors are sorted, so first < second
+    return _sort_rows(np.array([first, centers, second]).T.reshape(-1, 3))
+
+
+def get_dihedrals(graph):
+    """Return an (M, 4) array with all dihedral angles (i, j, k, l), with j < k
+
+       The atoms j and k form the central bond, i is bonded to j and l is bonded
+       to k. All four atoms are different.
+    """
+    indptr, indices, degrees = _get_adjacency(graph)
+    centrals = np.sort(graph.edge_array, axis=1).reshape(-1, 2)
+    degrees1 = degrees[centrals[:, 0]]
+    degrees2 = degrees[centrals[:, 1]]
+    bonds, positions = _expand(degrees1*degrees2)
+    atoms1 = centrals[bonds, 0]
+    atoms2 = centrals[bonds, 1]
+    atoms0 = indices[indptr[atoms1] + positions//degrees2[bonds]]
+    atoms3 = indices[indptr[atoms2] + positions%degrees2[bonds]]
+    mask = (atoms0 != atoms2) & (atoms3 != atoms1) & (atoms0 != atoms3)
+    result = np.array([atoms0, atoms1, atoms2, atoms3]).T[mask]
+    return _sort_rows(result.reshape(-1, 4))
+
+
+def get_impropers(graph, num_neighbors=3):
+    """Return an (M, 4) array with improper quartets (i, j, k, l), with k < l
+
+       The central atom i is bonded to j, k and l. Each neighbor of the
+       central atom appears once in the second column, such that there are
+       three improper quartets for a central atom with three neighbors.
+
+       Optional argument:
+        | ``num_neighbors``  --  only central atoms with this number of
+                                neighbors are included. When None, all atoms
+                                with at least three neighbors are included.
+                                [default=3]
+    """
+    indptr, indices, degrees = _get_adjacency(graph)
+    if num_neighbors is None:
+        centers = (degrees >= 3).nonzero()[0]
+    else:
+        centers = (degrees == num_neighbors).nonzero()[0]
+    sizes = degrees[centers]
+    # all triples of positions within the neighbors of each center
+    groups, positions = _expand(sizes**3)
+    size = sizes[groups]
+    first = positions//(size*size)
+    second = (positions//size)%size
+    third = positions%size
+    mask = (first != second) & (first != third) & (second < third)
+    centers = centers[groups[mask]]
+    offsets = indptr[centers]
+    result = np.array([
+        centers, indices[offsets + first[mask]], indices[offsets + second[mask]],
+        indices[offsets + third[mask]]
+    ]).T
+    return _sort_rows(result.reshape(-1, 4))
@@ -34,6 +34,7 @@ import pkg_resources
 
 from molmod.molecules import Molecule
 from molmod.periodic import periodic
+from molmod.topology import get_bends
 from molmod.ext import ff_dm_quad, ff_dm_reci, ff_bond_quad, ff_bond_hyper
 
 
@@ -198,49 +199,53 @@ class ToyFF(object):
 
         special_angles = SpecialAngles()
 
-        span_edges = []
-        span_lengths = []
-        for i, neighbors in graph.neighbors.items():
+        def get_default_angle(i):
+            """The default bending angle for a central atom"""
             number_i = graph.numbers[i]
             if (number_i >= 5 and number_i <=8):
-                valence = len(neighbors) + abs(number_i-6)
+                valence = num_neighbors[i] + abs(number_i-6)
             elif number_i >= 13 and number_i <= 16:
-                valence = len(neighbors) + abs(number_i-14)
+                valence = num_neighbors[i] + abs(number_i-14)
             else:
                 valence = -1
             if valence < 2 or valence > 6:
-                default_angle = np.pi/180.0*115.0
+                return np.pi/180.0*115.0
             elif valence == 2:
-                default_angle = np.pi
+                return np.pi
             elif valence == 3:
-                default_angle = np.pi/180.0*125.0
+                return np.pi/180.0*125.0
             elif valence == 4:
-                default_angle = np.pi/180.0*109.0
+                return np.pi/180.0*109.0
             elif valence == 5:
-                default_angle = np.pi/180.0*100.0
+                return np.pi/180.0*100.0
             elif valence == 6:
-                default_angle = np.pi/180.0*90.0
-            for j in neighbors:
-                number_j = graph.numbers[j]
-                for k in neighbors:
-                    if j < k and not frozenset([j, k]) in graph.edges:
-                        number_k = graph.numbers[k]
-
-                        triplet = (
-                            number_j, len(graph.neighbors[j]),
-                            number_i, len(graph.neighbors[i]),
-                            number_k, len(graph.neighbors[k]),
-                        )
-
-                        angle = special_angles.get_angle(triplet)
-                        if angle is None:
-                            angle = default_angle
-
-                        dj = bonds.get_length(number_i, number_j)
-                        dk = bonds.get_length(number_i, number_k)
-                        d = np.sqrt(dj**2+dk**2-2*dj*dk*np.cos(angle))
-                        span_edges.append((j, k))
-                        span_lengths.append(d)
+                return np.pi/180.0*90.0
+
+        num_neighbors = np.diff(graph.csr[0]).tolist()
+        span_edges = []
+        span_lengths = []
+        for j, i, k in get_bends(graph).tolist():
+            if frozenset([j, k]) in graph.edge_index:
+                continue
+            number_i = graph.numbers[i]
+            number_j = graph.numbers[j]
+            number_k = graph.numbers[k]
+
+            triplet = (
+                number_j, num_neighbors[j],
+                number_i, num_neighbors[i],
+                number_k, num_neighbors[k],
+            )
+
+            angle = special_angles.get_angle(triplet)
+            if angle is None:
+                angle = get_default_angle(i)
+
+            dj = bonds.get_length(number_i, number_j)
+            dk = bonds.get_length(number_i, number_k)
+            d = np.sqrt(dj**2+dk**2-2*dj*dk*np.cos(angle))
+            span_edges.append((j, k))
+            span_lengths.append(d)
         self.span_edges = np.array(span_edges, int)
         self.span_lengths = np.array(span_lengths, float)
 
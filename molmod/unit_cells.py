@@ -26,6 +26,8 @@
 from __future__ import division
 
 from builtins import range
+import itertools
+
 import numpy as np
 
 from molmod.utils import cached, ReadOnly, ReadOnlyAttribute
@@ -245,6 +247,57 @@ class UnitCell(ReadOnly):
                 result[i] = result_invsq[i]**(-0.5)
         return result
 
+    @cached
+    def reduced(self):
+        """An equivalent unit cell with a Minkowski-reduced basis
+
+           The active cell vectors are replaced by the shortest vectors that
+           span the same lattice. (The conditions for a Minkowski-reduced
+           basis only involve coefficients -1, 0 and 1 for lattices with up
+           to three dimensions.) The inactive cell vectors are not changed.
+           Such a basis is a prerequisite for an exact minimum image
+           convention, see :meth:`shortest_vector`.
+        """
+        active = self.active_inactive[0]
+        vectors = [self.matrix[:, index].copy() for index in active]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(vectors)):
+                others = [vectors[j] for j in range(len(vectors)) if j != i]
+                # Gauss reduction with the other vectors
+                for other in others:
+                    factor = np.round(np.dot(vectors[i], other)/np.dot(other, other))
+                    candidate = vectors[i] - factor*other
+                    if np.dot(candidate, candidate) < np.dot(vectors[i], vectors[i])*(1 - self.eps):
+                        vectors[i] = candidate
+                        changed = True
+                # Minkowski conditions
+                for coeffs in itertools.product([-1, 0, 1], repeat=len(others)):
+                    candidate = vectors[i] + sum(c*o for c, o in zip(coeffs, others))
+                    if np.dot(candidate, candidate) < np.dot(vectors[i], vectors[i])*(1 - self.eps):
+                        vectors[i] = candidate
+                        changed = True
+        vectors.sort(key=np.linalg.norm)
+        matrix = self.matrix.copy()
+        for index, vector in zip(active, vectors):
+            matrix[:, index] = vector
+        # preserve the handedness of the original cell
+        if len(active) > 0 and np.linalg.det(matrix)*np.linalg.det(self.matrix) < 0:
+            matrix[:, active[-1]] *= -1
+        return self.copy_with(matrix=matrix)
+
+    @cached
+    def mic_images(self):
+        """The lattice vectors of the neighboring images of the central cell
+
+           This is an Kx3 array with all integer combinations of the active
+           cell vectors with coefficients -1, 0 and 1. The first row is the
+           zero vector.
+        """
+        ranges = [[0, -1, 1] if active else [0] for active in self.active]
+        return self.to_cartesian(np.array(list(itertools.product(*ranges)), float))
+
     def to_fractional(self, cartesian):
         """Convert Cartesian to fractional coordinates
 
@@ -269,21 +322,40 @@ class UnitCell(ReadOnly):
         """
         return np.dot(fractional, self.matrix.transpose())
 
-    def shortest_vector(self, delta):
+    def shortest_vector(self, delta, exact=False):
         """Compute the relative vector under periodic boundary conditions.
 
            Argument:
-            | ``delta``  --  the relative vector between two points
+            | ``delta``  --  the relative vector between two points, or an
+                             array with shape (N, 3) with relative vectors.
 
-           The return value is not necessarily the shortest possible vector,
-           but instead is the vector with fractional coordinates in the range
-           [-0.5,0.5[. This is most of the times the shortest vector between
-           the two points, but not always. (See commented test.) It is always
-           the shortest vector for orthorombic cells.
+           Optional argument:
+            | ``exact``  --  When True, the exact minimum image is computed.
+                             [default=False]
+
+           By default, the return value is not necessarily the shortest
+           possible vector, but instead is the vector with fractional
+           coordinates in the range [-0.5,0.5[. This is most of the times the
+           shortest vector between the two points, but not always. (See
+           commented test.) It is always the shortest vector for orthorombic
+           cells.
+
+           When ``exact`` is True, the relative vector is first wrapped in the
+           Minkowski-reduced cell (see :attr:`reduced`). The shortest vector
+           is then found among the neighboring images in the reduced cell
+           (see :attr:`mic_images`), which is exact for all cell shapes.
         """
-        fractional = self.to_fractional(delta)
-        fractional = np.floor(fractional + 0.5)
-        return delta - self.to_cartesian(fractional)
+        if not exact:
+            fractional = self.to_fractional(delta)
+            fractional = np.floor(fractional + 0.5)
+            return delta - self.to_cartesian(fractional)
+        reduced = self.reduced
+        wrapped = reduced.shortest_vector(np.asarray(delta, float))
+        candidates = wrapped[..., np.newaxis, :] - reduced.mic_images
+        best = (candidates*candidates).sum(axis=-1).argmin(axis=-1)
+        return np.take_along_axis(
+            candidates, best[..., np.newaxis, np.newaxis], axis=-2
+        )[..., 0, :]
 
     def add_cell_vector(self, vector):
         """Returns a new unit cell with an additional cell vector"""
@@ -368,8 +440,8 @@ class UnitCell(ReadOnly):
         indexes = np.zeros((max_size, 3), int)
 
         from molmod.ext import unit_cell_get_radius_indexes
-        reciprocal = self.reciprocal*self.active
-        matrix = self.matrix*self.active
+        reciprocal = np.ascontiguousarray(self.reciprocal*self.active)
+        matrix = np.ascontiguousarray(self.matrix*self.active)
         size = unit_cell_get_radius_indexes(
             matrix, reciprocal, radius, max_ranges, indexes
         )
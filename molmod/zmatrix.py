@@ -27,10 +27,11 @@ from builtins import range
 import numpy as np
 
 import molmod.ic as ic
+from molmod.utils import cached
 from molmod.vectors import random_orthonormal
 
 
-__all__ = ["ZMatrixGenerator", "zmat_to_cart"]
+__all__ = ["ZMatrixGenerator", "zmat_to_cart", "zmat_to_cart_batch"]
 
 
 class ZMatrixGenerator(object):
@@ -63,11 +64,16 @@ class ZMatrixGenerator(object):
         # to one of the previous atoms. It is the user's responsability to make
         # sure that heavier atoms come first.
         new_order = [0]
+        placed = np.zeros(graph.num_vertices, bool)
+        placed[0] = True
+        def is_bonded_to_placed(i):
+            return any(placed[n] for n in graph.neighbors[i])
         # We will try to take the original order as long as it satisfies the
         # constraint.
         for i in range(1, graph.num_vertices):
-            if (graph.distances[i][new_order] == 1).any():
+            if is_bonded_to_placed(i):
                 new_order.append(i)
+                placed[i] = True
             else:
                 break
         # If not all atoms are listed in new_order, we continue adding the
@@ -76,8 +82,9 @@ class ZMatrixGenerator(object):
         remaining = list(range(len(new_order), graph.num_vertices))
         while len(remaining) > 0:
             pivot = remaining.pop()
-            if (graph.distances[pivot][new_order] == 1).any():
+            if is_bonded_to_placed(pivot):
                 new_order.append(pivot)
+                placed[pivot] = True
             else:
                 remaining.insert(0, pivot)
         # store the orders as indexes
@@ -117,6 +124,24 @@ class ZMatrixGenerator(object):
                 return result
         raise RuntimeError("Could not find new reference.")
 
+    @cached
+    def refs(self):
+        """The reference atoms of each row in the ZMatrix
+
+           An integer array with shape (N, 3). Row i contains the (original)
+           indexes of the atoms that define the distance, the angle and the
+           dihedral angle of atom old_index[i]. Unused references are -1.
+        """
+        N = self.graph.num_vertices
+        result = np.zeros((N, 3), int) - 1
+        for i in range(1, N):
+            existing_refs = [self.old_index[i]]
+            for j in range(min(i, 3)):
+                ref = self._get_new_ref(existing_refs)
+                result[i, j] = ref
+                existing_refs.append(ref)
+        return result
+
     def cart_to_zmat(self, coordinates):
         """Convert cartesian coordinates to ZMatrix format
 
@@ -129,81 +154,119 @@ class ZMatrixGenerator(object):
         N = len(self.graph.numbers)
         if coordinates.shape != (N, 3):
             raise ValueError("The shape of the coordinates must be (%i, 3)" % N)
-        result = np.zeros(N, dtype=self.dtype)
-        for i in range(N):
-            ref0 = self.old_index[i]
-            rel1 = -1
-            rel2 = -1
-            rel3 = -1
-            distance = 0
-            angle = 0
-            dihed = 0
-            if i > 0:
-                ref1 = self._get_new_ref([ref0])
-                distance = np.linalg.norm(coordinates[ref0]-coordinates[ref1])
-                rel1 = i - self.new_index[ref1]
-            if i > 1:
-                ref2 = self._get_new_ref([ref0, ref1])
-                angle, = ic.bend_angle(coordinates[[ref0, ref1, ref2]])
-                rel2 = i - self.new_index[ref2]
-            if i > 2:
-                ref3 = self._get_new_ref([ref0, ref1, ref2])
-                dihed, = ic.dihed_angle(coordinates[[ref0, ref1, ref2, ref3]])
-                rel3 = i - self.new_index[ref3]
-            result[i] = (self.graph.numbers[i], distance, rel1, angle, rel2, dihed, rel3)
+        return self.cart_to_zmat_batch(coordinates[np.newaxis])[0]
+
+    def cart_to_zmat_batch(self, coordinates):
+        """Convert the cartesian coordinates of many conformers to ZMatrix format
+
+           Argument:
+             coordinates  --  Cartesian coordinates (numpy array FxNx3), with
+                              F the number of conformers
+
+           Returns an array with shape (F, N) and the same dtype as the result
+           of cart_to_zmat. The reference atoms are the same for all
+           conformers.
+        """
+        N = len(self.graph.numbers)
+        if coordinates.ndim != 3 or coordinates.shape[1:] != (N, 3):
+            raise ValueError("The shape of the coordinates must be (F, %i, 3)" % N)
+        result = np.zeros((len(coordinates), N), dtype=self.dtype)
+        result["number"] = self.graph.numbers
+        refs = np.concatenate([self.old_index[:, np.newaxis], self.refs], axis=1)
+        rels = np.arange(N)[:, np.newaxis] - self.new_index[refs[:, 1:]]
+        rels[refs[:, 1:] < 0] = -1
+        result["rel1"] = rels[:, 0]
+        result["rel2"] = rels[:, 1]
+        result["rel3"] = rels[:, 2]
+        if N > 1:
+            result["distance"][:, 1:] = ic.bond_length_batch(coordinates, refs[1:, :2])[0]
+        if N > 2:
+            result["angle"][:, 2:] = ic.bend_angle_batch(coordinates, refs[2:, :3])[0]
+        if N > 3:
+            result["dihed"][:, 3:] = ic.dihed_angle_batch(coordinates, refs[3:])[0]
         return result
 
 
 def zmat_to_cart(zmat):
     """Converts a ZMatrix back to cartesian coordinates."""
+    numbers, coordinates = zmat_to_cart_batch(zmat[np.newaxis])
+    return numbers, coordinates[0]
+
+
+def zmat_to_cart_batch(zmat):
+    """Converts the ZMatrices of many conformers back to cartesian coordinates
 
-    numbers = zmat["number"]
-    N = len(numbers)
-    coordinates = np.zeros((N, 3), float)
+       Argument:
+         zmat  --  an array with shape (F, N) and the dtype of
+                   ZMatrixGenerator, e.g. the result of cart_to_zmat_batch
+
+       All conformers must have the same atom numbers and reference atoms.
+       Returns the atom numbers and an array with shape (F, N, 3) with
+       Cartesian coordinates. Atoms whose reference atoms are already placed
+       are computed together, such that the Python overhead only scales with
+       the depth of the ZMatrix.
+    """
+    numbers = zmat["number"][0]
+    for field in "number", "rel1", "rel2", "rel3":
+        if (zmat[field] != zmat[field][0]).any():
+            raise ValueError("The field %s must be the same for all conformers." % field)
+    F, N = zmat.shape
+    coordinates = np.zeros((F, N, 3), float)
 
     # special cases for the first coordinates
-    coordinates[1, 2] = zmat["distance"][1]
-    if zmat["rel1"][2] == 1:
-        sign = -1
-    else:
-        sign = 1
-    coordinates[2, 2] = zmat["distance"][2]*sign*np.cos(zmat["angle"][2])
-    coordinates[2, 1] = zmat["distance"][2]*sign*np.sin(zmat["angle"][2])
-    coordinates[2] += coordinates[2-zmat["rel1"][2]]
-
-    ref0 = 3
-    for (number, distance, rel1, angle, rel2, dihed, rel3) in zmat[3:]:
-        ref1 = ref0 - rel1
-        ref2 = ref0 - rel2
-        ref3 = ref0 - rel3
-        if ref1 < 0: ref1 = 0
-        if ref2 < 0: ref2 = 0
-        if ref3 < 0: ref3 = 0
-        # define frame axes
-        origin = coordinates[ref1]
-        new_z = coordinates[ref2] - origin
-        norm_z = np.linalg.norm(new_z)
-        if norm_z < 1e-15:
-            new_z = np.array([0, 0, 1], float)
-        else:
-            new_z /= np.linalg.norm(new_z)
-        new_x = coordinates[ref3] - origin
-        new_x -= np.dot(new_x, new_z)*new_z
-        norm_x = np.linalg.norm(new_x)
-        if norm_x < 1e-15:
-            new_x = random_orthonormal(new_z)
+    if N > 1:
+        coordinates[:, 1, 2] = zmat["distance"][:, 1]
+    if N > 2:
+        if zmat["rel1"][0, 2] == 1:
+            sign = -1
         else:
-            new_x /= np.linalg.norm(new_x)
+            sign = 1
+        coordinates[:, 2, 2] = zmat["distance"][:, 2]*sign*np.cos(zmat["angle"][:, 2])
+        coordinates[:, 2, 1] = zmat["distance"][:, 2]*sign*np.sin(zmat["angle"][:, 2])
+        coordinates[:, 2] += coordinates[:, 2-zmat["rel1"][0, 2]]
+    if N <= 3:
+        return numbers, coordinates
+
+    rows = np.arange(3, N)
+    refs = np.array([rows - zmat[field][0, 3:] for field in ("rel1", "rel2", "rel3")]).T
+    refs[refs < 0] = 0
+    # Assign each row to a level, such that all references of a row are in
+    # lower levels.
+    levels = np.zeros(N, int)
+    for row, (ref1, ref2, ref3) in zip(rows, refs):
+        levels[row] = max(levels[ref1], levels[ref2], levels[ref3]) + 1
+    levels = levels[3:]
+    for level in range(1, levels.max() + 1):
+        mask = levels == level
+        ref0 = rows[mask]
+        ref1, ref2, ref3 = refs[mask].T
+        # define frame axes
+        origin = coordinates[:, ref1]
+        new_z = coordinates[:, ref2] - origin
+        norm_z = np.sqrt((new_z**2).sum(axis=2))
+        degenerate = norm_z < 1e-15
+        new_z[degenerate] = [0, 0, 1]
+        norm_z[degenerate] = 1
+        new_z /= norm_z[:, :, np.newaxis]
+        new_x = coordinates[:, ref3] - origin
+        new_x -= (new_x*new_z).sum(axis=2)[:, :, np.newaxis]*new_z
+        norm_x = np.sqrt((new_x**2).sum(axis=2))
+        for iframe, irow in zip(*(norm_x < 1e-15).nonzero()):
+            new_x[iframe, irow] = random_orthonormal(new_z[iframe, irow])
+            norm_x[iframe, irow] = 1
+        new_x /= norm_x[:, :, np.newaxis]
         # we must make our axes frame left handed due to the poor IUPAC
         # definition of the sign of a dihedral angle.
         new_y = -np.cross(new_z, new_x)
 
-        # coordinates of new atom:
+        # coordinates of new atoms:
+        distance = zmat["distance"][:, ref0]
+        angle = zmat["angle"][:, ref0]
+        dihed = zmat["dihed"][:, ref0]
         x = distance*np.cos(dihed)*np.sin(angle)
         y = distance*np.sin(dihed)*np.sin(angle)
         z = distance*np.cos(angle)
-        coordinates[ref0] = origin + x*new_x + y*new_y + z*new_z
-        # loop
-        ref0 += 1
+        coordinates[:, ref0] = origin + x[:, :, np.newaxis]*new_x + \
+            y[:, :, np.newaxis]*new_y + z[:, :, np.newaxis]*new_z
 
     return numbers, coordinates